@@ -0,0 +1,349 @@
+'''
+Recording and animating maze generation.
+
+`Maze.carve_events()` (or `carve_passages_from(..., events=True)`) yields an
+event `(cell, direction)` for every wall the backtracker opens: the flat id of
+a cell and the direction bit of the wall. This module stores event streams as a
+compact delta log and turns them into animated PNGs.
+
+A delta log is a 16-byte little-endian header followed by one varint per event:
+
+    magic      4s   b'MZEV'
+    version    H    VERSION
+    topology   B    index into serialize.TOPOLOGIES
+    reserved   B    0
+    rows       I    number of rows (the side or ring count of other mazes)
+    cols       I    number of columns (0 for other mazes)
+
+An event is stored as the difference between its cell and the previous event's
+cell (0 for the first event), zigzag-encoded to make it non-negative, shifted
+left by 3 bits, with the index of its direction bit in the low 3 bits, as an
+unsigned LEB128 varint. The backtracker mostly steps from a cell to the
+neighbor it just opened, so on grids up to about 1000 cells wide nearly every
+event takes one or two bytes.
+
+Animations start from the fully walled maze. Every frame re-rasterizes only the
+walls around the ones its events opened and is written as the rectangle of
+pixels it changed (see `png_stream.ApngWriter`), so producing a frame costs
+O(changes) whatever the size of the maze.
+'''
+from itertools import islice
+import struct
+
+import numpy as np
+
+import png_stream
+import raster
+import serialize
+
+MAGIC = b'MZEV'
+VERSION = 1
+HEADER = struct.Struct('<4sHBxII')
+
+CHUNK = 1 << 16 # events encoded at a time
+MERGE_SLACK = 64*64 # pixels, see `WallCanvas.frames`
+
+# index of each direction bit, -1 for values that are not a single bit
+_BIT_INDEX = np.full(256, -1, dtype=np.int64)
+_BIT_INDEX[1 << np.arange(8)] = np.arange(8)
+
+'''
+Encode events, given as arrays of cells and direction bits, as the varints of a
+delta log. `previous` is the cell of the event before the first one.
+'''
+def encode_events(cells, directions, previous=0):
+    cells = np.asarray(cells, dtype=np.int64)
+    index = _BIT_INDEX[np.asarray(directions, dtype=np.uint8)]
+    if (index < 0).any():
+        raise ValueError("Every direction must be a single bit")
+
+    delta = np.diff(cells, prepend=np.int64(previous))
+    zigzag = ((delta << 1) ^ (delta >> 63)).view(np.uint64)
+    return _varints((zigzag << np.uint64(3)) | index.astype(np.uint64))
+
+'''
+Decode the varints of a delta log back into arrays of cells (int64) and
+direction bits (uint8), see `encode_events`.
+'''
+def decode_events(data, previous=0):
+    values = _parse_varints(np.frombuffer(data, dtype=np.uint8))
+    directions = (np.uint64(1) << (values & np.uint64(7))).astype(np.uint8)
+    zigzag = values >> np.uint64(3)
+    delta = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    return np.cumsum(delta) + previous, directions
+
+'''
+Write `events` (an iterable of `(cell, direction)`) for `maze` as a delta log to
+`file`, a path or a binary file-like object, encoding them a chunk at a time as
+they come. Returns the number of events written.
+'''
+def write_log(file, maze, events):
+    rows, cols = _dimensions(maze)
+    events = iter(events)
+    count, previous = 0, 0
+    with raster.open_output(file) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, serialize.TOPOLOGIES.index(maze.TOPOLOGY), rows, cols))
+        while True:
+            chunk = np.array(list(islice(events, CHUNK)), dtype=np.int64).reshape(-1, 2)
+            if not len(chunk):
+                return count
+            f.write(encode_events(chunk[:, 0], chunk[:, 1], previous).tobytes())
+            count += len(chunk)
+            previous = int(chunk[-1, 0])
+
+'''
+Read a delta log from `data` (bytes or any buffer). Returns a fully walled maze
+of the logged class and size, and the events as arrays of cells and direction
+bits, ready for `replay` or `write_apng`.
+'''
+def read_log(data):
+    if len(data) < HEADER.size:
+        raise ValueError("Not an event log: too short")
+    magic, version, topology, rows, cols = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an event log: bad magic")
+    if version != VERSION:
+        raise ValueError(f"Unsupported event log version {version}, expected {VERSION}")
+    cells, directions = decode_events(memoryview(data)[HEADER.size:])
+    return _walled(serialize.TOPOLOGIES[topology], rows, cols), cells, directions
+
+'''
+Open the walls named by the events `cells`, `directions` (arrays as returned by
+`read_log`, or any sequences) in `maze`, from both sides.
+'''
+def replay(maze, cells, directions):
+    cells = np.asarray(cells, dtype=np.int64)
+    directions = np.asarray(directions, dtype=np.uint8)
+    adj = maze.adjacency()
+    entries = _entries(adj, cells, directions)
+    if (entries < 0).any():
+        raise ValueError("Event opens a wall on the maze boundary")
+    np.bitwise_or.at(maze.cells, cells, directions)
+    np.bitwise_or.at(maze.cells, adj.neighbors[entries], adj.back[entries])
+    maze.invalidate()
+
+'''
+Incrementally updated image of a maze of the same class and size as `maze`,
+starting with every wall closed. `open()` takes down one wall and redraws the
+pixels around it; `canvas` always holds the picture `wall_geometry` describes
+for the walls opened so far. That is the picture `render_image` draws, except
+that polar mazes get chords where `render_image` draws arcs.
+'''
+class WallCanvas:
+    def __init__(self, maze):
+        walled = _walled(maze.TOPOLOGY, *_dimensions(maze))
+        width, height, polylines, segments, (cells, bits) = walled.wall_geometry(owners=True)
+
+        # segments sorted by the wall they draw, a wall being drawn by one or
+        # more consecutive segments
+        key = cells.astype(np.int64)*8 + _BIT_INDEX[bits]
+        order = np.argsort(key, kind='stable')
+        segments = [np.asarray(v)[order] for v in segments]
+        key = key[order]
+        first = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+        self.wall_segments = np.append(first, len(key)) # wall w: segments [w] to [w + 1]
+
+        # the boundary never changes: keep it as the background under the walls
+        self.background = raster.new_canvas(width, height)
+        for points in polylines:
+            raster.draw_polyline(self.background, points)
+
+        # segment ends truncated like `raster.draw_segments` does, and each
+        # segment's bounding box
+        self.x0, self.y0, self.x1, self.y1 = (np.asarray(v).astype(np.int64) for v in segments)
+        self.left, self.right = np.minimum(self.x0, self.x1), np.maximum(self.x0, self.x1)
+        self.top, self.bottom = np.minimum(self.y0, self.y1), np.maximum(self.y0, self.y1)
+        self.closed = np.ones(len(self.x0), dtype=bool)
+
+        # wall of each (cell, direction bit index) from either side, or -1
+        self.walls = np.full(len(walled.cells) * 8, -1, dtype=np.int32)
+        wall = np.arange(len(first))
+        self.walls[key[first]] = wall
+        adj = walled.adjacency()
+        entries = _entries(adj, key[first] // 8, (1 << (key[first] % 8)).astype(np.uint8))
+        inner = entries >= 0
+        entries = entries[inner]
+        self.walls[adj.neighbors[entries]*8 + _BIT_INDEX[adj.back[entries]]] = wall[inner]
+
+        self.__index_buckets(width, height)
+
+        self.canvas = self.background.copy()
+        raster.draw_segments(self.canvas, self.x0, self.y0, self.x1, self.y1)
+
+    '''
+    Draw the events in groups of `events_per_frame`, yielding one list of
+    changed rectangles per frame as `(x, y, pixels)`, `pixels` being a copy of
+    the canvas under the rectangle.
+
+    A frame's changes are merged into one rectangle while that covers at most
+    twice the pixels of the separate ones plus MERGE_SLACK, so scattered changes
+    (e.g. after the backtracker backs up) become several small rectangles rather
+    than one large one, and nearby ones share a rectangle.
+    '''
+    def frames(self, events, events_per_frame=1):
+        events = iter(events)
+        while True:
+            batch = list(islice(events, events_per_frame))
+            if not batch:
+                return
+
+            rects = [] # (x0, y0, x1, y1, pixels drawn into it)
+            for cell, direction in batch:
+                x0, y0, x1, y1 = self.open(cell, direction)
+                area = (x1 - x0) * (y1 - y0)
+                if rects:
+                    a0, b0, a1, b1, covered = rects[-1]
+                    u0, v0, u1, v1 = min(a0, x0), min(b0, y0), max(a1, x1), max(b1, y1)
+                    if (u1 - u0) * (v1 - v0) <= 2*(covered + area) + MERGE_SLACK:
+                        rects[-1] = (u0, v0, u1, v1, covered + area)
+                        continue
+                rects.append((x0, y0, x1, y1, area))
+
+            yield [(x0, y0, self.canvas[y0:y1, x0:x1].copy()) for x0, y0, x1, y1, _ in rects]
+
+    '''
+    Open the wall of `cell` in `direction` and redraw the pixels it covered.
+    Returns the rectangle of pixels that may have changed as `(x0, y0, x1, y1)`,
+    end exclusive.
+    '''
+    def open(self, cell, direction):
+        index = _BIT_INDEX[direction]
+        wall = self.walls[cell*8 + index] if index >= 0 else -1
+        if wall < 0:
+            raise ValueError(f"Cell {cell} has no inner wall in direction {direction}")
+        a, b = self.wall_segments[wall], self.wall_segments[wall + 1]
+        self.closed[a:b] = False
+
+        rect = (int(self.left[a:b].min()), int(self.top[a:b].min()),
+                int(self.right[a:b].max()) + 1, int(self.bottom[a:b].max()) + 1)
+        self.__redraw(*rect)
+        return rect
+
+    # Reset the rectangle to the background and draw every closed wall that
+    # reaches into it, found through the buckets under the rectangle.
+    def __redraw(self, x0, y0, x1, y1):
+        B = self.bucket
+        buckets = [by*self.buckets_across + bx
+                   for by in range(y0 // B, (y1 - 1) // B + 1)
+                   for bx in range(x0 // B, (x1 - 1) // B + 1)]
+        starts = self.bucket_offsets[buckets]
+        stops = self.bucket_offsets[np.asarray(buckets) + 1]
+        near = np.concatenate([self.bucket_segments[a:b] for a, b in zip(starts, stops)])
+        near = near[self.closed[near] & (self.left[near] < x1) & (self.right[near] >= x0)
+                    & (self.top[near] < y1) & (self.bottom[near] >= y0)]
+
+        self.canvas[y0:y1, x0:x1] = self.background[y0:y1, x0:x1]
+        raster.draw_segments(self.canvas, self.x0[near], self.y0[near],
+                             self.x1[near], self.y1[near])
+
+    # Square buckets at least as large as any segment, so that each segment
+    # lies in at most 2x2 of them, with the segments of each bucket CSR-style.
+    def __index_buckets(self, width, height):
+        extent = max(int((self.right - self.left).max(initial=0)),
+                     int((self.bottom - self.top).max(initial=0)))
+        B = self.bucket = max(64, extent + 1)
+        self.buckets_across = -(-width // B)
+        count = self.buckets_across * -(-height // B)
+
+        keys = np.stack([(self.top // B) * self.buckets_across + self.left // B,
+                         (self.top // B) * self.buckets_across + self.right // B,
+                         (self.bottom // B) * self.buckets_across + self.left // B,
+                         (self.bottom // B) * self.buckets_across + self.right // B], axis=1)
+        keys.sort(axis=1)
+        # each (segment, bucket) pair once
+        keep = np.ones(keys.shape, dtype=bool)
+        keep[:, 1:] = keys[:, 1:] != keys[:, :-1]
+        segments = np.broadcast_to(np.arange(len(keys))[:, None], keys.shape)[keep]
+        keys = keys[keep]
+
+        order = np.argsort(keys, kind='stable')
+        self.bucket_segments = segments[order]
+        self.bucket_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=count), out=self.bucket_offsets[1:])
+
+'''
+Write an animated PNG of `events` opening the walls of a maze like `maze` to
+`file`, a path or a binary file-like object. Each frame opens
+`events_per_frame` walls and is shown for `delay` milliseconds; the first
+(fully walled) and last frames are shown for `hold` milliseconds. `mode` is
+'1' or 'L', see `png_stream.PngWriter`. Returns the number of frames written,
+counting every rectangle of a frame (see `WallCanvas.frames`) as one.
+
+For example, to animate a maze as it is generated:
+
+    maze = CartesianMaze(20, seed=1)
+    write_apng('maze.png', maze, maze.carve_events(), events_per_frame=4)
+'''
+def write_apng(file, maze, events, events_per_frame=1, delay=40, hold=1000,
+               mode='1', compress_level=6):
+    wall_canvas = WallCanvas(maze)
+    with raster.open_output(file) as f, \
+         png_stream.ApngWriter(f, wall_canvas.canvas, (hold, 1000),
+                               compress_level=compress_level, mode=mode) as writer:
+        # a frame is written once the next one is known, so that the last one
+        # can get `hold` as its delay
+        previous = []
+        for rects in wall_canvas.frames(events, events_per_frame):
+            _write_rects(writer, previous, delay)
+            previous = rects
+        _write_rects(writer, previous, hold)
+    return writer.frames
+
+# the rectangles of one frame, all but the last shown for no time at all
+def _write_rects(writer, rects, delay):
+    for i, (x, y, pixels) in enumerate(rects):
+        writer.write_frame(pixels, x, y, (delay if i == len(rects) - 1 else 0, 1000))
+
+# (rows, cols) of `maze` as stored in file headers, see `serialize.write`
+def _dimensions(maze):
+    if maze.TOPOLOGY == 'cartesian':
+        return maze.rows, maze.cols
+    return maze.size, 0
+
+# a maze of the given class and size with every wall closed
+def _walled(topology, rows, cols):
+    cls = serialize.MAZE_CLASSES[topology]
+    return cls(rows, cols) if topology == 'cartesian' else cls(rows)
+
+# Adjacency entries of the events: for each, the entry of `cells[i]` whose
+# direction is `directions[i]`, or -1 if the cell has no neighbor that way.
+def _entries(adj, cells, directions):
+    if len(cells) and (cells.min() < 0 or cells.max() >= len(adj)):
+        raise ValueError("Event cell out of range")
+    degree = int(np.diff(adj.offsets).max(initial=0))
+    candidates = adj.offsets[cells][:, None] + np.arange(degree)
+    valid = candidates < adj.offsets[cells + 1][:, None]
+    candidates = np.where(valid, candidates, 0)
+    match = valid & (adj.directions[candidates] == directions[:, None])
+    entries = candidates[np.arange(len(cells)), match.argmax(axis=1)]
+    return np.where(match.any(axis=1), entries, -1)
+
+# Unsigned LEB128: 7 bits per byte, low groups first, the high bit set on all
+# but the last byte.
+def _varints(values):
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        lengths += values >= np.uint64(1 << shift)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for j in range(int(lengths.max(initial=0))):
+        has = lengths > j
+        byte = (values[has] >> np.uint64(7*j)) & np.uint64(0x7F)
+        byte |= np.where(lengths[has] > j + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[has] + j] = byte
+    return out
+
+def _parse_varints(data):
+    ends = np.flatnonzero(data < 0x80)
+    if len(data) and (not len(ends) or ends[-1] != len(data) - 1):
+        raise ValueError("Truncated event log")
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)[:len(ends)]
+    lengths = ends - starts + 1
+    if len(lengths) and lengths.max() > 10:
+        raise ValueError("Malformed event log: varint too long")
+    group = np.repeat(np.arange(len(ends)), lengths)
+    shift = 7 * (np.arange(len(data)) - starts[group])
+    parts = (data & 0x7F).astype(np.uint64) << shift.astype(np.uint64)
+    if not len(parts):
+        return np.zeros(0, dtype=np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
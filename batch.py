@@ -0,0 +1,160 @@
+'''
+Generate many mazes in parallel.
+
+A job says which maze to build (type, side, algorithm, seed) and what to produce
+(format). Jobs are grouped into chunks and fanned out over a process pool.
+Generation and rendering both happen inside the worker, so the only things
+sent back are file paths or the compact cell bytes.
+
+Usage:
+    python batch.py jobs.json -o out/
+    python batch.py --type hex --side 15 --count 1000 --seed 0 -o out/
+
+`jobs.json` holds a list of job objects, e.g.
+    [{"type": "cartesian", "side": 50, "algorithm": "kruskal", "seed": 1}]
+'''
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+
+import numpy as np
+
+from cartesian_maze import CartesianMaze
+from pointy_hexagon_maze import PointyHexagonMaze
+from polar_maze import PolarMaze
+import serialize
+from triangle_maze import TriangleMaze
+
+MAZE_TYPES = {
+    'cartesian': CartesianMaze,
+    'triangle': TriangleMaze,
+    'hex': PointyHexagonMaze,
+    'polar': PolarMaze,
+}
+
+# 'png' renders the maze to a file, 'maze' saves it in the binary format of
+# serialize.py, 'grid' returns the raw cell bytes (wall bits only, one byte per
+# cell in storage order)
+FORMATS = ('png', 'maze', 'grid')
+
+'''
+Number of pixels of `render_image` for a maze of `topology` and `size`, see
+`Maze.image_size`.
+'''
+def image_pixels(topology, size):
+    width, height = MAZE_TYPES[topology].image_size(size)
+    return width * height
+
+'''
+Number of cells of a maze of `topology` and `size`, without building it, see
+`Maze.count_cells`.
+'''
+def cell_count(topology, size):
+    return MAZE_TYPES[topology].count_cells(size)
+
+'''
+One maze to build. `output` is the file written for the 'png' and 'maze'
+formats; when it
+is None, a name is derived from the other fields inside `output_dir`.
+'''
+Job = namedtuple('Job', 'type side algorithm seed format output',
+                 defaults=('backtracker', None, 'png', None))
+
+'''
+Outcome of a job: `path` is the file written (for 'png' and 'maze'), `data` the encoded
+grid (for 'grid').
+'''
+Result = namedtuple('Result', 'job path data')
+
+'''
+Default output file name for `job`.
+'''
+def job_filename(job):
+    seed = 'random' if job.seed is None else job.seed
+    return f"{job.type}-{job.side}-{job.algorithm}-{seed}.{job.format}"
+
+'''
+Build and render one maze. Runs in a worker process.
+'''
+def run_job(job, output_dir='.'):
+    if job.type not in MAZE_TYPES:
+        raise ValueError(f"Unknown maze type {job.type!r}, expected one of {sorted(MAZE_TYPES)}")
+    if job.format not in FORMATS:
+        raise ValueError(f"Unknown format {job.format!r}, expected one of {FORMATS}")
+
+    maze = MAZE_TYPES[job.type](job.side, seed=job.seed)
+    maze.generate(job.algorithm)
+
+    if job.format == 'grid':
+        return Result(job, None, (maze.cells & ~np.uint8(maze.SEEN_MARKER)).tobytes())
+
+    path = job.output or os.path.join(output_dir, job_filename(job))
+    if job.format == 'maze':
+        serialize.save(maze, path)
+    else:
+        maze.render_to_png(file=path)
+    return Result(job, path, None)
+
+def _run_chunk(jobs, output_dir):
+    return [run_job(job, output_dir) for job in jobs]
+
+'''
+Run `jobs` over a pool of `workers` processes (default: one per CPU), sending
+them over in chunks of `chunksize` to amortize the inter-process overhead.
+Yields a `Result` per job as soon as its chunk completes, so results are not in
+job order.
+
+Jobs without a seed get a fresh random one here, before they are sent out, so
+that each gets its own file name and the seed in the result's job rebuilds the
+same maze.
+'''
+def run_batch(jobs, workers=None, chunksize=16, output_dir='.'):
+    jobs = [job if isinstance(job, Job) else Job(**job) for job in jobs]
+    fresh = np.random.default_rng()
+    jobs = [job if job.seed is not None else job._replace(seed=int(fresh.integers(1 << 63)))
+            for job in jobs]
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_chunk, chunk, output_dir) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Generate mazes in parallel.")
+    parser.add_argument('jobs', nargs='?',
+                        help="JSON file with a list of jobs; omit to describe one kind of job with the options below")
+    parser.add_argument('--type', choices=sorted(MAZE_TYPES), default='cartesian')
+    parser.add_argument('--side', type=int, default=50)
+    parser.add_argument('--algorithm', default='backtracker')
+    parser.add_argument('--seed', type=int, help="seed of the first maze, incremented per maze (default: a random seed per maze)")
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--count', type=int, default=1, help="number of mazes")
+    parser.add_argument('-o', '--output-dir', default='.')
+    parser.add_argument('-w', '--workers', type=int)
+    parser.add_argument('--chunksize', type=int, default=16)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+
+    if args.jobs:
+        with open(args.jobs) as f:
+            jobs = [Job(**job) for job in json.load(f)]
+    else:
+        jobs = [Job(args.type, args.side, args.algorithm,
+                    None if args.seed is None else args.seed + i, args.format)
+                for i in range(args.count)]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for result in run_batch(jobs, args.workers, args.chunksize, args.output_dir):
+        if result.path is None:
+            # grids are written by the parent, workers only return the bytes
+            path = os.path.join(args.output_dir, job_filename(result.job))
+            with open(path, 'wb') as f:
+                f.write(result.data)
+        else:
+            path = result.path
+        print(path)
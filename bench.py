@@ -0,0 +1,255 @@
+'''
+Benchmarks for generation, rendering and solving.
+
+Every case times one phase for one kind of maze at one size:
+
+    generate  build the maze object and run the generation algorithm
+    png       render_image() and encode it as PNG into memory
+    text      render_to_text() into /dev/null
+    solve     solve.solve() from the first cell to the last
+
+Phases other than `generate` work on a maze generated beforehand, outside the
+timing. Each case runs in a fresh process, so that its peak RSS is its own, and
+is repeated `--repeat` times; the best time is reported together with
+cells/second. One more run under `tracemalloc` records the peak of traced
+allocations (NumPy arrays included), unless `--no-tracemalloc` is given.
+
+Cases larger than the machine's memory allows (see MAX_CELLS) are skipped, and
+cases whose process dies are recorded as failed; failures make the exit status
+1. Results are written as JSON. Pass a previous run's file as `--baseline` to
+compare: cases more than `--threshold` slower than the baseline are reported as
+regressions and also make the exit status 1.
+
+Usage:
+    python bench.py -o results.json
+    python bench.py --types cartesian --sizes 10 100 1000 5000 --phases generate solve
+    python bench.py -o new.json --baseline results.json --threshold 0.1
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from batch import MAZE_TYPES, cell_count, image_pixels
+import kernels
+import solve
+
+PHASES = ('generate', 'png', 'text', 'solve')
+SIZES = (10, 100, 1000, 5000)
+
+# A case needs about this many bytes of memory per cell at its peak: the cell
+# store, the adjacency table (see `maze.Adjacency`) and the generation or search
+# arrays. Measured at about 70 for Cartesian mazes of side 5000; hex cells have
+# six neighbors and need more.
+BYTES_PER_CELL = 100
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+# Cases above these limits are recorded as skipped instead of run. By default
+# the cell limit is what fits in this machine's memory, so every size in SIZES
+# runs where memory allows (hex and polar mazes of side 5000 have 75M cells and
+# need about 7.5 GB); rendering is capped separately by the canvas size.
+MAX_CELLS = (_physical_memory() or 1 << 33) // BYTES_PER_CELL
+MAX_PIXELS = 200_000_000 # PNG canvas size
+
+'''
+Reason why a case should not run, or None.
+'''
+def skip_reason(topology, size, phase, max_cells=MAX_CELLS, max_pixels=MAX_PIXELS):
+    if cell_count(topology, size) > max_cells:
+        return f"more than {max_cells} cells (about {max_cells * BYTES_PER_CELL / 2**30:.1f} GB)"
+    if phase == 'png' and image_pixels(topology, size) > max_pixels:
+        return f"image larger than {max_pixels} pixels"
+    return None
+
+def _generate(topology, size, algorithm):
+    maze = MAZE_TYPES[topology](size, seed=0)
+    maze.generate(algorithm)
+    return maze
+
+'''
+Set up a case and return the function to time.
+'''
+def _workload(topology, size, phase, algorithm):
+    if phase == 'generate':
+        return lambda: _generate(topology, size, algorithm)
+
+    maze = _generate(topology, size, algorithm)
+    if phase == 'png':
+        return lambda: maze.render_image().save(io.BytesIO(), 'PNG')
+    if phase == 'text':
+        def write_text():
+            with open(os.devnull, 'w') as devnull:
+                maze.render_to_text(devnull)
+        return write_text
+    if phase == 'solve':
+        return lambda: solve.solve(maze, 0, maze.cell_count - 1)
+    raise ValueError(f"Unknown phase {phase!r}, expected one of {PHASES}")
+
+def _peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+'''
+Run one case in the current process and return its result record.
+'''
+def run_case(topology, size, phase, algorithm='backtracker', repeat=3, trace=True):
+    record = {'type': topology, 'size': size, 'phase': phase, 'algorithm': algorithm,
+              'cells': cell_count(topology, size)}
+
+    run = _workload(topology, size, phase, algorithm)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    record['times'] = times
+    record['seconds'] = min(times)
+    record['cells_per_second'] = record['cells'] / record['seconds'] if record['seconds'] else None
+    record['peak_rss_bytes'] = _peak_rss()
+
+    if trace:
+        tracemalloc.start()
+        run()
+        record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return record
+
+'''
+Run one case in a fresh process. If the process dies (e.g. killed for running
+out of memory), the case is recorded with a `failed` reason instead of timings.
+'''
+def run_isolated(topology, size, phase, algorithm='backtracker', repeat=3, trace=True):
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            return pool.submit(run_case, topology, size, phase, algorithm, repeat, trace).result()
+    except BrokenProcessPool:
+        return {'type': topology, 'size': size, 'phase': phase, 'algorithm': algorithm,
+                'failed': "the benchmark process died"}
+
+'''
+Run every combination of `types`, `sizes` and `phases`, yielding a record per
+case as it finishes. Skipped cases get a `skipped` reason instead of timings.
+'''
+def run_benchmarks(types=tuple(MAZE_TYPES), sizes=SIZES, phases=PHASES,
+                   algorithm='backtracker', repeat=3, trace=True, isolate=True,
+                   max_cells=MAX_CELLS, max_pixels=MAX_PIXELS):
+    runner = run_isolated if isolate else run_case
+    for topology in types:
+        for size in sizes:
+            for phase in phases:
+                reason = skip_reason(topology, size, phase, max_cells, max_pixels)
+                if reason is not None:
+                    yield {'type': topology, 'size': size, 'phase': phase,
+                           'algorithm': algorithm, 'skipped': reason}
+                else:
+                    yield runner(topology, size, phase, algorithm, repeat, trace)
+
+def _case_key(record):
+    return record['type'], record['size'], record['phase'], record['algorithm']
+
+'''
+Compare `results` with `baseline` (lists of records). Returns
+`(key, baseline seconds, seconds, relative change)` for every case that was
+timed in both, and the subset that got slower by more than `threshold`.
+'''
+def compare(results, baseline, threshold=0.1):
+    before = {_case_key(r): r['seconds'] for r in baseline if 'seconds' in r}
+    changes = []
+    for record in results:
+        key = _case_key(record)
+        if 'seconds' in record and key in before and before[key] > 0:
+            change = record['seconds'] / before[key] - 1
+            changes.append((key, before[key], record['seconds'], change))
+    regressions = [c for c in changes if c[3] > threshold]
+    return changes, regressions
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': kernels.numba.__version__ if kernels.AVAILABLE else None,
+        'kernels': kernels.enabled(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def _format(record):
+    name = f"{record['type']:>9} {record['size']:>5} {record['phase']:<8}"
+    if 'skipped' in record:
+        return f"{name} skipped: {record['skipped']}"
+    if 'failed' in record:
+        return f"{name} FAILED: {record['failed']}"
+    line = (f"{name} {record['seconds']:10.4f}s {record['cells_per_second']:14,.0f} cells/s"
+            f" rss {record['peak_rss_bytes'] / 2**20:8.1f}M")
+    if 'tracemalloc_peak_bytes' in record:
+        line += f" traced {record['tracemalloc_peak_bytes'] / 2**20:8.1f}M"
+    return line
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark maze generation, rendering and solving.")
+    parser.add_argument('--types', nargs='+', choices=sorted(MAZE_TYPES), default=list(MAZE_TYPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    parser.add_argument('--algorithm', default='backtracker')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-tracemalloc', action='store_true')
+    parser.add_argument('--in-process', action='store_true',
+                        help="run cases in this process (peak RSS is then cumulative)")
+    parser.add_argument('--max-cells', type=int, default=MAX_CELLS,
+                        help="skip larger cases (default: what fits in memory)")
+    parser.add_argument('--max-pixels', type=int, default=MAX_PIXELS)
+    parser.add_argument('-o', '--output', help="JSON file for the results (default: standard output)")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative slowdown counted as a regression")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+
+    results = []
+    for record in run_benchmarks(args.types, args.sizes, args.phases, args.algorithm,
+                                 args.repeat, not args.no_tracemalloc, not args.in_process,
+                                 args.max_cells, args.max_pixels):
+        print(_format(record), file=sys.stderr)
+        results.append(record)
+
+    report = {'environment': _environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        changes, regressions = compare(results, baseline, args.threshold)
+        for (topology, size, phase, _), before, after, change in changes:
+            mark = ' REGRESSION' if change > args.threshold else ''
+            print(f"{topology:>9} {size:>5} {phase:<8} {before:10.4f}s -> {after:10.4f}s "
+                  f"{change:+7.1%}{mark}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+    if any('failed' in record for record in results):
+        sys.exit(1)
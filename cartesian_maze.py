@@ -1,7 +1,11 @@
-from maze import Maze
+from maze import Adjacency, Maze
+import generators
+from png_stream import PngWriter
+import raster
+from rng import RandomSource
+import text
 
-from PIL import Image, ImageDraw
-from random import shuffle
+import numpy as np
 
 N, S, E, W = 1, 2, 4, 8
 SEEN_MARKER = 16 # when this is set, the cell is seen
@@ -28,126 +32,441 @@ OPPOSITE = {
 }
 
 '''
-Maze based on a 2D square grid.
+Maze based on a 2D square grid. Pass `cols` for a rectangular grid of `side`
+rows by `cols` columns.
 '''
 class CartesianMaze(Maze):
-    def __init__(self, side):
+    TOPOLOGY = 'cartesian'
+    SEEN_MARKER = SEEN_MARKER
+    SC = 25 # output scale
+    M = 20 # padding
+    __slots__ = ('rows', 'cols')
+
+    def __init__(self, side, cols=None, seed=None, cells=None):
+        self._seed(seed)
         self.rows = side
-        self.cols = side
-        self.grid = [[0 for _ in range(self.cols)] for _ in range(self.rows)]
+        self.cols = side if cols is None else cols
+        self.size = (self.rows, self.cols)
+        self._allocate_cells([self.cols] * self.rows, cells)
+        self._attach_grid()
 
-    def __in_bounds(self, coords):
-        r, c = coords
-        return 0 <= r < self.rows and 0 <= c < self.cols
+    # 2D view into the flat cell store, so `self.grid[r][c]` still works
+    def _attach_grid(self):
+        self.grid = self.cells.reshape(self.rows, self.cols)
 
-    '''
-    When the bitwise AND of a cell and a direction is 0 it means there is no
-    connection in that direction, which means there is a wall there. This method
-    assumes that `coords` is known to be in bounds.
-    '''
-    def __has_wall(self, coords, direction):
-        r, c = coords
-        return self.grid[r][c] & direction == 0
-
-    def render_to_text(self):
-        print(' ' + '_' * (2*self.cols - 1)) # top row
-        for r in range(self.rows):
-            print('|', end='') # leftmost wall
-            for c in range(self.cols):
-                # check for south wall
-                if self.__has_wall([r, c], S):
-                    print('_', end='')
-                else:
-                    print(' ', end='')
-
-                # check for east wall
-                if c == self.cols-1 or self.__has_wall([r, c], E):
-                    print('|', end='')
-                else:
-                    print(' ' , end='')
-            print()
-
-    def render_to_png(self, filename):
-        SC = 25 # output scale
-        M = 20 # padding
+    def render_to_text(self, file=None, style='ascii'):
+        with self._phase('text'):
+            render_rows_to_text(self.grid, self.cols, file, style)
+
+    @classmethod
+    def count_cells(cls, side, cols=None):
+        return side * (side if cols is None else cols)
+
+    @classmethod
+    def image_size(cls, side, cols=None):
+        cols = side if cols is None else cols
+        return cols*cls.SC + 2*cls.M, side*cls.SC + 2*cls.M
+
+    def render_image(self, mode='L'):
+        SC, M = self.SC, self.M
 
         WIDTH, HEIGHT = self.cols*SC, self.rows*SC
 
-        WHITE = (255, 255, 255)
-        BLACK = (0, 0, 0)
+        canvas = raster.new_canvas(*self.image_size(self.rows, self.cols))
 
-        image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M))
-        draw = ImageDraw.Draw(image)
+        # outer border
+        canvas[M, M:WIDTH + M + 1] = raster.BLACK
+        canvas[HEIGHT + M, M:WIDTH + M + 1] = raster.BLACK
+        canvas[M:HEIGHT + M + 1, M] = raster.BLACK
+        canvas[M:HEIGHT + M + 1, WIDTH + M] = raster.BLACK
 
-        draw.rectangle([(0, 0),
-                        (WIDTH + 2*M, HEIGHT + 2*M)],
-                        WHITE)
-        draw.rectangle([(M, M), (WIDTH + M, HEIGHT + M)], None, BLACK)
+        # walls a band of rows at a time to bound the temporary arrays
+        BAND = 256
+        for r0 in range(0, self.rows, BAND):
+            _draw_walls(canvas[M + r0*SC:, M:], self.grid[r0:r0 + BAND], SC)
 
-        for r in range(self.rows):
-            for c in range(self.cols):
-                if self.__has_wall([r, c], E):
-                    draw.line([(M + (c+1)*SC, M + r*SC),
-                               (M + (c+1)*SC, M + (r+1)*SC)],
-                               BLACK)
-                if self.__has_wall([r, c], S):
-                    draw.line([(M + c*SC, M + (r+1)*SC),
-                               (M + (c+1)*SC, M + (r+1)*SC)],
-                               BLACK)
+        if self.instrumentation.enabled:
+            closed = (self.cells & E == 0).sum() + (self.cells & S == 0).sum()
+            self.instrumentation.count('walls_drawn', int(closed))
 
-        del draw
+        return raster.to_image(canvas, mode)
 
-        path = f"./img/{filename}.png"
-        print(f"Writing maze to {path}")
-        image.save(f"{path}", 'PNG')
+    # Same picture as `render_image`, which rasterizes the wall masks directly
+    # instead of going through segments. The bottom and right borders are the
+    # closed S and E walls of the last row and column.
+    def wall_geometry(self, owners=False):
+        SC, M = self.SC, self.M
 
-    def __neighbors(self, coords):
-        directions = [N, E, W, S]
-        shuffle(directions)
+        WIDTH, HEIGHT = self.cols*SC, self.rows*SC
+        border = [(M, M + HEIGHT), (M, M), (M + WIDTH, M)]
+
+        r, c = self.coordinates()
+        east = self.cells & E == 0
+        south = self.cells & S == 0
+        segments = (np.concatenate((M + (c[east] + 1)*SC, M + c[south]*SC)),
+                    np.concatenate((M + r[east]*SC, M + (r[south] + 1)*SC)),
+                    np.concatenate((M + (c[east] + 1)*SC, M + (c[south] + 1)*SC)),
+                    np.concatenate((M + (r[east] + 1)*SC, M + (r[south] + 1)*SC)))
+        if owners:
+            east, south = np.flatnonzero(east), np.flatnonzero(south)
+            walls = (np.concatenate((east, south)),
+                     np.repeat(np.array([E, S], dtype=np.uint8), (len(east), len(south))))
+            return (*self.image_size(self.rows, self.cols), [border], segments, walls)
+        return (*self.image_size(self.rows, self.cols), [border], segments)
 
-        cx, cy = coords
+    '''
+    Render the part of the image `render_image` would produce that lies in the
+    pixel rectangle from (`x0`, `y0`) to (`x1`, `y1`) (end exclusive), drawing
+    only the cells that reach into it. See `render_viewport`.
+    '''
+    def render_viewport(self, x0, y0, x1, y1, mode='L'):
+        return raster.to_image(render_viewport(self, x0, y0, x1, y1), mode)
 
-        for direction in directions:
-            nx, ny = cx + DX[direction], cy + DY[direction]
+    '''
+    Wall bits of rows `r0` to `r1` and columns `c0` to `c1` (end exclusive), as
+    a 2D view into the cell store.
+    '''
+    def region(self, r0, c0, r1, c1):
+        return self.grid[r0:r1, c0:c1]
 
-            if not self.__in_bounds([ny, nx]):
-                continue
+    '''
+    Flat id of the cell in row `r`, column `c`.
+    '''
+    def cell_id(self, r, c):
+        return r*self.cols + c
+
+    @classmethod
+    def _build_coordinates(cls, size):
+        rows, cols = size
+        return np.divmod(np.arange(rows*cols, dtype=np.int32), cols)
+
+    @classmethod
+    def _build_adjacency(cls, size):
+        rows, cols = size
+        r, c = cls._build_coordinates(size)
 
-            yield (nx, ny, direction)
+        directions = [N, E, W, S]
+        table = np.empty((rows*cols, len(directions)), dtype=np.int32)
+        for k, direction in enumerate(directions):
+            nr, nc = r + DY[direction], c + DX[direction]
+            inside = (0 <= nr) & (nr < rows) & (0 <= nc) & (nc < cols)
+            table[:, k] = np.where(inside, nr*cols + nc, -1)
+
+        return Adjacency.from_table(table, directions, OPPOSITE)
 
     '''
     Generate a maze by carving out passages starting from cell (cx, cy). Here
-    `cx` is the row, `cy` is the column.
+    `cx` is the column, `cy` is the row. With `events=True`, return a generator
+    of carve events instead, see `Maze.carve_events`.
     '''
-    def carve_passages_from(self, cx, cy):
-        # We start out with `reverse_dir` == None.
-        stack = [(cx, cy, None)]
-
-        while stack:
-            # `reverse_dir` is the direction that takes you from the current cell
-            # to the cell that enqueued it. This is why we start out the stack
-            # with a None `reverse_dir`.
-            cx, cy, reverse_dir = stack.pop()
-            if self.__seen([cy, cx]):
+    def carve_passages_from(self, cx, cy, events=False):
+        if events:
+            return self.carve_events(self.cell_id(cy, cx))
+        with self._phase('generate'):
+            generators.backtracker(self, self.cell_id(cy, cx))
+        self.invalidate()
+
+'''
+Binary tree: every cell opens a passage either north or east. Each choice is
+independent of all others, so the whole grid is carved with a few array
+operations. Produces a strong diagonal bias and two open corridors along the
+top row and the rightmost column.
+Reference: https://weblog.jamisbuck.org/2011/2/1/maze-generation-binary-tree-algorithm
+'''
+@generators.register('binary-tree', topologies=('cartesian',))
+def binary_tree(maze):
+    rows, cols = maze.rows, maze.cols
+    cells = maze.cells
+    r, c = np.divmod(np.arange(rows*cols), cols)
+
+    has_north, has_east = r > 0, c < cols - 1
+    go_north = has_north & (~has_east | (maze.rng.floats(rows*cols) < 0.5))
+    go_east = has_east & ~go_north
+
+    north = np.flatnonzero(go_north)
+    cells[north] |= N
+    cells[north - cols] |= S
+    east = np.flatnonzero(go_east)
+    cells[east] |= E
+    cells[east + 1] |= W
+
+'''
+Sidewinder: each row is split into random runs of cells joined east-west, and
+every run opens one passage north from a random member. The top row is a
+single corridor. Like the binary tree, rows only depend on randomness, so the
+grid is carved with array operations.
+Reference: https://weblog.jamisbuck.org/2011/2/3/maze-generation-sidewinder-algorithm
+'''
+@generators.register('sidewinder', topologies=('cartesian',))
+def sidewinder(maze):
+    rows, cols = maze.rows, maze.cols
+    cells = maze.cells
+
+    cells[:cols - 1] |= E
+    cells[1:cols] |= W
+    if rows == 1:
+        return
+
+    # all rows but the first, flattened; runs always close at the last column
+    # so they never span two rows
+    n = (rows - 1)*cols
+    close = (np.arange(n) % cols == cols - 1) | (maze.rng.floats(n) < 0.5)
+
+    east = np.flatnonzero(~close) + cols
+    cells[east] |= E
+    cells[east + 1] |= W
+
+    ends = np.flatnonzero(close)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    picks = starts + (maze.rng.floats(len(ends)) * (ends - starts + 1)).astype(np.int64)
+    picks += cols
+    cells[picks] |= N
+    cells[picks - cols] |= S
+
+'''
+Eller's algorithm over the whole grid, see `eller_rows`.
+'''
+@generators.register('eller', topologies=('cartesian',))
+def eller(maze):
+    for r, row in enumerate(eller_rows(maze.rows, maze.cols, maze.rng)):
+        maze.grid[r] = np.frombuffer(row, dtype=np.uint8)
+
+'''
+Eller's algorithm. Yields the maze one finished row at a time as a `bytearray`
+of `cols` cells holding the usual N/S/E/W connection bits, keeping only O(cols)
+state between rows. This makes it possible to stream mazes with far more rows
+than would fit in memory into `render_rows_to_text` or `render_rows_to_png`.
+`rng` is a `rng.RandomSource` or anything it accepts as a seed.
+Reference: https://weblog.jamisbuck.org/2010/12/29/maze-generation-eller-s-algorithm
+'''
+def eller_rows(rows, cols, rng=None):
+    rng = RandomSource(rng)
+    random, choice = rng.random, rng.choice
+
+    # `sets[c]` is the label of the set the cell in column c belongs to. Cells
+    # share a label iff they are already connected through rows seen so far.
+    sets = list(range(cols))
+    next_label = cols
+    # connections to the row above, carried over from its S openings
+    north = bytearray(cols)
+
+    for r in range(rows):
+        row = north
+        last = r == rows - 1
+
+        members = {}
+        for c, label in enumerate(sets):
+            members.setdefault(label, []).append(c)
+
+        # randomly join adjacent cells that are not yet connected; on the last
+        # row join all of them so that everything ends up in one set
+        for c in range(cols - 1):
+            a, b = sets[c], sets[c+1]
+            if a == b or not (last or random() < 0.5):
                 continue
-            self.__mark_seen([cy, cx])
+            row[c] |= E
+            row[c+1] |= W
+            # relabel the smaller set so that merging stays O(cols log cols)
+            if len(members[a]) < len(members[b]):
+                a, b = b, a
+            for m in members[b]:
+                sets[m] = a
+            members[a].extend(members.pop(b))
+
+        if last:
+            yield row
+            break
+
+        # every set extends down at least once so that no set is cut off
+        north = bytearray(cols)
+        below = [-1] * cols
+        for label, columns in members.items():
+            down = [c for c in columns if random() < 0.5] or [choice(columns)]
+            for c in down:
+                row[c] |= S
+                north[c] = N
+                below[c] = label
+
+        # cells that were not reached from above start new sets
+        for c in range(cols):
+            if below[c] < 0:
+                below[c] = next_label
+                next_label += 1
+        sets = below
+
+        yield row
+
+'''
+Draw the E and S walls of `block`, a 2D array of cells, into `canvas`, whose
+pixel (0, 0) is the top-left corner of the block's first cell. Every E wall is a
+vertical run of SC+1 pixels in pixel column (c+1)*SC, and every S wall a
+horizontal run in pixel row (r+1)*SC. The wall masks are expanded to pixel
+resolution and written into those columns/rows with strided slices.
+'''
+def _draw_walls(canvas, block, SC):
+    rows, cols = block.shape
+
+    east = block & E == 0
+    run = np.zeros((rows*SC + 1, cols), dtype=bool)
+    run[:-1] = np.repeat(east, SC, axis=0)
+    run[SC::SC] |= east # bottom endpoint of each run
+    canvas[:rows*SC + 1, SC:cols*SC + 1:SC][run] = raster.BLACK
+
+    south = block & S == 0
+    run = np.zeros((rows, cols*SC + 1), dtype=bool)
+    run[:, :-1] = np.repeat(south, SC, axis=1)
+    run[:, SC::SC] |= south # right endpoint of each run
+    canvas[SC:rows*SC + 1:SC, :cols*SC + 1][run] = raster.BLACK
+
+'''
+Render the pixel rectangle from (`x0`, `y0`) to (`x1`, `y1`) (end exclusive) of
+the image of a Cartesian maze at scale `SC` and padding `M`, as a canvas (see
+`raster.py`). Only the cells whose walls reach into the rectangle are read and
+drawn, so this works for any maze size, e.g. for a `TiledMaze`: `maze` only needs
+`rows`, `cols` and `region`. At the default scale and padding the result is the
+same as cropping `CartesianMaze.render_image`.
+'''
+def render_viewport(maze, x0, y0, x1, y1, SC=CartesianMaze.SC, M=CartesianMaze.M):
+    canvas = raster.new_canvas(x1 - x0, y1 - y0)
+
+    # the walls of cell (r, c) span pixels M + c*SC to M + (c+1)*SC across and
+    # M + r*SC to M + (r+1)*SC down
+    c0 = min(max(0, -((M - x0) // SC) - 1), maze.cols)
+    c1 = min(max(0, (x1 - 1 - M) // SC + 1), maze.cols)
+    r0 = min(max(0, -((M - y0) // SC) - 1), maze.rows)
+    r1 = min(max(0, (y1 - 1 - M) // SC + 1), maze.rows)
+    if r0 == r1 or c0 == c1:
+        return canvas
+
+    block = raster.new_canvas((c1 - c0)*SC + 1, (r1 - r0)*SC + 1)
+    _draw_walls(block, maze.region(r0, c0, r1, c1), SC)
+    # the N and W walls of the first row and column are the outer border
+    if r0 == 0:
+        block[0] = raster.BLACK
+    if c0 == 0:
+        block[:, 0] = raster.BLACK
+
+    # copy the overlap of the block and the rectangle
+    bx, by = M + c0*SC, M + r0*SC
+    xa, xb = max(x0, bx), min(x1, bx + block.shape[1])
+    ya, yb = max(y0, by), min(y1, by + block.shape[0])
+    if xa < xb and ya < yb:
+        canvas[ya - y0:yb - y0, xa - x0:xb - x0] = block[ya - by:yb - by, xa - bx:xb - bx]
+    return canvas
+
+# Text glyphs, see `text.py`. In the 'ascii' style every cell is two
+# characters, its S wall (or not) and its E wall (or not), looked up by the
+# cell's S and E bits.
+ASCII_CELLS = text.lookup_table((S | E) + 1, 2,
+                                lambda bits: ('_' if bits & S == 0 else ' ') +
+                                             ('|' if bits & E == 0 else ' '))
+# In the 'unicode' style walls are drawn on the lines between rows, with a
+# box-drawing corner wherever they meet, looked up by which of the walls going
+# up (1), down (2), left (4) and right (8) from it exist.
+BOX_CORNERS = np.array([ord(ch) for ch in ' ╵╷│╴┘┐┤╶└┌├─┴┬┼'], dtype=np.uint32)
+BOX_HORIZONTAL, BOX_VERTICAL, SPACE = ord('─'), ord('│'), ord(' ')
+
+'''
+Generate the lines of text showing rows of a Cartesian maze in `style` (see
+`text.py`). `rows` is any iterable of rows of `cols` cells, e.g.
+`CartesianMaze.grid` or the output of `eller_rows`, and is consumed one row at
+a time.
+'''
+def text_lines(rows, cols, style='ascii'):
+    text.check_style(style)
+    if style == 'ascii':
+        yield ' ' + '_' * (2*cols - 1) # top row
+        for row in rows:
+            glyphs = ASCII_CELLS[np.asarray(row, dtype=np.uint8) & (S | E)]
+            glyphs[-1, 1] = ord('|') # rightmost wall
+            yield '|' + text.decode(glyphs) # leftmost wall, then the cells
+        return
+
+    above = None
+    for row in rows:
+        row = np.asarray(row, dtype=np.uint8)
+        yield _box_line(above, row, cols)
+        yield _box_cells(row)
+        above = row
+    yield _box_line(above, None, cols)
+
+'''
+Print rows of a Cartesian maze as text to `file` (default: standard output),
+see `text_lines`.
+'''
+def render_rows_to_text(rows, cols, file=None, style='ascii'):
+    text.write_lines(text_lines(rows, cols, style), file)
+
+# whether there is a vertical wall at each of the cols+1 corners of `row`
+def _box_verticals(row):
+    walls = np.ones(len(row) + 1, dtype=np.uint8)
+    walls[1:-1] = row[:-1] & E == 0
+    return walls
+
+# The line between rows `above` and `below` (None past the edges of the maze):
+# corners with two characters of horizontal wall or space between them.
+def _box_line(above, below, cols):
+    corners = np.zeros(cols + 1, dtype=np.uint8)
+    if above is None:
+        horizontal = np.ones(cols, dtype=np.uint8)
+    else:
+        corners |= _box_verticals(above)
+        horizontal = (above & S == 0).astype(np.uint8)
+    if below is not None:
+        corners |= _box_verticals(below) << 1
+    corners[1:] |= horizontal << 2
+    corners[:-1] |= horizontal << 3
+
+    codes = np.full((cols + 1, 3), SPACE, dtype=np.uint32)
+    codes[:, 0] = BOX_CORNERS[corners]
+    codes[:-1, 1:] = np.where(horizontal, BOX_HORIZONTAL, SPACE)[:, None]
+    return text.decode(codes.reshape(-1)[:-2])
+
+# The line through the middle of `row`, holding its vertical walls.
+def _box_cells(row):
+    codes = np.full((len(row) + 1, 3), SPACE, dtype=np.uint32)
+    codes[:, 0] = np.where(_box_verticals(row), BOX_VERTICAL, SPACE)
+    return text.decode(codes.reshape(-1)[:-2])
+
+'''
+Write rows of a Cartesian maze as a PNG to `file`, a path or a binary file-like
+object, a band of pixel rows per maze row, without holding the maze or the
+image in memory. `rows` is consumed one row at a time like in
+`render_rows_to_text`; `nrows` is the number of rows it yields, needed up front
+for the PNG header. The output matches `CartesianMaze.render_to_png` at the
+same scale and padding. `mode` is 'L' or '1', see `png_stream.PngWriter`.
+'''
+def render_rows_to_png(rows, nrows, cols, file, SC=CartesianMaze.SC, M=CartesianMaze.M, mode='L', compress_level=6):
+    WIDTH, HEIGHT = cols*SC, nrows*SC
+    right = np.arange(1, cols + 1)*SC + M # x of each cell's E wall
 
-            if reverse_dir:
-                px, py = cx + DX[reverse_dir], cy + DY[reverse_dir]
-                prev_dir = OPPOSITE[reverse_dir]
-                self.grid[py][px] |= prev_dir
-                self.grid[cy][cx] |= reverse_dir
+    with raster.open_output(file) as file:
+        png = PngWriter(file, WIDTH + 2*M, HEIGHT + 2*M, compress_level, mode)
+        png.write(raster.new_canvas(WIDTH + 2*M, M)) # top padding
 
-            for nx, ny, new_dir in self.__neighbors([cx, cy]):
-                stack.append((nx, ny, OPPOSITE[new_dir]))
+        prev = None
+        for row in rows:
+            row = np.asarray(row, dtype=np.uint8)
+            band = raster.new_canvas(WIDTH + 2*M, SC)
 
-    def generate(self):
-        self.carve_passages_from(0, 0) # top-leftmost cell
+            # the band's first pixel row is the previous row's bottom edge: its
+            # S walls and the bottom endpoints of its E walls
+            if prev is None:
+                band[0, M:WIDTH + M + 1] = raster.BLACK
+            else:
+                south = np.repeat(prev & S == 0, SC)
+                band[0, M:WIDTH + M][south] = raster.BLACK
+                band[0, right[prev & S == 0]] = raster.BLACK
+                band[0, right[prev & E == 0]] = raster.BLACK
 
-    def __seen(self, coords):
-        cy, cx = coords
-        return self.grid[cy][cx] & SEEN_MARKER != 0
+            band[:, right[row & E == 0]] = raster.BLACK
+            band[:, M] = raster.BLACK
+            band[:, WIDTH + M] = raster.BLACK
+            png.write(band)
+            prev = row
 
-    def __mark_seen(self, coords):
-        cy, cx = coords
-        self.grid[cy][cx] |= SEEN_MARKER
+        # bottom border (covering the last row's S walls), then padding
+        bottom = raster.new_canvas(WIDTH + 2*M, M)
+        bottom[0, M:WIDTH + M + 1] = raster.BLACK
+        png.write(bottom)
+        png.close()
@@ -0,0 +1,411 @@
+'''
+Maze generation algorithms, looked up by name.
+
+Every algorithm is a function taking a maze and carving a spanning tree of
+passages into `maze.cells`, drawing all randomness from `maze.rng` so that the
+result only depends on the maze's seed. Generic algorithms only use the topology-neutral
+interface of `maze.Maze`: flat cell ids, the CSR adjacency table from
+`maze.adjacency()` and `maze.SEEN_MARKER`. Algorithms that only make sense on
+one kind of grid declare the topologies they support, see `register`.
+'''
+from collections import deque
+from functools import lru_cache
+from heapq import heappop, heappush
+from itertools import permutations
+
+import numpy as np
+
+import kernels
+
+'''
+A registered algorithm. `topologies` is a tuple of `Maze.TOPOLOGY` values the
+algorithm supports, or None if it works on any topology.
+'''
+class Generator:
+    def __init__(self, name, carve, topologies=None):
+        self.name = name
+        self.carve = carve
+        self.topologies = topologies
+
+    def supports(self, topology):
+        return self.topologies is None or topology in self.topologies
+
+GENERATORS = {}
+
+'''
+Decorator registering a generation function under `name`. Pass `topologies` to
+restrict it to some kinds of mazes.
+'''
+def register(name, topologies=None):
+    def decorator(carve):
+        GENERATORS[name] = Generator(name, carve, topologies)
+        return carve
+    return decorator
+
+'''
+Names of the algorithms that can generate mazes of the given topology.
+'''
+def available(topology):
+    return sorted(name for name, gen in GENERATORS.items() if gen.supports(topology))
+
+'''
+Generate `maze` in place with the algorithm registered as `algorithm`.
+'''
+def generate(maze, algorithm='backtracker'):
+    try:
+        gen = GENERATORS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unknown generation algorithm {algorithm!r}, "
+                         f"expected one of {sorted(GENERATORS)}") from None
+    if not gen.supports(maze.TOPOLOGY):
+        raise ValueError(f"Algorithm {algorithm!r} does not support {maze.TOPOLOGY} "
+                         f"mazes, expected one of {available(maze.TOPOLOGY)}")
+    gen.carve(maze)
+
+# Generic algorithms
+
+'''
+Unpack the adjacency table and cell store of `maze` into memoryviews, which
+index into plain Python ints much faster than NumPy arrays do.
+'''
+def _views(maze):
+    adj = maze.adjacency()
+    return (memoryview(adj.offsets),
+            memoryview(adj.neighbors),
+            memoryview(adj.directions),
+            memoryview(adj.back),
+            memoryview(maze.cells))
+
+'''
+Flat id of the cell owning each adjacency entry, i.e. the inverse of the CSR
+offsets.
+'''
+def _sources(adj):
+    return np.repeat(np.arange(len(adj), dtype=np.int32), np.diff(adj.offsets))
+
+'''
+All orderings of `range(degree)`. Shuffling a cell's neighbors is picking one of
+these with a single random draw, which needs no allocation.
+'''
+@lru_cache(maxsize=None)
+def _permutations(degree):
+    return list(permutations(range(degree)))
+
+'''
+`_permutations(d)` for every degree `d` up to the largest in `adj`, indexed by
+degree.
+'''
+def _permutation_table(adj):
+    max_degree = int(np.diff(adj.offsets).max(initial=0))
+    return [_permutations(d) for d in range(max_degree + 1)]
+
+'''
+`_permutation_table(adj)` as arrays for `kernels.backtracker`: all the
+permutations stacked into one int32 array, and the row where those of each
+degree start, plus one past the end.
+'''
+@lru_cache(maxsize=None)
+def _permutation_arrays(max_degree):
+    table = [_permutations(d) for d in range(max_degree + 1)]
+    perms = np.zeros((sum(len(p) for p in table), max(max_degree, 1)), dtype=np.int32)
+    first = np.zeros(max_degree + 2, dtype=np.int64)
+    row = 0
+    for d, options in enumerate(table):
+        first[d] = row
+        for order in options:
+            perms[row, :d] = order
+            row += 1
+    first[-1] = row
+    return perms, first
+
+'''
+Iterative recursive backtracker (randomized depth-first search), starting from
+the cell with flat id `start`. By default that is the first cell in storage
+order, i.e. the top-left (or topmost) cell.
+
+The stack holds the current path only, one frame per cell: the cell, a random
+ordering of its adjacency entries and a cursor into that ordering. A neighbor
+is looked at only when the cursor reaches it and pushed only if it is still
+unvisited, so the stack never grows beyond the longest path. Its peak size is
+stored in `maze.peak_stack_size`.
+
+Exactly one random number is drawn per cell, in visiting order, to pick the
+cell's neighbor ordering. The compiled kernel (see `kernels.py`) draws the same
+numbers, so it carves the same maze.
+Reference: https://weblog.jamisbuck.org/2010/12/27/maze-generation-recursive-backtracking
+'''
+@register('backtracker')
+def backtracker(maze, start=0):
+    carve = _compiled_backtracker if kernels.enabled() else _backtracker
+    maze.peak_stack_size = carve(maze, start)
+    if maze.instrumentation.enabled:
+        # every cell reached is pushed and popped exactly once
+        visited = int(np.count_nonzero(maze.cells & maze.SEEN_MARKER))
+        maze.instrumentation.count('cells_visited', visited)
+        maze.instrumentation.count('stack_pushes', visited)
+        maze.instrumentation.count('stack_pops', visited)
+
+# the reference implementation, returning the peak stack size
+def _backtracker(maze, start):
+    deque(backtracker_events(maze, start), maxlen=0)
+    return maze.peak_stack_size
+
+'''
+The reference backtracker as a generator of carve events: yields `(cell,
+direction)`, the flat id of a cell and the direction bit of the wall it opens,
+right after both cells' bits are updated. The walls are opened in the same
+order and with the same random numbers as `backtracker`, so running the
+generator to the end leaves the same maze (and sets `maze.peak_stack_size`).
+The maze is only consistent between events; see `animation.py` for recording
+and replaying them.
+'''
+def backtracker_events(maze, start=0):
+    offsets, neighbors, directions, back, cells = _views(maze)
+    seen_marker = maze.SEEN_MARKER
+    perms = _permutation_table(maze.adjacency())
+    random = maze.rng.random
+
+    def pick_order(cell):
+        options = perms[offsets[cell + 1] - offsets[cell]]
+        return options[int(random() * len(options))]
+
+    cells[start] |= seen_marker
+    path = [start]
+    orders = [pick_order(start)]
+    cursors = [0]
+    peak = 1
+
+    while path:
+        cell = path[-1]
+        order = orders[-1]
+        base = offsets[cell]
+        i = cursors[-1]
+
+        # advance this frame's cursor to the next unvisited neighbor
+        while i < len(order):
+            k = base + order[i]
+            i += 1
+            n = neighbors[k]
+            if not cells[n] & seen_marker:
+                break
+        else:
+            # dead end, backtrack
+            path.pop()
+            orders.pop()
+            cursors.pop()
+            continue
+        cursors[-1] = i
+
+        # `directions[k]` leads cell -> n, `back[k]` n -> cell
+        cells[cell] |= directions[k]
+        cells[n] |= back[k] | seen_marker
+        yield cell, directions[k]
+
+        path.append(n)
+        orders.append(pick_order(n))
+        cursors.append(0)
+        if len(path) > peak:
+            peak = len(path)
+
+    maze.peak_stack_size = peak
+
+def _compiled_backtracker(maze, start):
+    adj = maze.adjacency()
+    perms, first = _permutation_arrays(int(np.diff(adj.offsets).max(initial=0)))
+    peak, used = kernels.backtracker(adj.offsets, adj.neighbors, adj.directions, adj.back,
+                                     maze.cells, maze.SEEN_MARKER, perms, first,
+                                     maze.rng.buffered(), maze.rng.generator, start)
+    maze.rng.skip(used)
+    return int(peak)
+
+'''
+Randomized Kruskal's: visit all edges in random order and open those joining
+two cells that are not yet connected, tracked with a union-find using path
+halving and union by size.
+Reference: https://weblog.jamisbuck.org/2011/1/3/maze-generation-kruskal-s-algorithm
+'''
+@register('kruskal')
+def kruskal(maze):
+    adj = maze.adjacency()
+    _, neighbors, directions, back, cells = _views(maze)
+    sources = _sources(adj)
+
+    # every edge appears twice in the table, keep the entry from the lower id
+    edges = np.flatnonzero(sources < adj.neighbors)
+    # shuffle by sorting on one random key per edge, drawn in bulk
+    edges = edges[np.argsort(maze.rng.floats(len(edges)), kind='stable')].tolist()
+    sources = memoryview(sources)
+
+    parent = list(range(maze.cell_count))
+    size = [1] * maze.cell_count
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    remaining = maze.cell_count - 1
+    for k in edges:
+        if not remaining:
+            break
+        a, b = find(sources[k]), find(neighbors[k])
+        if a == b:
+            continue
+        if size[a] < size[b]:
+            a, b = b, a
+        parent[b] = a
+        size[a] += size[b]
+        cells[sources[k]] |= directions[k]
+        cells[neighbors[k]] |= back[k]
+        remaining -= 1
+
+'''
+Randomized Prim's. The frontier (cells next to the maze but not in it yet) is a
+list plus an index of each cell's position in it, so a random frontier cell is
+picked and removed in O(1) by swapping it with the last one.
+Reference: https://weblog.jamisbuck.org/2011/1/10/maze-generation-prim-s-algorithm
+'''
+@register('prim')
+def prim(maze, start=0):
+    offsets, neighbors, directions, back, cells = _views(maze)
+    seen_marker = maze.SEEN_MARKER
+
+    randbelow, choice = maze.rng.randbelow, maze.rng.choice
+
+    frontier = []
+    position = [-1] * maze.cell_count # index in `frontier`, -1 if not in it
+
+    def add(cell):
+        cells[cell] |= seen_marker
+        for k in range(offsets[cell], offsets[cell + 1]):
+            n = neighbors[k]
+            if not cells[n] & seen_marker and position[n] < 0:
+                position[n] = len(frontier)
+                frontier.append(n)
+
+    add(start)
+    while frontier:
+        i = randbelow(len(frontier))
+        cell = frontier[i]
+        last = frontier.pop()
+        if last != cell:
+            frontier[i] = last
+            position[last] = i
+        position[cell] = -1
+
+        # connect to a random neighbor that is already in the maze
+        inside = [k for k in range(offsets[cell], offsets[cell + 1])
+                  if cells[neighbors[k]] & seen_marker]
+        k = choice(inside)
+        cells[cell] |= directions[k]
+        cells[neighbors[k]] |= back[k]
+        add(cell)
+
+'''
+Wilson's algorithm: loop-erased random walks from each cell not yet in the
+maze until the walk hits the maze. Produces a uniformly random spanning tree.
+Loops are erased implicitly by remembering only the last exit taken from each
+cell of the walk.
+Reference: https://weblog.jamisbuck.org/2011/1/20/maze-generation-wilson-s-algorithm
+'''
+@register('wilson')
+def wilson(maze):
+    offsets, neighbors, directions, back, cells = _views(maze)
+    seen_marker = maze.SEEN_MARKER
+
+    randbelow = maze.rng.randbelow
+
+    exit_taken = [-1] * maze.cell_count # last adjacency entry left through
+    cells[randbelow(maze.cell_count)] |= seen_marker
+
+    for start in range(maze.cell_count):
+        if cells[start] & seen_marker:
+            continue
+
+        cell = start
+        while not cells[cell] & seen_marker:
+            k = offsets[cell] + randbelow(offsets[cell + 1] - offsets[cell])
+            exit_taken[cell] = k
+            cell = neighbors[k]
+
+        # retrace the loop-erased walk and add it to the maze
+        cell = start
+        while not cells[cell] & seen_marker:
+            k = exit_taken[cell]
+            cells[cell] |= directions[k] | seen_marker
+            cells[neighbors[k]] |= back[k]
+            cell = neighbors[k]
+
+'''
+Aldous-Broder: a plain random walk that opens a passage whenever it steps into
+a cell it has not visited yet. Uniform like Wilson's, but slow to finish.
+Reference: https://weblog.jamisbuck.org/2011/1/17/maze-generation-aldous-broder-algorithm
+'''
+@register('aldous-broder')
+def aldous_broder(maze):
+    offsets, neighbors, directions, back, cells = _views(maze)
+    seen_marker = maze.SEEN_MARKER
+
+    randbelow = maze.rng.randbelow
+
+    cell = randbelow(maze.cell_count)
+    cells[cell] |= seen_marker
+    remaining = maze.cell_count - 1
+
+    while remaining:
+        k = offsets[cell] + randbelow(offsets[cell + 1] - offsets[cell])
+        n = neighbors[k]
+        if not cells[n] & seen_marker:
+            cells[cell] |= directions[k]
+            cells[n] |= back[k] | seen_marker
+            remaining -= 1
+        cell = n
+
+'''
+Hunt-and-kill: random walk through unvisited cells; when stuck, hunt for the
+first unvisited cell (in storage order) that borders the maze and continue from
+there. Instead of rescanning the grid, candidates for the hunt are kept in a
+heap as they appear, which finds the same cell a scan would.
+Reference: https://weblog.jamisbuck.org/2011/1/24/maze-generation-hunt-and-kill-algorithm
+'''
+@register('hunt-and-kill')
+def hunt_and_kill(maze, start=0):
+    offsets, neighbors, directions, back, cells = _views(maze)
+    seen_marker = maze.SEEN_MARKER
+    choice = maze.rng.choice
+
+    candidates = []
+
+    def visit(cell):
+        cells[cell] |= seen_marker
+        for k in range(offsets[cell], offsets[cell + 1]):
+            if not cells[neighbors[k]] & seen_marker:
+                heappush(candidates, neighbors[k])
+
+    cell = start
+    visit(cell)
+    while True:
+        # kill: walk to random unvisited neighbors until there are none
+        unvisited = [k for k in range(offsets[cell], offsets[cell + 1])
+                     if not cells[neighbors[k]] & seen_marker]
+        if unvisited:
+            k = choice(unvisited)
+            cells[cell] |= directions[k]
+            cells[neighbors[k]] |= back[k]
+            cell = neighbors[k]
+            visit(cell)
+            continue
+
+        # hunt: the lowest unvisited cell next to the maze
+        while candidates and cells[candidates[0]] & seen_marker:
+            heappop(candidates)
+        if not candidates:
+            break
+        cell = heappop(candidates)
+        inside = [k for k in range(offsets[cell], offsets[cell + 1])
+                  if cells[neighbors[k]] & seen_marker]
+        k = choice(inside)
+        cells[cell] |= directions[k]
+        cells[neighbors[k]] |= back[k]
+        visit(cell)
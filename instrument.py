@@ -0,0 +1,192 @@
+'''
+Opt-in instrumentation: per-phase timers and counters for the work a maze does.
+
+Every `maze.Maze` holds an `instrumentation` object and wraps its expensive
+steps in `phase()` blocks:
+
+    allocate  allocating the cell store in the constructor
+    generate  running a generation algorithm
+    render    rasterizing the image (counts `walls_drawn`)
+    save      encoding and writing the image (counts `bytes_written`)
+    svg       writing SVG output (counts `bytes_written`)
+    text      writing text output
+
+Code inside a phase can add to counters with `count()`; the backtracker counts
+`cells_visited`, `stack_pushes` and `stack_pops`. When a phase ends, its
+duration and the counters it collected are passed to every sink as an event,
+and added to running totals.
+
+By default mazes get `DISABLED`, whose `phase()` returns one shared do-nothing
+context manager and whose `count()` does nothing, so uninstrumented code pays
+a method call per phase and nothing per cell. Call `enable()` to instrument all
+mazes created afterwards, or assign an `Instrumentation` to one maze's
+`instrumentation` attribute.
+
+A sink is any callable taking `(event, instrumentation)`; see `log_sink`,
+`callback_sink` and `PrometheusSink`.
+'''
+from contextlib import contextmanager, nullcontext
+import logging
+import os
+import time
+
+'''
+Collects timings and counters and forwards them to sinks.
+'''
+class Instrumentation:
+    enabled = True
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        # running totals keyed by (phase, labels), labels being a sorted
+        # tuple of (name, value) pairs
+        self.seconds = {}
+        self.calls = {}
+        # keyed by (counter, phase, labels)
+        self.counters = {}
+        self.__events = [] # events of the phases currently running
+
+    '''
+    Context manager timing the phase `name`. `labels` (e.g. the maze class) are
+    attached to the event and used to key the totals. Yields the event dict,
+    which sinks receive with `seconds` and `counters` filled in.
+    '''
+    @contextmanager
+    def phase(self, name, **labels):
+        event = {'phase': name, 'labels': labels, 'counters': {}}
+        self.__events.append(event)
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event['seconds'] = time.perf_counter() - start
+            self.__events.pop()
+
+            key = (name, tuple(sorted(labels.items())))
+            self.seconds[key] = self.seconds.get(key, 0.0) + event['seconds']
+            self.calls[key] = self.calls.get(key, 0) + 1
+            for counter, n in event['counters'].items():
+                self.counters[(counter,) + key] = self.counters.get((counter,) + key, 0) + n
+
+            for sink in self.sinks:
+                sink(event, self)
+
+    '''
+    Add `n` to the counter `name` of the innermost running phase. Counts made
+    outside any phase are dropped.
+    '''
+    def count(self, name, n=1):
+        if self.__events:
+            counters = self.__events[-1]['counters']
+            counters[name] = counters.get(name, 0) + n
+
+    # Sinks do not travel between processes: a maze sent to another process
+    # gets the instrumentation that is current there.
+    def __reduce__(self):
+        return current, ()
+
+'''
+Stand-in used when instrumentation is off.
+'''
+class Disabled:
+    enabled = False
+
+    def phase(self, name, **labels):
+        return _NO_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+    def __reduce__(self):
+        return current, ()
+
+_NO_PHASE = nullcontext()
+DISABLED = Disabled()
+
+_current = DISABLED
+
+'''
+Instrumentation given to mazes when they are created.
+'''
+def current():
+    return _current
+
+'''
+Instrument every maze created from now on, sending events to `sinks`. Returns
+the shared `Instrumentation`.
+'''
+def enable(*sinks):
+    global _current
+    _current = Instrumentation(*sinks)
+    return _current
+
+'''
+Stop instrumenting mazes created from now on.
+'''
+def disable():
+    global _current
+    _current = DISABLED
+
+# Sinks
+
+'''
+Sink logging one line per phase to `logger` (default: this module's logger).
+'''
+def log_sink(logger=None, level=logging.INFO):
+    logger = logger or logging.getLogger(__name__)
+    def sink(event, instrumentation):
+        labels = ''.join(f" {k}={v}" for k, v in event['labels'].items())
+        counters = ''.join(f" {k}={v}" for k, v in event['counters'].items())
+        logger.log(level, "%s%s took %.6fs%s", event['phase'], labels, event['seconds'], counters)
+    return sink
+
+'''
+Sink calling `callback(event)` for every phase.
+'''
+def callback_sink(callback):
+    return lambda event, instrumentation: callback(event)
+
+'''
+Sink keeping a file in the Prometheus text exposition format up to date with
+the running totals, e.g. for node_exporter's textfile collector. The file is
+rewritten at most every `interval` seconds, atomically through a temporary
+file; call `write()` to force it.
+'''
+class PrometheusSink:
+    PREFIX = 'maze'
+
+    def __init__(self, path, interval=0.0):
+        self.path = path
+        self.interval = interval
+        self.last_write = None
+
+    def __call__(self, event, instrumentation):
+        now = time.monotonic()
+        if self.last_write is None or now - self.last_write >= self.interval:
+            self.write(instrumentation)
+            self.last_write = now
+
+    def write(self, instrumentation):
+        p = self.PREFIX
+        lines = [f"# TYPE {p}_phase_seconds_total counter"]
+        for (phase, labels), seconds in sorted(instrumentation.seconds.items()):
+            lines.append(f"{p}_phase_seconds_total{_labels(phase, labels)} {seconds!r}")
+        lines.append(f"# TYPE {p}_phase_calls_total counter")
+        for (phase, labels), calls in sorted(instrumentation.calls.items()):
+            lines.append(f"{p}_phase_calls_total{_labels(phase, labels)} {calls}")
+
+        names = sorted({key[0] for key in instrumentation.counters})
+        for name in names:
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            for (counter, phase, labels), n in sorted(instrumentation.counters.items()):
+                if counter == name:
+                    lines.append(f"{p}_{name}_total{_labels(phase, labels)} {n}")
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.path)
+
+def _labels(phase, labels):
+    pairs = (('phase', phase),) + labels
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
@@ -0,0 +1,218 @@
+'''
+Optional compiled kernels for the hottest loops, built with Numba when it is
+installed (`pip install numba`).
+
+The pure-Python loops in `generators.py`, `solve.py` and `lca.py` stay the
+reference implementations. Each kernel here does exactly what its reference
+does on the same arrays, drawing the same random numbers in the same order, so
+a seed generates the same maze with or without Numba. Callers check `enabled()`
+and fall back to the reference code otherwise.
+
+Kernels are compiled on first use and the machine code is cached next to this
+file. Set the environment variable MAZE_PURE_PYTHON=1, or call `disable()`, to
+use the reference code even when Numba is installed.
+'''
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+
+_enabled = AVAILABLE and not os.environ.get('MAZE_PURE_PYTHON')
+
+'''
+True iff the compiled kernels are in use.
+'''
+def enabled():
+    return _enabled
+
+'''
+Use the compiled kernels. Raises RuntimeError if Numba is not installed.
+'''
+def enable():
+    global _enabled
+    if not AVAILABLE:
+        raise RuntimeError("The compiled kernels need Numba, which is not installed")
+    _enabled = True
+
+'''
+Use the pure-Python reference code.
+'''
+def disable():
+    global _enabled
+    _enabled = False
+
+# Without Numba the kernels below are still importable as (slow) plain Python.
+_jit = numba.njit(cache=True, nogil=True) if AVAILABLE else (lambda f: f)
+
+'''
+Recursive backtracker, see `generators.backtracker` for the algorithm. The
+permutations of `range(d)` are rows `perm_first[d]` to `perm_first[d + 1]` of
+`perms`, in the order `generators._permutations` lists them. Random numbers are
+taken from `buffered` first, then from the NumPy `generator`, like
+`RandomSource.random()` does. Returns the peak stack size and how many
+numbers were taken from `buffered`.
+'''
+@_jit
+def backtracker(offsets, neighbors, directions, back, cells, seen_marker,
+                perms, perm_first, buffered, generator, start):
+    n = len(cells)
+    path = np.empty(n, dtype=np.int32)
+    orders = np.empty(n, dtype=np.int32) # row of `perms` per frame
+    cursors = np.empty(n, dtype=np.int32)
+    used = 0
+
+    # pick a random ordering for the start cell, as `pick_order` does
+    degree = offsets[start + 1] - offsets[start]
+    count = perm_first[degree + 1] - perm_first[degree]
+    if used < len(buffered):
+        x = buffered[used]
+        used += 1
+    else:
+        x = generator.random()
+
+    cells[start] |= seen_marker
+    path[0] = start
+    orders[0] = perm_first[degree] + int(x * count)
+    cursors[0] = 0
+    top = 1
+    peak = 1
+
+    while top > 0:
+        cell = path[top - 1]
+        row = orders[top - 1]
+        base = offsets[cell]
+        degree = offsets[cell + 1] - base
+        i = cursors[top - 1]
+
+        # advance this frame's cursor to the next unvisited neighbor
+        k = -1
+        while i < degree:
+            entry = base + perms[row, i]
+            i += 1
+            if not cells[neighbors[entry]] & seen_marker:
+                k = entry
+                break
+        if k < 0:
+            # dead end, backtrack
+            top -= 1
+            continue
+        cursors[top - 1] = i
+
+        nxt = neighbors[k]
+        cells[cell] |= directions[k]
+        cells[nxt] |= back[k] | seen_marker
+
+        degree = offsets[nxt + 1] - offsets[nxt]
+        count = perm_first[degree + 1] - perm_first[degree]
+        if used < len(buffered):
+            x = buffered[used]
+            used += 1
+        else:
+            x = generator.random()
+
+        path[top] = nxt
+        orders[top] = perm_first[degree] + int(x * count)
+        cursors[top] = 0
+        top += 1
+        if top > peak:
+            peak = top
+
+    return peak, used
+
+'''
+Breadth-first search from `source` over open passages, writing each reachable
+cell's number of steps into `field` (which must hold UNREACHABLE everywhere),
+see `solve.distance_field`.
+'''
+@_jit
+def distance_field(offsets, neighbors, directions, cells, source, field):
+    unreachable = field[source]
+    queue = np.empty(len(cells), dtype=np.int32)
+    queue[0] = source
+    field[source] = 0
+    head, tail = 0, 1
+    while head < tail:
+        cell = queue[head]
+        head += 1
+        d = field[cell] + 1
+        bits = cells[cell]
+        for k in range(offsets[cell], offsets[cell + 1]):
+            n = neighbors[k]
+            if bits & directions[k] and field[n] == unreachable:
+                field[n] = d
+                queue[tail] = n
+                tail += 1
+
+'''
+Breadth-first search from `root` over open passages, filling `parent` and
+`depth` (which must hold -1 everywhere), see `lca._bfs_tree`.
+'''
+@_jit
+def bfs_tree(offsets, neighbors, directions, cells, root, parent, depth):
+    queue = np.empty(len(cells), dtype=np.int32)
+    queue[0] = root
+    depth[root] = 0
+    head, tail = 0, 1
+    while head < tail:
+        cell = queue[head]
+        head += 1
+        d = depth[cell] + 1
+        bits = cells[cell]
+        for k in range(offsets[cell], offsets[cell + 1]):
+            n = neighbors[k]
+            if bits & directions[k] and depth[n] < 0:
+                depth[n] = d
+                parent[n] = cell
+                queue[tail] = n
+                tail += 1
+
+'''
+Breadth-first search from `start` to `goal` over open passages, see
+`solve.Solver.bfs`. Cells are marked visited by setting `stamps` to `mark`,
+`parent` receives the parent links and `queue` is scratch space for one entry
+per cell. Returns the path from `start` to `goal` as an int32 array, empty if
+`goal` cannot be reached.
+'''
+@_jit
+def bfs_path(offsets, neighbors, directions, cells, start, goal, parent, stamps, mark, queue):
+    stamps[start] = mark
+    parent[start] = -1
+    queue[0] = start
+    head, tail = 0, 1
+    found = start == goal
+    while head < tail and not found:
+        cell = queue[head]
+        head += 1
+        bits = cells[cell]
+        for k in range(offsets[cell], offsets[cell + 1]):
+            if not bits & directions[k]:
+                continue
+            n = neighbors[k]
+            if stamps[n] != mark:
+                stamps[n] = mark
+                parent[n] = cell
+                if n == goal:
+                    found = True
+                    break
+                queue[tail] = n
+                tail += 1
+    if not found:
+        return np.empty(0, dtype=np.int32)
+
+    length = 0
+    cell = goal
+    while cell >= 0:
+        length += 1
+        cell = parent[cell]
+    path = np.empty(length, dtype=np.int32)
+    cell = goal
+    for i in range(length - 1, -1, -1):
+        path[i] = cell
+        cell = parent[cell]
+    return path
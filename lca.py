@@ -0,0 +1,159 @@
+'''
+Lowest-common-ancestor index for answering many shortest-path queries on one
+generated maze.
+
+A generated maze is a spanning tree of its cells, so the only path between two
+cells goes up from each of them to their lowest common ancestor in the tree
+rooted anywhere. After an O(n log n) build with binary lifting, path lengths
+take O(log n) per query, whole batches of queries are answered with NumPy array
+operations, and paths are produced lazily.
+'''
+import numpy as np
+
+import kernels
+
+class TreeIndex:
+    '''
+    Index the passages of `maze` as a tree rooted at cell `root` (a flat id).
+    The maze must be connected; cells that cannot be reached from the root have
+    depth -1 and cannot be queried.
+    '''
+    def __init__(self, maze, root=0):
+        self.root = root
+        self.parent, self.depth = _bfs_tree(maze, root)
+
+        # up[j][c] is the 2^j-th ancestor of c, with the root its own parent
+        levels = max(1, int(self.depth.max()).bit_length())
+        up = np.empty((levels, maze.cell_count), dtype=np.int32)
+        up[0] = np.where(self.parent < 0, np.arange(maze.cell_count), self.parent)
+        for j in range(1, levels):
+            up[j] = up[j - 1][up[j - 1]]
+        self.up = up
+
+        self.__up_views = [memoryview(row) for row in up]
+        self.__depth_view = memoryview(self.depth)
+
+    '''
+    The lowest common ancestor of cells `u` and `v`.
+    '''
+    def lca(self, u, v):
+        up, depth = self.__up_views, self.__depth_view
+        self.__check(u)
+        self.__check(v)
+        if depth[u] < depth[v]:
+            u, v = v, u
+        u = self.ancestor(u, depth[u] - depth[v])
+        if u == v:
+            return u
+        for j in range(len(up) - 1, -1, -1):
+            if up[j][u] != up[j][v]:
+                u, v = up[j][u], up[j][v]
+        return up[0][u]
+
+    '''
+    The ancestor `k` levels above cell `cell`.
+    '''
+    def ancestor(self, cell, k):
+        up = self.__up_views
+        j = 0
+        while k:
+            if k & 1:
+                cell = up[j][cell]
+            k >>= 1
+            j += 1
+        return cell
+
+    '''
+    Number of steps on the path between cells `u` and `v`.
+    '''
+    def distance(self, u, v):
+        depth = self.__depth_view
+        return depth[u] + depth[v] - 2*depth[self.lca(u, v)]
+
+    '''
+    Lowest common ancestors of many pairs at once. `us` and `vs` are equal-length
+    integer arrays of flat ids.
+    '''
+    def lca_batch(self, us, vs):
+        us = np.asarray(us, dtype=np.int64)
+        vs = np.asarray(vs, dtype=np.int64)
+        if (self.depth[us] < 0).any() or (self.depth[vs] < 0).any():
+            raise ValueError("Cells not connected to the root cannot be queried")
+
+        # make `us` the deeper ones and lift them to the depth of `vs`
+        swap = self.depth[us] < self.depth[vs]
+        us, vs = np.where(swap, vs, us), np.where(swap, us, vs)
+        diff = self.depth[us] - self.depth[vs]
+        for j in range(len(self.up)):
+            us = np.where((diff >> j) & 1, self.up[j][us], us)
+
+        # then lift both while their ancestors differ
+        for j in range(len(self.up) - 1, -1, -1):
+            pu, pv = self.up[j][us], self.up[j][vs]
+            move = pu != pv
+            us = np.where(move, pu, us)
+            vs = np.where(move, pv, vs)
+        return np.where(us == vs, us, self.up[0][us])
+
+    '''
+    Path lengths for many pairs at once. `pairs` is an integer array of shape
+    (n, 2) holding flat ids; returns an int array of n lengths.
+    '''
+    def distances(self, pairs):
+        pairs = np.asarray(pairs, dtype=np.int64)
+        us, vs = pairs[:, 0], pairs[:, 1]
+        lcas = self.lca_batch(us, vs)
+        return self.depth[us] + self.depth[vs] - 2*self.depth[lcas]
+
+    '''
+    Generator over the cells on the path from `u` to `v`, both included. Cells
+    are produced on demand: the way up from `u` follows parent links, the way
+    down to `v` looks up ancestors of `v` with binary lifting.
+    '''
+    def path(self, u, v):
+        depth = self.__depth_view
+        parent = memoryview(self.parent)
+        top = self.lca(u, v)
+
+        while u != top:
+            yield u
+            u = parent[u]
+        yield top
+        for k in range(depth[v] - depth[top] - 1, -1, -1):
+            yield self.ancestor(v, k)
+
+    def __check(self, cell):
+        if self.__depth_view[cell] < 0:
+            raise ValueError(f"Cell {cell} is not connected to the root")
+
+'''
+Breadth-first search over the open passages of `maze` from `root`, returning
+each cell's parent (-1 for the root and unreachable cells) and depth (-1 for
+unreachable cells) as int32 arrays.
+'''
+def _bfs_tree(maze, root):
+    adj = maze.adjacency()
+    parent = np.full(maze.cell_count, -1, dtype=np.int32)
+    depth = np.full(maze.cell_count, -1, dtype=np.int32)
+    if kernels.enabled():
+        kernels.bfs_tree(adj.offsets, adj.neighbors, adj.directions, maze.cells,
+                         root, parent, depth)
+        return parent, depth
+
+    offsets, neighbors = memoryview(adj.offsets), memoryview(adj.neighbors)
+    directions = memoryview(adj.directions)
+    cells = memoryview(maze.cells)
+    parents, depths = memoryview(parent), memoryview(depth)
+    depths[root] = 0
+
+    queue = [root]
+    for cell in queue:
+        d = depths[cell] + 1
+        bits = cells[cell]
+        for k in range(offsets[cell], offsets[cell + 1]):
+            n = neighbors[k]
+            if bits & directions[k] and depths[n] < 0:
+                depths[n] = d
+                parents[n] = cell
+                queue.append(n)
+    return parent, depth
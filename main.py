@@ -1,5 +1,6 @@
 from cartesian_maze import CartesianMaze
 from pointy_hexagon_maze import PointyHexagonMaze
+from polar_maze import PolarMaze
 from triangle_maze import TriangleMaze
 
 if __name__ == '__main__':
@@ -14,4 +15,8 @@ if __name__ == '__main__':
 
     maze = TriangleMaze(40)
     maze.generate()
-    maze.render_to_png('triangle')
\ No newline at end of file
+    maze.render_to_png('triangle')
+
+    maze = PolarMaze(20)
+    maze.generate()
+    maze.render_to_png('polar')
@@ -1,66 +1,421 @@
 '''
 Maze class from which implementation classes inherit methods.
 '''
+from collections import OrderedDict
+
+import generators
+import instrument
+from lca import TreeIndex
+import raster
+from rng import RandomSource
+import solve
+import svg
+
+import numpy as np
+
+'''
+Neighbor table for one maze topology and size, stored CSR-style. The neighbors
+of cell `i` are `neighbors[offsets[i]:offsets[i+1]]`; `directions` holds the
+direction bit that leads from `i` to each of them and `back` the bit that leads
+from the neighbor back to `i`. Cells are identified by their index into the
+flat cell store.
+'''
+class Adjacency:
+    def __init__(self, offsets, neighbors, directions, back):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.directions = directions
+        self.back = back
+
+    '''
+    Build the CSR table from a dense `(cells, len(bits))` table of neighbor ids,
+    where column `k` holds the neighbor in direction `bits[k]` or -1 when that
+    neighbor is out of bounds. `opposite` maps each direction to its reverse.
+    '''
+    @classmethod
+    def from_table(cls, table, bits, opposite):
+        valid = table >= 0
+        offsets = np.zeros(len(table) + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=offsets[1:])
+
+        # mask the per-column bits directly rather than through an int64 array
+        # of column indices, which would be the largest array built here
+        back = np.asarray([opposite[b] for b in bits], dtype=np.uint8)
+        bits = np.asarray(bits, dtype=np.uint8)
+        return cls(offsets,
+                   table[valid].astype(np.int32, copy=False),
+                   np.broadcast_to(bits, table.shape)[valid],
+                   np.broadcast_to(back, table.shape)[valid])
+
+    '''
+    Number of cells described by the table.
+    '''
+    def __len__(self):
+        return len(self.offsets) - 1
+
+'''
+Adjacency tables and cell coordinates only depend on the maze class and size,
+so they are built once and shared by every maze of that shape. They take about
+40 bytes per cell, many times the cell store itself, so the cache is bounded by
+bytes rather than by entries: the tables of the least recently used shapes are
+dropped once the cache holds more than TABLE_CACHE_BYTES. The tables of the
+shape in use are always kept, even when they alone are larger than that.
+'''
+TABLE_CACHE_BYTES = 64 << 20
+
+_tables = OrderedDict() # (cls, size) -> {kind: table}
+_table_bytes = 0
+
+def _cached_table(kind, cls, size, build):
+    global _table_bytes
+    key = (cls, size)
+    tables = _tables.setdefault(key, {})
+    _tables.move_to_end(key)
+    if kind in tables:
+        return tables[kind]
+
+    table = tables[kind] = build()
+    _table_bytes += _nbytes(table)
+    while _table_bytes > TABLE_CACHE_BYTES and len(_tables) > 1:
+        _, evicted = _tables.popitem(last=False)
+        _table_bytes -= sum(_nbytes(t) for t in evicted.values())
+    return table
+
+# bytes held by the arrays of an `Adjacency` or a tuple of arrays
+def _nbytes(table):
+    arrays = vars(table).values() if isinstance(table, Adjacency) else table
+    return sum(a.nbytes for a in arrays)
+
+'''
+Drop every cached adjacency and coordinate table.
+'''
+def clear_table_cache():
+    global _table_bytes
+    _tables.clear()
+    _table_bytes = 0
+
+def _adjacency(cls, size):
+    return _cached_table('adjacency', cls, size, lambda: cls._build_adjacency(size))
+
+def _coordinates(cls, size):
+    def build():
+        coords = cls._build_coordinates(size)
+        for a in coords:
+            a.setflags(write=False)
+        return coords
+    return _cached_table('coordinates', cls, size, build)
+
+# distance fields kept per maze by `Maze.distances()`
+DISTANCE_FIELDS_CACHED = 4
+
 class Maze:
+    SPARSE = False # True for mazes searched without per-cell arrays, see `solve.solve`
+
+    # Mazes have a fixed set of attributes; implementation classes add their
+    # own dimensions. `peak_stack_size` is set by the backtracker.
+    __slots__ = ('seed', 'rng', 'algorithm', 'instrumentation', 'size',
+                 'row_offsets', 'cells', 'grid', '_derived', 'peak_stack_size')
+
     '''
     Initialize a maze. `side` = side length. Initially the maze has no pathways.
+    `seed` seeds the maze's random number source, see `_seed`. `cells` is an
+    existing cell store to use instead of allocating one, see `_allocate_cells`.
     '''
-    def __init__(self, side):
+    def __init__(self, side, seed=None, cells=None):
         raise NotImplementedError("Constructor must be implemented")
 
     '''
-    Returns True iff the cell represented by `coords` lies within the maze.
-    `coords` is a list of integers. The interpretation of `coords` is up to the
-    implementation class. Examples:
-    1. For a Cartesian maze `coords` would be a list of 2 ints.
-    2. For a hex maze using cube coordinates `coords` would be a list of 3 ints.
+    Set up the maze's own random number source from `seed`, which may be None,
+    an int, a `random.Random` or a NumPy `Generator` (see `rng.RandomSource`).
+    The same seed always generates the same maze. Implementation classes call
+    this from their constructor.
+    '''
+    def _seed(self, seed):
+        self.seed = seed if isinstance(seed, int) else None
+        self.rng = RandomSource(seed)
+        self.algorithm = None # set by generate()
+
+    '''
+    Allocate the cell store shared by all implementation classes. Every cell is
+    one byte holding the direction bits and the seen marker, and all rows live
+    back to back in the flat `uint8` array `self.cells`. `row_lengths` gives the
+    number of cells in each row; row `r` occupies
+    `self.cells[self.row_offsets[r]:self.row_offsets[r+1]]`.
+
+    If `cells` is given it is used as the store instead, without copying. It
+    can be any 1D `uint8` array of the right length, e.g. one backed by a
+    memory-mapped file.
     '''
-    def __in_bounds(self, coords):
-        raise NotImplementedError("Abstract method `in_bounds` must be implemented")
+    def _allocate_cells(self, row_lengths, cells=None):
+        # see `instrument.py`
+        self.instrumentation = instrument.current()
+
+        with self._phase('allocate'):
+            self.row_offsets = np.zeros(len(row_lengths) + 1, dtype=np.int64)
+            np.cumsum(row_lengths, out=self.row_offsets[1:])
+            count = int(self.row_offsets[-1])
+
+            # results derived from the walls, see `invalidate`
+            self._derived = {}
+
+            if cells is None:
+                self.cells = np.zeros(count, dtype=np.uint8)
+            elif cells.dtype != np.uint8 or cells.shape != (count,):
+                raise ValueError(f"Expected {count} uint8 cells, got {cells.dtype} array of shape {cells.shape}")
+            else:
+                self.cells = cells
+
+    '''
+    Context manager timing the phase `name` of this maze's work, see
+    `instrument.py`. Does nothing unless instrumentation is enabled.
+    '''
+    def _phase(self, name):
+        return self.instrumentation.phase(name, maze=type(self).__name__)
+
+    '''
+    Return one view per row into the flat cell store. The views share memory
+    with `self.cells`, so `views[r][i] |= bit` writes straight through. Used by
+    the ragged layouts to keep `self.grid[r][i]` indexing working.
+    '''
+    def _row_views(self):
+        offsets = self.row_offsets.tolist()
+        return [self.cells[a:b] for a, b in zip(offsets, offsets[1:])]
+
+    '''
+    Set `self.grid`, the per-row views into the cell store. Implementation
+    classes with another layout override this.
+    '''
+    def _attach_grid(self):
+        self.grid = self._row_views()
+
+    # Pickled views would come back as copies detached from `cells`, so `grid`
+    # is left out and rebuilt from the unpickled store. Derived results are
+    # left out too and recomputed on demand.
+    def __getstate__(self):
+        slots = [name for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())]
+        return {name: getattr(self, name) for name in slots
+                if name not in ('grid', '_derived') and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._derived = {}
+        self._attach_grid()
 
     '''
-    Returns True iff the cell represented by `coords` has a wall in the direction
-    `direction`. `coords` is a list of integers and `direction`'s representation
-    depends on the kind of maze.
+    Return the (cached) adjacency table for this maze's topology and size. The
+    implementation class sets `self.size` and provides a `_build_adjacency`
+    classmethod that takes it.
     '''
-    def __has_wall(self, coords, direction):
-        raise NotImplementedError("Abstract method `__has_wall` must be implemented")
+    def adjacency(self):
+        return _adjacency(type(self), self.size)
 
     '''
-    Generator function to yield a list of neighbor cells for the cell located at
-    # `coords`. Implementations will usually end up calling self.in_bounds(coords).
+    Return the (cached) coordinates of every cell as a pair of int32 arrays
+    indexed by flat cell id. The coordinate system is the implementation
+    class's own, the one `cell_id` takes.
     '''
-    def __neighbors(self, coords):
-        raise NotImplementedError("Abstract method `neighbors` must be implemented")
+    def coordinates(self):
+        return _coordinates(type(self), self.size)
 
     '''
-    Print out a maze as characters.
+    Coordinates of the cell with flat id `cell`, the inverse of `cell_id`.
     '''
-    def render_to_text(self):
+    def cell_coords(self, cell):
+        a, b = self.coordinates()
+        return int(a[cell]), int(b[cell])
+
+    '''
+    Flat id of the cell at the given coordinates.
+    '''
+    def cell_id(self, *coords):
+        raise NotImplementedError("Abstract method `cell_id` must be implemented")
+
+    '''
+    Build the coordinate arrays returned by `coordinates()` for a maze of size
+    `size`.
+    '''
+    @classmethod
+    def _build_coordinates(cls, size):
+        raise NotImplementedError("Abstract method `_build_coordinates` must be implemented")
+
+    '''
+    Total number of cells in the maze.
+    '''
+    @property
+    def cell_count(self):
+        return len(self.cells)
+
+    '''
+    Return True iff cell `cell` (a flat id) has a wall in direction `direction`.
+    When the bitwise AND of a cell and a direction is 0 there is no connection
+    in that direction, so there is a wall there.
+    '''
+    def has_wall(self, cell, direction):
+        return self.cells[cell] & direction == 0
+
+    '''
+    Build the `Adjacency` table for a maze of size `size` (whatever the
+    implementation class stores in `self.size`). Called once per class and size;
+    see `adjacency()`.
+    '''
+    @classmethod
+    def _build_adjacency(cls, size):
+        raise NotImplementedError("Abstract method `_build_adjacency` must be implemented")
+
+    '''
+    Print out a maze as text to `file` (default: standard output) in `style`,
+    'ascii' or 'unicode' (see `text.py`).
+    '''
+    def render_to_text(self, file=None, style='ascii'):
         raise NotImplementedError("Abstract method `render_to_text` must be implemented")
 
     '''
-    Render a maze to a PNG file.
+    Number of cells of a maze built with the constructor arguments `dims` (the
+    side, and for Cartesian mazes optionally the number of columns), without
+    building it.
     '''
-    def render_to_png(self, filename):
-        raise NotImplementedError("Abstract method `render_to_png` must be implemented")
+    @classmethod
+    def count_cells(cls, *dims):
+        raise NotImplementedError("Abstract method `count_cells` must be implemented")
 
     '''
-    Generate the walls and connections of the maze.
+    `(width, height)` in pixels of the image `render_image` draws for a maze
+    built with the constructor arguments `dims`. Implementation classes derive
+    it from their output scale `SC` and padding `M`, which their renderers use.
     '''
-    def generate(self):
-        raise NotImplementedError("Abstract method `generate` must be implemented")
+    @classmethod
+    def image_size(cls, *dims):
+        raise NotImplementedError("Abstract method `image_size` must be implemented")
 
-    # Private methods
+    '''
+    Render a maze to a Pillow image in `mode`, one of `raster.MODES`.
+    '''
+    def render_image(self, mode='L'):
+        raise NotImplementedError("Abstract method `render_image` must be implemented")
+
+    '''
+    Render a maze to PNG. Given a `filename`, writes `./img/{filename}.png` (the
+    directory must exist) and prints its path. Otherwise writes to `file`, a
+    path or a binary file-like object, or returns the PNG as bytes if `file` is
+    None too. `options` are those of `write_image`.
+    '''
+    def render_to_png(self, filename=None, file=None, **options):
+        if filename is not None:
+            file = f"./img/{filename}.png"
+            print(f"Writing maze to {file}")
+        data = self.write_image(file, 'png', **options)
+        return data if file is None else None
 
     '''
-    Check if the cell at `coords` was "seen" during maze generation.
+    Render a maze and encode it as `format` ('png', 'webp' or 'qoi') in `mode`
+    ('L', the default, 'RGB', or '1' and 'P' for 1 bit per pixel), see
+    `raster.py`. Writes
+    it to `file`, a path or a binary file-like object, if given, and returns the
+    encoded bytes.
     '''
-    def __seen(self, coords):
-        raise NotImplementedError("Abstract method `__seen` must be implemented")
+    def write_image(self, file=None, format='png', mode='L', compress_level=6, optimize=False):
+        with self._phase('render'):
+            image = self.render_image(mode)
+        with self._phase('save'):
+            data = raster.save_image(image, file, format, compress_level, optimize)
+            self.instrumentation.count('bytes_written', len(data))
+        return data
 
     '''
-    Mark the cell at `coords` as "seen" during maze generation.
+    Describe the picture `render_image` draws as `(width, height, polylines,
+    segments)`: the image size in pixels, a list of point lists for the
+    boundary, and the walls as four arrays `x0, y0, x1, y1` of segment ends.
+    With `owners=True` a fifth item `(cells, directions)` gives the flat id and
+    direction bit of the wall each segment draws.
     '''
-    def __mark_seen(self, coords):
-        raise NotImplementedError("Abstract method `__mark_seen` must be implemented")
\ No newline at end of file
+    def wall_geometry(self, owners=False):
+        raise NotImplementedError("Abstract method `wall_geometry` must be implemented")
+
+    '''
+    Render a maze to an SVG file with the same geometry as `render_to_png`.
+    Collinear walls that touch are merged into single lines, see `svg.py`.
+    '''
+    def render_to_svg(self, filename):
+        path = f"./img/{filename}.svg"
+        print(f"Writing maze to {path}")
+        with self._phase('svg'), open(path, 'w') as f:
+            svg.write_svg(f, *self.wall_geometry())
+            self.instrumentation.count('bytes_written', f.tell())
+
+    '''
+    Generate the walls and connections of the maze with the generation algorithm
+    registered as `algorithm`, see `generators.py`. Implementation classes set
+    `TOPOLOGY` so that algorithms can tell which kinds of mazes they support.
+    '''
+    def generate(self, algorithm='backtracker'):
+        with self._phase('generate'):
+            generators.generate(self, algorithm)
+        self.algorithm = algorithm
+        self.invalidate()
+
+    '''
+    Run the recursive backtracker from the cell with flat id `start`, yielding a
+    carve event `(cell, direction)` for every wall it opens, see
+    `generators.backtracker_events`. The walls open as the generator is
+    consumed; once it is exhausted the maze is the one `carve_passages_from`
+    would have generated. Events can be recorded and animated with
+    `animation.py`.
+    '''
+    def carve_events(self, start=0):
+        self.invalidate()
+        yield from generators.backtracker_events(self, start)
+        self.algorithm = 'backtracker'
+        self.invalidate()
+
+    '''
+    Forget all cached results derived from the walls (distance fields, the
+    diameter, the tree index). `generate()` and `carve_passages_from()` call
+    this; call it after modifying `cells` or `grid` by hand.
+    '''
+    def invalidate(self):
+        self._derived.clear()
+
+    '''
+    Number of steps from cell `source` (a flat id) to every cell, as a uint32
+    array indexed by flat id, see `solve.distance_field`. The array is cached
+    until the walls change and must not be modified.
+    '''
+    def distances(self, source=0):
+        key = ('distances', source)
+        if key not in self._derived:
+            fields = [k for k in self._derived if k[0] == 'distances']
+            if len(fields) >= DISTANCE_FIELDS_CACHED:
+                del self._derived[fields[0]]
+            field = solve.distance_field(self, source)
+            field.setflags(write=False)
+            self._derived[key] = field
+        return self._derived[key]
+
+    '''
+    The two cells farthest apart and the number of steps between them, as
+    `(a, b, length)`. Generated mazes are spanning trees, so the farthest cell
+    from any cell is one end of a longest path, and a second search from there
+    finds the other end. Two BFS passes, cached until the walls change.
+    '''
+    def diameter(self):
+        if 'diameter' not in self._derived:
+            a = int(np.argmax(self.__reachable(self.distances(0))))
+            field = self.__reachable(self.distances(a))
+            b = int(np.argmax(field))
+            self._derived['diameter'] = (a, b, int(field[b]))
+        return self._derived['diameter']
+
+    '''
+    Lowest-common-ancestor index over the maze's passages, for fast repeated
+    shortest-path queries (see `lca.TreeIndex`). Built on first use and cached
+    until the walls change.
+    '''
+    def tree_index(self):
+        if 'tree_index' not in self._derived:
+            self._derived['tree_index'] = TreeIndex(self)
+        return self._derived['tree_index']
+
+    # distances with unreachable cells counted as 0, for picking the farthest
+    def __reachable(self, field):
+        return np.where(field == solve.UNREACHABLE, 0, field)
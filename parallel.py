@@ -0,0 +1,215 @@
+'''
+Generate one large Cartesian maze on several cores.
+
+Generation algorithms are sequential, so a single maze normally uses one core
+however large it is. Here the grid is split into rectangular regions of at most
+`region` x `region` cells, and each region is generated as a maze of its own in
+a worker process and written into its place in a shared memory segment laid
+out like the maze's cell store. The segment then becomes the maze's store, so
+the full grid is never copied and workers only hold one region each.
+
+The regions are then joined into one perfect maze: regions are the nodes of a
+grid graph whose edges are the boundaries between neighboring regions, and a
+random spanning tree of that graph is picked with randomized Kruskal's and a
+union-find. For each tree edge exactly one wall is opened, at a random position
+along the boundary, so every cell is connected to every other by exactly one
+path.
+
+Each region draws from its own random stream, derived from numbers drawn from
+`maze.rng` and the region's position, so the maze only depends on the maze's
+seed, the algorithm and the region size, not on the number of workers.
+
+Usage:
+    python parallel.py --side 20000 --workers 8 --seed 1 -o big.maze
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import time
+import weakref
+
+import numpy as np
+
+from cartesian_maze import CartesianMaze, S, E, W, N
+import generators
+import serialize
+
+DEFAULT_REGION = 1024
+
+'''
+Generate the Cartesian `maze` in place, one region of at most `region` x
+`region` cells at a time, with the algorithm registered as `algorithm`, on
+`workers` processes (default: one per CPU). With `workers=1` the regions are
+generated in this process, which gives the same maze. The maze's cell store is
+replaced by the shared memory the regions were generated into.
+'''
+def generate(maze, algorithm='backtracker', workers=None, region=DEFAULT_REGION):
+    if maze.TOPOLOGY != 'cartesian':
+        raise ValueError(f"Parallel generation needs a Cartesian maze, got a {maze.TOPOLOGY} maze")
+    gen = generators.GENERATORS.get(algorithm)
+    if gen is None or not gen.supports(maze.TOPOLOGY):
+        raise ValueError(f"Algorithm {algorithm!r} cannot generate regions, "
+                         f"expected one of {generators.available(maze.TOPOLOGY)}")
+    if region < 1:
+        raise ValueError(f"Regions must be at least 1 cell wide, got {region}")
+
+    regions = _regions(maze.rows, maze.cols, region)
+    entropy = [int(x) for x in maze.rng.floats(2) * (1 << 53)]
+
+    with maze._phase('generate'):
+        peaks = _generate_regions(maze, regions, entropy, algorithm, workers)
+        _stitch(maze, regions, region)
+        maze.instrumentation.count('regions', len(regions))
+
+    maze.algorithm = algorithm
+    if None not in peaks:
+        maze.peak_stack_size = max(peaks)
+    maze.invalidate()
+
+'''
+Bounds `(r0, r1, c0, c1)` (ends exclusive) of the regions of a `rows` x `cols`
+grid, row by row of regions.
+'''
+def _regions(rows, cols, region):
+    return [(r0, min(r0 + region, rows), c0, min(c0 + region, cols))
+            for r0 in range(0, rows, region)
+            for c0 in range(0, cols, region)]
+
+# Generate every region into a shared memory segment laid out like the maze's
+# cell store, which then becomes the store. Returns each region's peak stack
+# size (None for algorithms that do not report one).
+def _generate_regions(maze, regions, entropy, algorithm, workers):
+    jobs = [(maze.rows, maze.cols, bounds, entropy + [bounds[0], bounds[2]], algorithm)
+            for bounds in regions]
+    peaks = [None] * len(regions)
+
+    workers = workers or os.cpu_count() or 1
+    shm = shared_memory.SharedMemory(create=True, size=max(1, maze.cell_count))
+    try:
+        if workers == 1:
+            for k, job in enumerate(jobs):
+                peaks[k] = _generate_region(shm.name, *job)
+        else:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                futures = {pool.submit(_generate_region, shm.name, *job): k
+                           for k, job in enumerate(jobs)}
+                for future in as_completed(futures):
+                    peaks[futures[future]] = future.result()
+        cells = np.ndarray((maze.cell_count,), dtype=np.uint8, buffer=shm.buf)
+    except BaseException:
+        _close(shm)
+        raise
+    finally:
+        shm.unlink()
+
+    # the segment stays mapped for as long as the store is in use
+    weakref.finalize(cells, _close, shm)
+    maze.cells = cells
+    maze._attach_grid()
+    return peaks
+
+# Unmap `shm`. This fails with BufferError while views of its buffer are alive,
+# e.g. held by a traceback; the mapping then goes away with the last view, and
+# the error being handled is not replaced by this one.
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+'''
+Generate the region `bounds` = `(r0, r1, c0, c1)` of a `rows` x `cols` maze
+as a maze of its own and write it into its place in the shared memory segment
+`name`. Runs in a worker process. Returns the peak stack size if the
+algorithm reports one.
+'''
+def _generate_region(name, rows, cols, bounds, seed, algorithm):
+    r0, r1, c0, c1 = bounds
+    region = CartesianMaze(r1 - r0, c1 - c0, seed=np.random.default_rng(seed))
+    region.generate(algorithm)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        grid = np.ndarray((rows, cols), dtype=np.uint8, buffer=shm.buf)
+        grid[r0:r1, c0:c1] = region.grid
+        del grid
+    finally:
+        _close(shm)
+    return getattr(region, 'peak_stack_size', None)
+
+# Join the regions with a random spanning tree of the region graph, opening one
+# wall at a random position along the boundary for every tree edge.
+def _stitch(maze, regions, region):
+    across = -(-maze.cols // region)
+    count = len(regions)
+
+    # boundaries as (region, region to the east or south of it, True if east);
+    # with a single column of regions b == a + 1 for south edges too
+    ids = np.arange(count)
+    east = ids[(ids % across) + 1 < across]
+    south = ids[ids + across < count]
+    edges = np.concatenate((np.stack((east, east + 1, np.ones_like(east)), axis=1),
+                            np.stack((south, south + across, np.zeros_like(south)), axis=1)))
+
+    # shuffle by sorting on one random key per edge, and pick each edge's
+    # position along its boundary, all drawn in bulk
+    order = np.argsort(maze.rng.floats(len(edges)), kind='stable')
+    edges = edges[order]
+    where = maze.rng.floats(len(edges))
+
+    parent = list(range(count))
+    size = [1] * count
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    cells, bits = [], []
+    for (a, b, eastward), t in zip(edges.tolist(), where.tolist()):
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+        if size[ra] < size[rb]:
+            ra, rb = rb, ra
+        parent[rb] = ra
+        size[ra] += size[rb]
+
+        r0, r1, c0, c1 = regions[a]
+        if eastward:
+            # the boundary is region a's last column
+            r = r0 + int(t * (r1 - r0))
+            cells += [r*maze.cols + c1 - 1, r*maze.cols + c1]
+            bits += [E, W]
+        else:
+            # the boundary is region a's last row
+            c = c0 + int(t * (c1 - c0))
+            cells += [(r1 - 1)*maze.cols + c, r1*maze.cols + c]
+            bits += [S, N]
+
+    np.bitwise_or.at(maze.cells, np.asarray(cells, dtype=np.int64),
+                     np.asarray(bits, dtype=np.uint8))
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Generate one large Cartesian maze on several cores.")
+    parser.add_argument('--side', type=int, required=True, help="rows (and columns unless --cols is given)")
+    parser.add_argument('--cols', type=int)
+    parser.add_argument('--algorithm', default='backtracker')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--region', type=int, default=DEFAULT_REGION, help="region side in cells")
+    parser.add_argument('-o', '--output', help="save the maze to this file (see serialize.py)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+    maze = CartesianMaze(args.side, args.cols, seed=args.seed)
+    start = time.perf_counter()
+    generate(maze, args.algorithm, args.workers, args.region)
+    print(f"Generated {maze.rows}x{maze.cols} in {time.perf_counter() - start:.2f}s")
+    if args.output:
+        serialize.save(maze, args.output)
+        print(f"Wrote maze to {args.output}")
@@ -0,0 +1,185 @@
+'''
+Minimal streaming PNG encoder. Pillow needs the whole image in memory before it
+can save it, which rules it out for mazes that are generated row by row. This
+writer takes the image a band of scanlines at a time and only ever holds one
+band plus the zlib state.
+
+Output is grayscale, 8 bits per pixel in 'L' mode or 1 bit per pixel in '1'
+mode (pixels darker than mid-gray black, the others white), every scanline with
+filter type 0 (None).
+
+`ApngWriter` writes animated PNGs in the same modes, where every frame after
+the first only covers the rectangle that changed.
+'''
+import shutil
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IDAT_SIZE = 1 << 16 # flush compressed data in chunks of about this size
+
+class PngWriter:
+    MODES = {'L': 8, '1': 1} # bit depth per mode
+
+    '''
+    `file` is a binary file object. `width` and `height` are in pixels and the
+    caller must write exactly `height` scanlines before calling `close()`.
+    '''
+    def __init__(self, file, width, height, compress_level=6, mode='L'):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported mode {mode!r} for streamed PNGs, expected one of {tuple(self.MODES)}")
+        self.file = file
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.pending = []
+        self.pending_size = 0
+
+        self.file.write(SIGNATURE)
+        # color type 0 (grayscale), default compression, filter and interlace
+        # methods
+        _chunk(self.file, b'IHDR', _ihdr(width, height, mode))
+
+    '''
+    Write a band of scanlines. `band` is a 2D uint8 NumPy array of shape
+    (rows, width).
+    '''
+    def write(self, band):
+        if band.shape[1] != self.width:
+            raise ValueError(f"band is {band.shape[1]} pixels wide, expected {self.width}")
+        self.rows_written += band.shape[0]
+        if self.rows_written > self.height:
+            raise ValueError(f"more than {self.height} rows written")
+        self.__compress(_scanlines(band, self.mode))
+
+    '''
+    Finish the image. Raises ValueError if fewer rows than promised were
+    written.
+    '''
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"{self.rows_written} rows written, expected {self.height}")
+        self.pending.append(self.compressor.flush())
+        self.__flush_idat()
+        _chunk(self.file, b'IEND', b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def __compress(self, data):
+        out = self.compressor.compress(data)
+        if out:
+            self.pending.append(out)
+            self.pending_size += len(out)
+        if self.pending_size >= IDAT_SIZE:
+            self.__flush_idat()
+
+    def __flush_idat(self):
+        data = b''.join(self.pending)
+        if data:
+            _chunk(self.file, b'IDAT', data)
+        self.pending = []
+        self.pending_size = 0
+
+'''
+Animated PNG (APNG) writer. The first frame is the whole image and doubles as
+the still image shown by viewers without APNG support; every later frame is a
+rectangle of pixels drawn over the previous frame (dispose op NONE, blend op
+SOURCE), so a frame that changes a few pixels costs a few bytes.
+
+The frame count goes into the header, before any frame, so frames are spooled
+(compressed) to a temporary file until `close()` writes the whole animation to
+`file`, a binary file object.
+'''
+class ApngWriter:
+    MODES = PngWriter.MODES
+
+    '''
+    `first` is the first frame as a 2D uint8 array, shown for `delay` (a
+    fraction `(numerator, denominator)` of a second). `plays` is the number of
+    times the animation runs, 0 for forever.
+    '''
+    def __init__(self, file, first, delay=(1, 10), plays=0, compress_level=6, mode='L'):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported mode {mode!r} for animated PNGs, expected one of {tuple(self.MODES)}")
+        self.file = file
+        self.height, self.width = first.shape
+        self.plays = plays
+        self.compress_level = compress_level
+        self.mode = mode
+        self.frames = 1
+        self.sequence = 1 # sequence number 0 is the first frame's fcTL
+        self.spool = tempfile.SpooledTemporaryFile(max_size=1 << 24)
+
+        self.first_control = _frame_control(0, self.width, self.height, 0, 0, delay)
+        self.first_data = zlib.compress(_scanlines(first, mode), compress_level)
+
+    '''
+    Add a frame replacing the pixels at (`x`, `y`) with `pixels`, a 2D uint8
+    array, shown for `delay`. A zero delay shows the next frame right away,
+    which lets a frame be split into several rectangles.
+    '''
+    def write_frame(self, pixels, x, y, delay=(1, 10)):
+        height, width = pixels.shape
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height or not pixels.size:
+            raise ValueError(f"frame of {width}x{height} at ({x}, {y}) is outside the "
+                             f"{self.width}x{self.height} image")
+        _chunk(self.spool, b'fcTL', _frame_control(self.sequence, width, height, x, y, delay))
+        data = zlib.compress(_scanlines(pixels, self.mode), self.compress_level)
+        _chunk(self.spool, b'fdAT', struct.pack('>I', self.sequence + 1) + data)
+        self.sequence += 2
+        self.frames += 1
+
+    def close(self):
+        f = self.file
+        f.write(SIGNATURE)
+        _chunk(f, b'IHDR', _ihdr(self.width, self.height, self.mode))
+        _chunk(f, b'acTL', struct.pack('>II', self.frames, self.plays))
+        _chunk(f, b'fcTL', self.first_control)
+        _chunk(f, b'IDAT', self.first_data)
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, f)
+        self.spool.close()
+        _chunk(f, b'IEND', b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.spool.close()
+
+# color type 0 (grayscale), default compression, filter and interlace methods
+def _ihdr(width, height, mode):
+    return struct.pack('>IIBBBBB', width, height, PngWriter.MODES[mode], 0, 0, 0, 0)
+
+# dispose op 0 (NONE), blend op 0 (SOURCE)
+def _frame_control(sequence, width, height, x, y, delay):
+    return struct.pack('>IIIIIHHBB', sequence, width, height, x, y, delay[0], delay[1], 0, 0)
+
+# Raw image data for a band of pixels: every scanline prefixed with its filter
+# type byte (0), packed 8 pixels per byte in '1' mode.
+def _scanlines(band, mode):
+    if mode == '1':
+        # the leftmost pixel in the high bit
+        band = np.packbits(band >= 128, axis=1)
+    raw = np.zeros((band.shape[0], band.shape[1] + 1), dtype=np.uint8)
+    raw[:, 1:] = band
+    return raw.tobytes()
+
+def _chunk(file, kind, data):
+    file.write(struct.pack('>I', len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
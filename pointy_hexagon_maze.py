@@ -3,10 +3,12 @@
 # some notes at the end in a scratchpad comment block to jog my memory next time
 # I read this code.
 
-from maze import Maze
+from maze import Adjacency, Maze
+import generators
+import raster
+import text
 
-from PIL import Image, ImageDraw
-from random import shuffle
+import numpy as np
 
 SQRT_3 = 1.73205
 NW, NE, E, SE, SW, W = 1, 2, 4, 8, 16, 32
@@ -55,17 +57,50 @@ class PointyHexagonMaze(Maze):
     # N + (N + 1) + ... [N terms] +
     # N + (N + 1) + ... [N - 1 terms]
     # which comes out to be N^2 + N(N-1) + (N-1)^2
-    def __init__(self, side):
+    TOPOLOGY = 'hex'
+    SEEN_MARKER = SEEN_MARKER
+    SC = 20 # output scale
+    M = 25 # padding
+    __slots__ = ('N', 'rows')
+
+    def __init__(self, side, seed=None, cells=None):
+        self._seed(seed)
         self.N = side
         self.rows = 2*self.N - 1 # number of rows in the grid
+        self.size = side
 
-        self.grid = [
-            [0 for _ in range(self.rows - abs(self.N - r - 1))]
-            for r in range(self.rows)
-        ]
+        # Cells are stored in one flat array with per-row offsets. The grid is
+        # an array of per-row views into it.
+        self._allocate_cells([self.rows - abs(self.N - r - 1)
+                              for r in range(self.rows)], cells)
+        self._attach_grid()
+
+    '''
+    Flat id of the cell at axial coordinates (q, r). Rows are stored back to
+    back and row `r` starts at q = max(0, N-r-1).
+    Reference: https://www.redblobgames.com/grids/hexagons/#map-storage
+    '''
+    def cell_id(self, q, r):
+        return int(self.row_offsets[r]) + q - max(0, self.N - r - 1)
+
+    @classmethod
+    def _build_coordinates(cls, size):
+        n = size
+        rows = 2*n - 1
+        lengths = rows - np.abs(n - np.arange(rows) - 1)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        r = np.repeat(np.arange(rows, dtype=np.int32), lengths)
+        q = np.arange(offsets[-1], dtype=np.int32) - offsets[r] + np.maximum(0, n - r - 1)
+        return q.astype(np.int32), r
+
+    @classmethod
+    def _build_adjacency(cls, size):
+        n = size
+        rows = 2*n - 1
+        lengths = rows - np.abs(n - np.arange(rows) - 1)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
 
-    def __in_bounds(self, coords):
-        q, r = coords
         # in the r-th row, the number of elements is
         # 2*N - 1 - abs(N-r-1)
         # e.g. if side == 3, the rows have these many elements
@@ -77,44 +112,62 @@ class PointyHexagonMaze(Maze):
         # r 4 => 3 => 0 1 2
         # the values of q range from (inclusive) max(0, N-r-1)
         # to (non-inclusive) 2N - 1 - abs(N-r-1) + max(0, N-r-1)
+        def q_range(r):
+            d = n - r - 1
+            return np.maximum(0, d), rows - np.abs(d) + np.maximum(0, d)
 
-        qmin, qmax = self.__q_range(r)
-        return 0 <= r < self.rows and qmin <= q < qmax
+        count = int(offsets[-1])
+        q, r = cls._build_coordinates(size)
 
-    def __neighbors(self, coords):
         directions = [NW, NE, E, SE, SW, W]
-        shuffle(directions)
-
-        cq, cr = coords
-
-        for direction in directions:
-            nq, nr = cq + DQ[direction], cr + DR[direction]
-
-            if not self.__in_bounds([nq, nr]):
-                continue
-
-            yield (nq, nr, direction)
-
-    def render_to_png(self, filename):
-        SC = 20 # output scale
-        M = 25 # padding
+        table = np.empty((count, len(directions)), dtype=np.int32)
+        for k, direction in enumerate(directions):
+            nq, nr = q + DQ[direction], r + DR[direction]
+            # clip so that rows outside the grid can still be looked up; those
+            # entries are masked out below anyway
+            qmin, qmax = q_range(np.clip(nr, 0, rows - 1))
+            inside = (0 <= nr) & (nr < rows) & (qmin <= nq) & (nq < qmax)
+            nid = offsets[np.clip(nr, 0, rows - 1)] + nq - qmin
+            table[:, k] = np.where(inside, nid, -1)
+
+        return Adjacency.from_table(table, directions, OPPOSITE)
 
-        WHITE = (255, 255, 255)
-        BLACK = (0, 0, 0)
-
-        # a pointy hexagon with side s can be tightly bounded by a rectangle of
-        # width s*sqrt(3) and height 3s-1
-        WIDTH = int((2*self.N - 1)*SQRT_3*SC) # centre row has 2N-1 cells
-        HEIGHT = int((3*self.N-1)*SC)
-
-        image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M))
-        draw = ImageDraw.Draw(image)
-
-        draw.rectangle([(0, 0),
-                        (WIDTH + 2*M, HEIGHT + 2*M)],
-                        WHITE)
-
-        # draw the top and bottom boundaries
+    '''
+    Print out the maze as text to `file` (default: standard output), see
+    `text_lines`.
+    '''
+    def render_to_text(self, file=None, style='ascii'):
+        with self._phase('text'):
+            text.write_lines(text_lines(self.grid, self.N, style), file)
+
+    @classmethod
+    def count_cells(cls, side):
+        return 3*side*side - 3*side + 1
+
+    # a pointy hexagon with side s can be tightly bounded by a rectangle of
+    # width s*sqrt(3) and height 3s-1
+    @classmethod
+    def image_size(cls, side):
+        width = int((2*side - 1)*SQRT_3*cls.SC) # centre row has 2N-1 cells
+        height = int((3*side - 1)*cls.SC)
+        return width + 2*cls.M, height + 2*cls.M
+
+    def render_image(self, mode='L'):
+        width, height, polylines, segments = self.wall_geometry()
+        canvas = raster.new_canvas(width, height)
+        for points in polylines:
+            raster.draw_polyline(canvas, points)
+        raster.draw_segments(canvas, *segments)
+        self.instrumentation.count('walls_drawn', len(segments[0]))
+        return raster.to_image(canvas, mode)
+
+    def wall_geometry(self, owners=False):
+        SC, M = self.SC, self.M
+
+        width, height = self.image_size(self.N)
+        WIDTH, HEIGHT = width - 2*M, height - 2*M
+
+        # the top and bottom boundaries
         top_wall, bottom_wall = [], []
         for col in range(self.N + 1):
             x = M + SC*SQRT_3*(col + ((self.N-1) / 2))
@@ -128,16 +181,14 @@ class PointyHexagonMaze(Maze):
         top_wall.pop()
         bottom_wall.pop()
 
-        draw.line(top_wall, BLACK)
-        draw.line(bottom_wall, BLACK)
-
         x = M + SC*SQRT_3*(self.N-1)/2
         y = M + SC/2
         n = self.N # number of elements in the row
         dx, dy, dn = -SC*SQRT_3/2, SC*1.5, 1
 
-        # draw the rows along with their left and right boundaries
+        # the left and right boundaries, remembering where each row starts
         left_wall, right_wall = [], []
+        row_x, row_y, row_qmin = [], [], []
         for r in range(self.rows):
             if r == self.N-1:
                 dx = -dx
@@ -149,110 +200,119 @@ class PointyHexagonMaze(Maze):
                               (x, y+SC),
                               (x+dx, y+dy)])
 
-            qmin, qmax = self.__q_range(r)
-
-            # number of cells in row r is qmax - qmin
-            row_width = (qmax-qmin)*SC*SQRT_3
+            qmin = max(0, self.N-r-1) # q of the row's first cell
+            row_width = len(self.grid[r])*SC*SQRT_3
 
             right_wall.extend([(x+row_width, y),
                                (x+row_width, y+SC),
                                (x+row_width-dx, y+dy)])
 
-            # for each cell in this row, draw the E, SE, SW walls if they exist
-            for q in range(qmin, qmax):
-                if self.__has_wall([q, r], E):
-                    draw.line([(x+(q-qmin+1)*SQRT_3*SC, y),
-                               (x+(q-qmin+1)*SQRT_3*SC, y+SC)],
-                              BLACK)
-                if self.__has_wall([q, r], SE):
-                    draw.line([(x+(q-qmin+1)*SQRT_3*SC, y+SC),
-                               (x+(q-qmin+0.5)*SQRT_3*SC, y+SC*1.5)],
-                              BLACK)
-                if self.__has_wall([q, r], SW):
-                    draw.line([(x+(q-qmin+0.5)*SQRT_3*SC, y+SC*1.5),
-                               (x+(q-qmin)*SQRT_3*SC, y+SC)],
-                              BLACK)
+            row_x.append(x)
+            row_y.append(y)
+            row_qmin.append(qmin)
 
             x += dx
             y += dy
             n += dn
 
         left_wall.pop()
-        draw.line(left_wall, BLACK)
-        draw.line(right_wall, BLACK)
 
-        del draw
-
-        path = f"./img/{filename}.png"
-        print(f"Writing maze to {path}")
-        image.save(f"{path}", 'PNG')
+        # for each cell, the E, SE, SW walls if they exist. `k` is the
+        # cell's position within its row, i.e. q - qmin.
+        r = np.repeat(np.arange(self.rows), np.diff(self.row_offsets))
+        k = np.arange(self.cell_count) - self.row_offsets[r]
+        x = np.asarray(row_x)[r]
+        y = np.asarray(row_y)[r]
+
+        x0, y0, x1, y1 = [], [], [], []
+        cells, bits = [], []
+        def add(bit, ax, ay, bx, by):
+            mask = self.cells & bit == 0
+            for out, v in zip((x0, y0, x1, y1), (ax, ay, bx, by)):
+                out.append(v[mask])
+            cells.append(np.flatnonzero(mask))
+            bits.append(np.full(len(cells[-1]), bit, dtype=np.uint8))
+
+        add(E,
+            x+(k+1)*SQRT_3*SC, y,
+            x+(k+1)*SQRT_3*SC, y+SC)
+        add(SE,
+            x+(k+1)*SQRT_3*SC, y+SC,
+            x+(k+0.5)*SQRT_3*SC, y+SC*1.5)
+        add(SW,
+            x+(k+0.5)*SQRT_3*SC, y+SC*1.5,
+            x+k*SQRT_3*SC, y+SC)
+
+        segments = tuple(np.concatenate(v) for v in (x0, y0, x1, y1))
+        polylines = [top_wall, bottom_wall, left_wall, right_wall]
+        if owners:
+            walls = (np.concatenate(cells), np.concatenate(bits))
+            return width, height, polylines, segments, walls
+        return width, height, polylines, segments
 
     '''
     Generate a maze by carving out passages starting from cell (cq, cr). Here
-    `cq` is the q-coordinate, `cr` is the r-coordinate.
-    '''
-    def carve_passages_from(self, cq, cr):
-        # We start out with `reverse_dir` == None.
-        stack = [(cq, cr, None)]
-
-        while stack:
-            # `reverse_dir` is the direction that takes you from the current cell
-            # to the cell that enqueued it. This is why we start out the stack
-            # with a None `reverse_dir`.
-            cq, cr, reverse_dir = stack.pop()
-            if self.__seen([cq, cr]):
-                continue
-            self.__mark_seen([cq, cr])
-
-            if reverse_dir:
-                pq, pr = cq + DQ[reverse_dir], cr + DR[reverse_dir]
-                prev_dir = OPPOSITE[reverse_dir]
-                self.__carve_passage(pq, pr, prev_dir)
-                self.__carve_passage(cq, cr, reverse_dir)
-
-            for nq, nr, new_dir in self.__neighbors([cq, cr]):
-                stack.append((nq, nr, OPPOSITE[new_dir]))
-
-    def generate(self):
-        self.carve_passages_from(self.N-1, 0) # top-leftmost cell
-
-    '''
-    When the bitwise AND of a cell and a direction is 0 it means there is no
-    connection in that direction, which means there is a wall there. This method
-    assumes that `coords` is known to be in bounds.
-    '''
-    def __has_wall(self, coords, direction):
-        row, col = self.__coords(*coords)
-        return self.grid[row][col] & direction == 0
-
-    def __seen(self, coords):
-        row, col = self.__coords(*coords)
-        return self.grid[row][col] & SEEN_MARKER != 0
-
-    def __mark_seen(self, coords):
-        row, col = self.__coords(*coords)
-        self.grid[row][col] |= SEEN_MARKER
-
-    # Given a row index r, return two values a, b such that q lies in the
-    # range [a, b) for that r
-    def __q_range(self, r):
-        d = self.N-r-1 # signed distance of r from center row
-        return max(0, d), self.rows - abs(d) + max(0, d)
-
-    '''
-    Break the wall at cell `(q, r)` in the direction `direction`.
+    `cq` is the q-coordinate, `cr` is the r-coordinate. With `events=True`,
+    return a generator of carve events instead, see `Maze.carve_events`.
     '''
-    def __carve_passage(self, q, r, direction):
-        row, col = self.__coords(q, r)
-        self.grid[row][col] |= direction
+    def carve_passages_from(self, cq, cr, events=False):
+        if events:
+            return self.carve_events(self.cell_id(cq, cr))
+        with self._phase('generate'):
+            generators.backtracker(self, self.cell_id(cq, cr))
+        self.invalidate()
+
+# Text glyphs, see `text.py`: '/' and '\' for the diagonal walls and '|' for
+# the vertical ones, per style. Every row is drawn as a line of NW and NE walls
+# (shared with the SE and SW walls of the row above) and a line of W and E
+# walls:
+#      / \ / \
+#     |   |   |
+TEXT_GLYPHS = {
+    'ascii': (ord('/'), ord('\\'), ord('|')),
+    'unicode': (ord('╱'), ord('╲'), ord('│')),
+}
 
-    '''
-    Translate axial coordinates into 2D-array row-column coordinates. We're using
-    "array of arrays" storage.
-    Reference: https://www.redblobgames.com/grids/hexagons/#map-storage
-    '''
-    def __coords(self, q, r):
-        return r, q - max(0, self.N - r - 1)
+'''
+Generate the lines of text showing a hexagon maze of side `side` in `style`
+(see `text.py`), two lines per row plus one for the bottom walls. `rows` is any
+iterable of rows in storage order, e.g. `PointyHexagonMaze.grid`, and is
+consumed one row at a time.
+'''
+def text_lines(rows, side, style='ascii'):
+    text.check_style(style)
+    slash, backslash, bar = TEXT_GLYPHS[style]
+    # a cell is four characters wide and rows are shifted half a cell against
+    # each other
+    width = 8*side - 3
+
+    above = None # centers and cells of the previous row
+    for r, row in enumerate(rows):
+        row = np.asarray(row, dtype=np.uint8)
+        x = 2*abs(side - r - 1) + 2 + 4*np.arange(len(row))
+
+        line = np.full(width, ord(' '), dtype=np.uint32)
+        if above is not None:
+            _bottom_walls(line, *above, slash, backslash)
+        line[x[row & NW == 0] - 1] = slash
+        line[x[row & NE == 0] + 1] = backslash
+        yield text.decode(line).rstrip()
+
+        line = np.full(width, ord(' '), dtype=np.uint32)
+        line[x[row & W == 0] - 2] = bar
+        line[x[row & E == 0] + 2] = bar
+        yield text.decode(line).rstrip()
+        above = (x, row)
+
+    if above is not None:
+        line = np.full(width, ord(' '), dtype=np.uint32)
+        _bottom_walls(line, *above, slash, backslash)
+        yield text.decode(line).rstrip()
+
+# draw the SW and SE walls of the row with cell centers `x` into `line`
+def _bottom_walls(line, x, row, slash, backslash):
+    line[x[row & SW == 0] - 1] = backslash
+    line[x[row & SE == 0] + 1] = slash
 
 '''
 Scratchpad
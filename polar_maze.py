@@ -0,0 +1,311 @@
+from functools import lru_cache
+
+from maze import Adjacency, Maze
+import generators
+import raster
+import text
+
+import numpy as np
+
+# Direction bits of the cells in rings 1 and up: towards the centre, to the
+# clockwise and counterclockwise neighbors in the same ring, and to the first
+# and second cell of the next ring out. The centre cell has up to 6 outward
+# neighbors, one bit each: bit k (1 << k) leads to cell k of ring 1.
+IN, CW, CCW, OUT, OUT2 = 1, 2, 4, 8, 16
+SEEN_MARKER = 64 # when this is set, the cell is seen
+
+TAU = 2*np.pi
+
+'''
+Number of cells in each of the `rings` rings, see the notes at the bottom.
+'''
+@lru_cache(maxsize=16)
+def ring_counts(rings):
+    counts = [1, 6][:rings]
+    for r in range(2, rings):
+        # width of the previous ring's cells, measured in ring heights along
+        # this ring's inner edge
+        width = TAU*r / counts[-1]
+        counts.append(counts[-1] * (2 if width >= 1.5 else 1))
+    return tuple(counts)
+
+'''
+Circular maze of concentric rings around a single centre cell. Ring r holds
+`ring_counts(rings)[r]` cells; rings are subdivided as they grow so that cells
+stay roughly as wide as they are deep. Cells are addressed by (ring, index)
+coordinates, index 0 starting at angle 0 (east) and increasing clockwise, or by
+flat id, see `cell_id`.
+'''
+class PolarMaze(Maze):
+    TOPOLOGY = 'polar'
+    SEEN_MARKER = SEEN_MARKER
+    SC = 12 # output scale: ring height
+    M = 20 # padding
+    __slots__ = ('rings',)
+
+    def __init__(self, side, seed=None, cells=None):
+        self._seed(seed)
+        self.rings = side
+        self.size = side
+
+        # Cells are stored in one flat array, ring after ring from the centre
+        # out. The grid is an array of per-ring views into it.
+        self._allocate_cells(ring_counts(side), cells)
+        self._attach_grid()
+
+    '''
+    Flat id of cell `i` of ring `r`.
+    '''
+    def cell_id(self, r, i):
+        return int(self.row_offsets[r]) + i
+
+    @classmethod
+    def _build_coordinates(cls, size):
+        counts = np.asarray(ring_counts(size), dtype=np.int64)
+        first = np.cumsum(counts) - counts
+        ring = np.repeat(np.arange(size, dtype=np.int32), counts)
+        index = (np.arange(counts.sum()) - first[ring]).astype(np.int32)
+        return ring, index
+
+    @classmethod
+    def _build_adjacency(cls, size):
+        counts = np.asarray(ring_counts(size), dtype=np.int64)
+        first = np.cumsum(counts) - counts
+        ring, index = cls._build_coordinates(size)
+        ring, index = ring.astype(np.int64), index.astype(np.int64)
+        cell = np.arange(len(ring))
+
+        # cells of ring r+1 per cell of ring r (1 or 2), for every ring but
+        # the centre and the last
+        ratio = np.ones(size, dtype=np.int64)
+        ratio[1:-1] = counts[2:] // counts[1:-1]
+
+        # (cells, their neighbors, direction bits, back bits) per kind of entry
+        entries = []
+        around = ring >= 1
+        c, r, i = cell[around], ring[around], index[around]
+        n = counts[r]
+        entries.append((c, first[r] + (i + 1) % n, CW, CCW))
+        entries.append((c, first[r] + (i - 1) % n, CCW, CW))
+
+        # between the centre and ring 1
+        ring1, bit = c[r == 1], 1 << i[r == 1]
+        entries.append((ring1, np.zeros_like(ring1), IN, bit))
+        entries.append((np.zeros_like(ring1), ring1, bit, IN))
+
+        # between the other rings
+        inner = (r >= 2)
+        k = ratio[r[inner] - 1]
+        parent = first[r[inner] - 1] + i[inner] // k
+        entries.append((c[inner], parent, IN, np.where(i[inner] % k == 0, OUT, OUT2)))
+        outer = (r >= 1) & (r < size - 1)
+        k = ratio[r[outer]]
+        child = first[r[outer] + 1] + i[outer]*k
+        entries.append((c[outer], child, OUT, IN))
+        second = k == 2
+        entries.append((c[outer][second], child[second] + 1, OUT2, IN))
+
+        sources, neighbors, directions, back = (
+            np.concatenate([np.broadcast_to(e[j], e[0].shape) for e in entries])
+            for j in range(4))
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(len(ring) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(ring)), out=offsets[1:])
+        return Adjacency(offsets,
+                         neighbors[order].astype(np.int32),
+                         directions[order].astype(np.uint8),
+                         back[order].astype(np.uint8))
+
+    '''
+    Print out the maze as text to `file` (default: standard output), see
+    `text_lines`.
+    '''
+    def render_to_text(self, file=None, style='ascii'):
+        with self._phase('text'):
+            text.write_lines(text_lines(self.grid, self.rings, style), file)
+
+    @classmethod
+    def count_cells(cls, side):
+        return sum(ring_counts(side))
+
+    @classmethod
+    def image_size(cls, side):
+        size = 2*side*cls.SC + 2*cls.M
+        return size, size
+
+    # Arcs and radial walls are rasterized in batches of cells to bound the
+    # temporary arrays.
+    def render_image(self, mode='L'):
+        SC, M = self.SC, self.M
+
+        size, _ = self.image_size(self.rings)
+        centre = M + self.rings*SC
+        canvas = raster.new_canvas(size, size)
+        raster.draw_arcs(canvas, centre, centre, self.rings*SC, 0, TAU) # outer boundary
+
+        ring, index = self.coordinates()
+        counts = np.asarray(ring_counts(self.rings), dtype=np.int64)
+        BATCH = 1 << 16
+        walls = 0
+        for start in range(1, self.cell_count, BATCH):
+            stop = min(start + BATCH, self.cell_count)
+            bits = self.cells[start:stop]
+            r = ring[start:stop].astype(np.float64)
+            i = index[start:stop]
+            n = counts[ring[start:stop]]
+
+            inward = bits & IN == 0
+            raster.draw_arcs(canvas, centre, centre, r[inward]*SC,
+                             TAU*(i[inward]/n[inward]), TAU*((i[inward] + 1)/n[inward]))
+
+            cw = bits & CW == 0
+            theta = TAU*((i[cw] + 1)/n[cw])
+            cos, sin = np.cos(theta), np.sin(theta)
+            raster.draw_segments(canvas,
+                                 centre + r[cw]*SC*cos, centre + r[cw]*SC*sin,
+                                 centre + (r[cw] + 1)*SC*cos, centre + (r[cw] + 1)*SC*sin)
+            walls += int(inward.sum()) + int(cw.sum())
+
+        self.instrumentation.count('walls_drawn', walls)
+        return raster.to_image(canvas, mode)
+
+    # Arcs are approximated by chords short enough to stay within half a pixel
+    # of the true arc, so the picture matches `render_image` to within a pixel.
+    # The outer boundary is one closed polyline.
+    def wall_geometry(self, owners=False):
+        SC, M = self.SC, self.M
+
+        size, _ = self.image_size(self.rings)
+        centre = M + self.rings*SC
+        R = self.rings*SC
+        steps = _chord_count(R, TAU)
+        theta = TAU*np.arange(steps + 1)/steps
+        theta[-1] = 0
+        boundary = list(zip((centre + R*np.cos(theta)).tolist(), (centre + R*np.sin(theta)).tolist()))
+
+        ring, index = self.coordinates()
+        counts = np.asarray(ring_counts(self.rings), dtype=np.int64)
+        n = counts[ring]
+        cells = np.arange(self.cell_count)
+
+        # IN walls as chords, each repeated per chord in the owner arrays
+        inward = (self.cells & IN == 0) & (ring >= 1)
+        r = ring[inward].astype(np.float64)
+        i, m = index[inward], n[inward]
+        a0, a1 = TAU*(i/m), TAU*((i + 1)/m)
+        chords = _chord_count(r*SC, a1 - a0)
+        arc = np.repeat(np.arange(len(r)), chords)
+        step = np.arange(int(chords.sum())) - np.repeat(np.cumsum(chords) - chords, chords)
+        t0 = a0[arc] + (a1 - a0)[arc]*step/chords[arc]
+        t1 = np.where(step + 1 == chords[arc], a1[arc],
+                      a0[arc] + (a1 - a0)[arc]*(step + 1)/chords[arc])
+        radius = r[arc]*SC
+
+        # CW walls
+        cw = (self.cells & CW == 0) & (ring >= 1)
+        rc = ring[cw].astype(np.float64)
+        theta = TAU*((index[cw] + 1)/n[cw])
+        cos, sin = np.cos(theta), np.sin(theta)
+
+        segments = (np.concatenate((centre + radius*np.cos(t0), centre + rc*SC*cos)),
+                    np.concatenate((centre + radius*np.sin(t0), centre + rc*SC*sin)),
+                    np.concatenate((centre + radius*np.cos(t1), centre + (rc + 1)*SC*cos)),
+                    np.concatenate((centre + radius*np.sin(t1), centre + (rc + 1)*SC*sin)))
+        if owners:
+            walls = (np.concatenate((cells[inward][arc], cells[cw])),
+                     np.repeat(np.array([IN, CW], dtype=np.uint8), (len(arc), int(cw.sum()))))
+            return size, size, [boundary], segments, walls
+        return size, size, [boundary], segments
+
+    '''
+    Generate a maze by carving out passages starting from cell `ci` of ring
+    `cr`. With `events=True`, return a generator of carve events instead, see
+    `Maze.carve_events`.
+    '''
+    def carve_passages_from(self, cr, ci, events=False):
+        if events:
+            return self.carve_events(self.cell_id(cr, ci))
+        with self._phase('generate'):
+            generators.backtracker(self, self.cell_id(cr, ci))
+        self.invalidate()
+
+# Number of chords for arcs of `radius` pixels spanning `angle` radians, such
+# that no chord strays more than half a pixel from its arc: a chord of length
+# L on radius R is at most L^2 / 8R away from it.
+def _chord_count(radius, angle):
+    longest = 2*np.sqrt(np.maximum(radius, 1))
+    return np.maximum(np.ceil(radius*angle / longest), 1).astype(np.int64)
+
+# Text glyphs, see `text.py`. The maze is drawn unrolled: ring r is line r,
+# from the centre at the top to the outer boundary at the bottom, and angle 0
+# is both the left and the right edge. Every cell of the outermost ring takes
+# two characters and cells further in stretch over the characters of the
+# outermost cells they cover. Each pair of characters is looked up by whether
+# there is a wall below it (1) and whether it ends with a radial wall (2):
+#     ring 0:   _____ ___
+#     ring 1:  |  _|   _ |
+#     ring 2:  |_|___|___|
+def _unit(underscore, bar):
+    def glyph(bits):
+        floor = underscore if bits & 1 else ' '
+        return floor + (bar if bits & 2 else floor)
+    return glyph
+
+TEXT_UNITS = {
+    'ascii': text.lookup_table(4, 2, _unit('_', '|')),
+    'unicode': text.lookup_table(4, 2, _unit('▁', '│')),
+}
+
+'''
+Generate the lines of text showing a polar maze of `side` rings in `style` (see
+`text.py`), one line per ring. `rings` is any iterable of rings, ring r holding
+`ring_counts(side)[r]` cells, e.g. `PolarMaze.grid`, and is consumed one ring
+at a time (looking one ring ahead for the walls below).
+'''
+def text_lines(rings, side, style='ascii'):
+    text.check_style(style)
+    units = TEXT_UNITS[style]
+    width = ring_counts(side)[-1] # every ring's count divides it
+
+    rings = iter(rings)
+    ring = next(rings, None)
+    r = 0
+    while ring is not None:
+        ring = np.asarray(ring, dtype=np.uint8)
+        outside = next(rings, None)
+
+        if outside is None:
+            walls = np.ones(width, dtype=np.uint8) # the outer boundary
+        else:
+            outside = np.asarray(outside, dtype=np.uint8)
+            walls = np.repeat(outside & IN == 0, width // len(outside)).astype(np.uint8)
+
+        if r == 0:
+            prefix = ' '
+        else:
+            walls[width // len(ring) - 1::width // len(ring)] |= (ring & CW == 0).astype(np.uint8) << 1
+            # angle 0 is the CW wall of the ring's last cell
+            prefix = chr(units[2, 1]) if ring[-1] & CW == 0 else ' '
+
+        yield prefix + text.decode(units[walls])
+        ring = outside
+        r += 1
+
+'''
+Notes
+
+Rings and subdivision
+Ring 0 is the centre cell and ring 1 has 6 cells. Each further ring r has as
+many cells as ring r-1 unless those cells, measured along ring r's inner edge
+(of length 2*pi*r ring heights), would be 1.5 ring heights wide or more; then
+every cell of ring r-1 has two cells outside it instead of one. Cell widths stay
+between 0.75 and 1.5 ring heights, and a cell has at most 2 outward neighbors
+(the centre has 6).
+
+Ring counts for 8 rings: 1 6 12 24 24 24 48 48
+
+Cells are stored ring after ring, so cell (r, i) has flat id
+row_offsets[r] + i. Cell i of a ring of n cells spans angles 2*pi*i/n to
+2*pi*(i+1)/n; when the next ring out has twice as many cells, its cells 2i and
+2i+1 are outside cell i (OUT and OUT2), otherwise cell i is (OUT).
+'''
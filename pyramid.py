@@ -0,0 +1,173 @@
+'''
+Export a Cartesian maze as a z/x/y pyramid of 256 pixel PNG tiles, the layout
+web map viewers (Leaflet, OpenLayers, ...) load on demand.
+
+At the deepest zoom level every cell is `SC` pixels wide and walls are drawn
+like in `CartesianMaze.render_image`, without padding. Each level up halves the
+scale. While cells are at least 2 pixels wide they are still drawn as walls with
+`cartesian_maze.render_viewport`; below that every pixel covers a block of
+cells and is shaded by the fraction of those cells' E and S walls that are
+closed, counted from the cell data. Nothing is ever downsampled from rendered
+pixels, and every tile only reads the cells under it, so the maze can be a
+`TiledMaze` of any size.
+
+Tiles are rendered by a pool of processes and written as soon as they are done.
+
+Usage:
+    python pyramid.py --side 2000 --seed 1 -o tiles/
+    python pyramid.py big.maze -o tiles/
+    python pyramid.py --tiled --side 1000000 --seed 1 --min-zoom 14 -o tiles/
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+
+import numpy as np
+
+from cartesian_maze import CartesianMaze, E, S, render_viewport
+from png_stream import PngWriter
+import raster
+import serialize
+from tiled_maze import TiledMaze
+
+TILE = 256 # tile width and height in pixels
+
+'''
+Deepest zoom level for `maze` at scale `SC`: the first one at which the whole
+image fits in 2^zoom tiles across and down.
+'''
+def deepest_zoom(maze, SC=16):
+    size = max(maze.rows, maze.cols)*SC + 1
+    return max(0, (size - 1) // TILE).bit_length()
+
+'''
+How zoom level `zoom` is drawn: ('walls', cell size in pixels) or
+('density', cells per pixel along each axis).
+'''
+def level(zoom, top, SC=16):
+    shift = top - zoom
+    if SC >> shift >= 2:
+        return 'walls', SC >> shift
+    return 'density', (1 << shift) // SC
+
+'''
+Number of tiles across and down at a zoom level drawn as `style`, `scale`.
+'''
+def level_tiles(maze, style, scale):
+    if style == 'walls':
+        width, height = maze.cols*scale + 1, maze.rows*scale + 1
+    else:
+        width, height = -(-maze.cols // scale), -(-maze.rows // scale)
+    return -(-width // TILE), -(-height // TILE)
+
+'''
+Render tile (`x`, `y`) of a level drawn as `style`, `scale` as a canvas.
+'''
+def render_tile(maze, style, scale, x, y):
+    if style == 'walls':
+        return render_viewport(maze, x*TILE, y*TILE, (x + 1)*TILE, (y + 1)*TILE,
+                               SC=scale, M=0)
+    return _density_tile(maze, scale, x, y)
+
+'''
+Shade every pixel of a tile by the fraction of closed E and S walls among the
+`k` x `k` cells it covers, a band of pixel rows at a time so that only
+`TILE*k` x `k` cells are held at once.
+'''
+def _density_tile(maze, k, x, y):
+    canvas = raster.new_canvas(TILE, TILE)
+    c0 = x*TILE*k
+    c1 = min(maze.cols, c0 + TILE*k)
+    if c0 >= c1:
+        return canvas
+
+    for py in range(TILE):
+        r0 = (y*TILE + py)*k
+        r1 = min(maze.rows, r0 + k)
+        if r0 >= r1:
+            break
+        block = maze.region(r0, c0, r1, c1)
+        closed = (block & E == 0).astype(np.uint32) + (block & S == 0)
+        # pad to whole pixels, padding counts as open
+        closed = np.pad(closed, ((0, k - (r1 - r0)), (0, -(c1 - c0) % k)))
+        counts = closed.reshape(k, -1, k).sum(axis=(0, 2))
+        shade = raster.WHITE - counts * raster.WHITE // (2*k*k)
+        canvas[py, :len(shade)] = shade
+    return canvas
+
+# the maze each worker renders from, set once per process by `_init_worker`
+_maze = None
+
+def _init_worker(maze):
+    global _maze
+    _maze = maze
+
+def _render_tiles(tiles, directory):
+    paths = []
+    for zoom, style, scale, x, y in tiles:
+        canvas = render_tile(_maze, style, scale, x, y)
+        path = os.path.join(directory, str(zoom), str(x), f"{y}.png")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            with PngWriter(f, TILE, TILE) as png:
+                png.write(canvas)
+        paths.append(path)
+    return paths
+
+'''
+Write the tile pyramid of Cartesian `maze` (a `CartesianMaze` or a `TiledMaze`)
+into `directory` as `{zoom}/{x}/{y}.png`, for zoom levels `min_zoom` to
+`max_zoom` (default: the deepest level, see `deepest_zoom()`). `SC` is the cell
+size in pixels at the deepest level and must be a power of two. Tiles are
+rendered by `workers` processes (default: one per CPU) in chunks of
+`chunksize`; yields the path of every tile as soon as its chunk is written.
+'''
+def export_pyramid(maze, directory, SC=16, min_zoom=0, max_zoom=None, workers=None, chunksize=64):
+    if SC < 2 or SC & (SC - 1):
+        raise ValueError(f"Cell size must be a power of two of at least 2, got {SC}")
+    top = deepest_zoom(maze, SC)
+    bottom = top if max_zoom is None else max_zoom
+
+    tiles = []
+    for zoom in range(min_zoom, bottom + 1):
+        style, scale = level(zoom, top, SC)
+        across, down = level_tiles(maze, style, scale)
+        tiles.extend((zoom, style, scale, x, y) for y in range(down) for x in range(across))
+    chunks = [tiles[i:i + chunksize] for i in range(0, len(tiles), chunksize)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(maze,)) as pool:
+        futures = [pool.submit(_render_tiles, chunk, directory) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Export a Cartesian maze as map tiles.")
+    parser.add_argument('maze', nargs='?', help="maze file written by serialize.py; omit to generate one")
+    parser.add_argument('--side', type=int, default=256)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--algorithm', default='backtracker')
+    parser.add_argument('--tiled', action='store_true', help="generate a TiledMaze")
+    parser.add_argument('--scale', type=int, default=16, help="cell size in pixels at the deepest zoom")
+    parser.add_argument('--min-zoom', type=int, default=0)
+    parser.add_argument('--max-zoom', type=int)
+    parser.add_argument('-o', '--output-dir', default='tiles')
+    parser.add_argument('-w', '--workers', type=int)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+
+    if args.maze:
+        maze = serialize.load(args.maze)
+    elif args.tiled:
+        maze = TiledMaze(args.side, seed=args.seed, algorithm=args.algorithm)
+    else:
+        maze = CartesianMaze(args.side, seed=args.seed)
+        maze.generate(args.algorithm)
+    if maze.TOPOLOGY != 'cartesian':
+        raise SystemExit(f"Only Cartesian mazes can be exported as tiles, got a {maze.TOPOLOGY} maze")
+
+    for path in export_pyramid(maze, args.output_dir, args.scale, args.min_zoom,
+                               args.max_zoom, args.workers):
+        print(path)
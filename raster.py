@@ -0,0 +1,223 @@
+'''
+Bulk rasterization helpers shared by the `render_to_png` implementations.
+
+A canvas is a 2D `uint8` NumPy array indexed as `canvas[y, x]`, with 255 for
+white and 0 for black. All walls are drawn into it with array operations and it
+is turned into a Pillow image with a single `Image.fromarray` call at the end.
+
+Mazes are pure black and white, so images default to 'L' (8-bit grayscale), the
+canvas itself without any conversion. They can also be encoded with one bit per
+pixel in '1' or 'P' (a 2-color palette) mode, which makes much smaller files
+that are faster to write, or converted to RGB. Encoded images
+go to a path, a binary file-like object or are returned as bytes, see
+`save_image`.
+'''
+from contextlib import contextmanager
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+WHITE, BLACK = 255, 0
+
+MODES = ('RGB', 'L', 'P', '1')
+FORMATS = ('png', 'webp', 'qoi')
+
+'''
+Return a white canvas of `width` x `height` pixels.
+'''
+def new_canvas(width, height):
+    return np.full((height, width), WHITE, dtype=np.uint8)
+
+'''
+Draw a batch of 1-pixel line segments from (x0, y0) to (x1, y1). The arguments
+are equal-length arrays (or scalars) of pixel coordinates, possibly fractional.
+
+This follows the Bresenham variant `ImageDraw.line` uses for 1-pixel lines:
+coordinates are truncated to ints, both endpoints are drawn, and the minor
+coordinate of step `i` along the major axis is offset by
+floor((2*i*minor + major) / (2*major)). So the output matches what drawing
+the same segments one by one with Pillow would give.
+'''
+def draw_segments(canvas, x0, y0, x1, y1, ink=BLACK):
+    x0, y0, x1, y1 = (np.atleast_1d(np.asarray(v)).astype(np.int64)
+                      for v in (x0, y0, x1, y1))
+    if len(x0) == 0:
+        return
+
+    dx, dy = x1 - x0, y1 - y0
+    adx, ady = np.abs(dx), np.abs(dy)
+    major = np.maximum(adx, ady)
+    minor = np.minimum(adx, ady)
+    x_major = adx >= ady
+
+    # one entry per pixel: which segment it belongs to and its step index
+    counts = major + 1
+    segment = np.repeat(np.arange(len(x0)), counts)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(int(counts.sum())) - starts[segment]
+
+    major_seg = major[segment]
+    # guard the division for single-pixel segments (major == 0)
+    offset = (2*step*minor[segment] + major_seg) // np.maximum(2*major_seg, 1)
+
+    sx, sy = np.sign(dx)[segment], np.sign(dy)[segment]
+    xm = x_major[segment]
+    xs = x0[segment] + sx*np.where(xm, step, offset)
+    ys = y0[segment] + sy*np.where(xm, offset, step)
+
+    height, width = canvas.shape
+    inside = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+    canvas[ys[inside], xs[inside]] = ink
+
+'''
+Draw a connected line through `points`, a sequence of (x, y) pairs.
+'''
+def draw_polyline(canvas, points, ink=BLACK):
+    points = np.asarray(points, dtype=np.float64)
+    draw_segments(canvas,
+                  points[:-1, 0], points[:-1, 1],
+                  points[1:, 0], points[1:, 1],
+                  ink)
+
+'''
+Draw a batch of 1-pixel circular arcs around (`cx`, `cy`). `radius`, `start`
+and `stop` are equal-length arrays (or scalars); each arc runs from angle
+`start` to `stop` in radians, measured from the x axis towards the y axis
+(clockwise on screen, where y points down).
+
+Points are sampled along each arc at most one pixel apart, both ends
+included, and truncated to ints like segment ends in `draw_segments`, so an
+arc meets a segment ending at the same point.
+'''
+def draw_arcs(canvas, cx, cy, radius, start, stop, ink=BLACK):
+    radius, start, stop = (np.atleast_1d(np.asarray(v, dtype=np.float64))
+                           for v in np.broadcast_arrays(radius, start, stop))
+    if len(radius) == 0:
+        return
+
+    # one entry per sample: which arc it belongs to and its step index
+    counts = np.ceil(radius * np.abs(stop - start)).astype(np.int64) + 1
+    arc = np.repeat(np.arange(len(radius)), counts)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(int(counts.sum())) - starts[arc]
+
+    last = counts[arc] - 1
+    theta = start[arc] + (stop - start)[arc] * step / np.maximum(last, 1)
+    theta = np.where(step == last, stop[arc], theta)
+    xs = (cx + radius[arc]*np.cos(theta)).astype(np.int64)
+    ys = (cy + radius[arc]*np.sin(theta)).astype(np.int64)
+
+    height, width = canvas.shape
+    inside = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+    canvas[ys[inside], xs[inside]] = ink
+
+'''
+Turn a finished canvas into a Pillow image in `mode`, one of MODES. In '1' and
+'P' mode pixels darker than mid-gray are black and the others white.
+'''
+def to_image(canvas, mode='L'):
+    if mode == 'RGB':
+        return Image.fromarray(canvas, 'L').convert('RGB')
+    if mode == 'L':
+        return Image.fromarray(canvas, 'L')
+    if mode == '1':
+        return Image.fromarray(canvas >= 128)
+    if mode == 'P':
+        image = Image.fromarray((canvas >= 128).astype(np.uint8), 'P')
+        image.putpalette([0, 0, 0, 255, 255, 255])
+        return image
+    raise ValueError(f"Unknown image mode {mode!r}, expected one of {MODES}")
+
+'''
+Encode `image` as `format`, one of FORMATS, and write it to `file`: a path, a
+binary file-like object, or None to only return the encoded bytes. Returns the
+encoded bytes.
+
+`compress_level` (0-9) and `optimize` are passed to the PNG encoder. WebP is
+lossless, with `compress_level` capped at 6 as the encoder's effort. QOI has no
+options and stores RGB; black and white images are encoded by `qoi_black_white`.
+'''
+def save_image(image, file=None, format='png', compress_level=6, optimize=False):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown image format {format!r}, expected one of {FORMATS}")
+
+    data = None
+    if format == 'qoi':
+        pixels = np.asarray(image.convert('L'))
+        if ((pixels == BLACK) | (pixels == WHITE)).all():
+            data = qoi_black_white(pixels == WHITE)
+        else:
+            image = image.convert('RGB')
+    if data is None:
+        options = {}
+        if format == 'png':
+            options = {'compress_level': compress_level, 'optimize': optimize}
+        elif format == 'webp':
+            options = {'lossless': True, 'method': min(compress_level, 6)}
+        out = io.BytesIO()
+        image.save(out, format.upper(), **options)
+        data = out.getvalue()
+    if file is not None:
+        with open_output(file) as f:
+            f.write(data)
+    return data
+
+# QOI ops used for black and white images, see https://qoiformat.org/qoi-specification.pdf
+QOI_INDEX_WHITE = 0x00 | 38 # index positions: (r*3 + g*5 + b*7 + a*11) % 64
+QOI_INDEX_BLACK = 0x00 | 53
+QOI_DIFF_TO_WHITE = 0x40 | 1 << 4 | 1 << 2 | 1 # -1 per channel, wrapping
+QOI_DIFF_TO_BLACK = 0x40 | 3 << 4 | 3 << 2 | 3 # +1 per channel, wrapping
+QOI_RUN = 0xC0 # | run length - 1
+QOI_MAX_RUN = 62
+
+'''
+Encode a black and white image, given as a 2D bool array that is True for white
+pixels, as an RGB QOI file. Pillow's QOI encoder goes pixel by pixel in Python;
+with only two colors the whole stream follows from the runs of equal pixels:
+every run starts with one op switching color (a DIFF op the first time the
+decoder sees the color, an INDEX op afterwards) and continues with RUN ops.
+'''
+def qoi_black_white(white):
+    height, width = white.shape
+    flat = white.reshape(-1)
+    header = b'qoif' + int(width).to_bytes(4, 'big') + int(height).to_bytes(4, 'big') + bytes((3, 0))
+    end = bytes(7) + b'\x01'
+    if flat.size == 0:
+        return header + end
+
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    colors = flat[starts]
+
+    # the decoder starts from black, so only a first run of white needs an op
+    switch = np.ones(len(starts), dtype=bool)
+    switch[0] = colors[0]
+    ops = np.where(colors, QOI_INDEX_WHITE, QOI_INDEX_BLACK).astype(np.uint8)
+    for color, diff in ((True, QOI_DIFF_TO_WHITE), (False, QOI_DIFF_TO_BLACK)):
+        first = np.flatnonzero(switch & (colors == color))
+        if len(first):
+            ops[first[0]] = diff
+
+    full, part = np.divmod(lengths - switch, QOI_MAX_RUN)
+    counts = switch + full + (part > 0)
+    first_byte = np.cumsum(counts) - counts
+
+    body = np.full(int(counts.sum()), QOI_RUN | (QOI_MAX_RUN - 1), dtype=np.uint8)
+    body[first_byte[switch]] = ops[switch]
+    partial = part > 0
+    body[(first_byte + counts - 1)[partial]] = QOI_RUN | (part[partial] - 1)
+    return header + body.tobytes() + end
+
+'''
+Context manager giving a binary file object for `file`: the file at that path,
+opened for writing, or `file` itself if it is already a file-like object.
+'''
+@contextmanager
+def open_output(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'wb') as f:
+            yield f
+    else:
+        yield file
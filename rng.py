@@ -0,0 +1,93 @@
+'''
+Per-maze random number source.
+
+Every maze owns a `RandomSource` instead of sharing the module-level `random`
+functions, so that generation is reproducible from a seed and parallel workers
+do not share state. Numbers come from a NumPy `Generator` and are drawn in bulk:
+single draws are served from a buffer, and `floats()` hands out whole arrays for
+vectorized algorithms. Both read from the same stream, so the sequence of
+numbers an algorithm sees does not depend on how it groups its draws.
+'''
+import random
+
+import numpy as np
+
+BUFFER_SIZE = 4096
+
+class RandomSource:
+    '''
+    `seed` may be None (fresh OS entropy), an int, a `random.Random` (a seed is
+    drawn from it), a NumPy `Generator` (used directly) or another
+    `RandomSource` (whose generator is shared).
+    '''
+    def __init__(self, seed=None):
+        if isinstance(seed, RandomSource):
+            generator = seed.generator
+        elif isinstance(seed, np.random.Generator):
+            generator = seed
+        elif isinstance(seed, random.Random):
+            generator = np.random.default_rng(seed.getrandbits(128))
+        else:
+            generator = np.random.default_rng(seed)
+
+        self.generator = generator
+        self.buffer = []
+
+    '''
+    A float in [0, 1).
+    '''
+    def random(self):
+        if not self.buffer:
+            self.__refill()
+        return self.buffer.pop()
+
+    '''
+    An int in [0, n).
+    '''
+    def randbelow(self, n):
+        return int(self.random() * n)
+
+    '''
+    A random element of the non-empty sequence `seq`.
+    '''
+    def choice(self, seq):
+        return seq[self.randbelow(len(seq))]
+
+    '''
+    Shuffle the list `items` in place (Fisher-Yates).
+    '''
+    def shuffle(self, items):
+        for i in range(len(items) - 1, 0, -1):
+            j = self.randbelow(i + 1)
+            items[i], items[j] = items[j], items[i]
+
+    '''
+    The next `size` floats in [0, 1) as a NumPy array, continuing the same
+    stream as `random()`.
+    '''
+    def floats(self, size):
+        take = min(size, len(self.buffer))
+        head = self.buffer[len(self.buffer) - take:]
+        del self.buffer[len(self.buffer) - take:]
+        head.reverse()
+        return np.concatenate((np.asarray(head, dtype=np.float64),
+                               self.generator.random(size - take)))
+
+    '''
+    The floats drawn from the generator but not handed out yet, as an array in
+    the order `random()` would return them. Code reading `generator` directly
+    (see `kernels.py`) takes these first and then drops the ones it used with
+    `skip()`, so that it sees the same stream as `random()`.
+    '''
+    def buffered(self):
+        return np.asarray(self.buffer[::-1], dtype=np.float64)
+
+    '''
+    Drop the next `n` buffered floats.
+    '''
+    def skip(self, n):
+        del self.buffer[len(self.buffer) - n:]
+
+    # the buffer is kept reversed so that `random()` can pop from the end
+    def __refill(self):
+        self.buffer = self.generator.random(BUFFER_SIZE)[::-1].tolist()
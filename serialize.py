@@ -0,0 +1,211 @@
+'''
+Compact binary file format for generated mazes.
+
+A file is a fixed 48-byte little-endian header followed by the wall bits:
+
+    magic      4s   b'MAZE'
+    version    H    VERSION
+    topology   B    index into TOPOLOGIES
+    flags      B    FLAG_SEED if the seed field is meaningful
+    rows       I    number of rows (the side for triangle and hex mazes, the
+                    number of rings for polar mazes)
+    cols       I    number of columns (0 for the others)
+    seed       Q    generation seed
+    algorithm  16s  generation algorithm name, NUL padded
+    body_size  Q    number of bytes after the header
+
+Cartesian mazes only store each cell's E and S bits, packed 2 bits per cell
+and 4 cells per byte with the first cell in the low bits; N and W follow from
+the neighbors above and to the left. Triangle and hex mazes store one byte per
+cell, i.e. the cell store itself minus the seen marker; so do polar mazes.
+
+Files are opened with `mmap`, so opening is instant whatever the size and only
+the parts that are touched are read from disk. Triangle and hex bodies are used
+as the cell store directly; Cartesian bodies are unpacked with a few array
+operations.
+'''
+import mmap
+import struct
+
+import numpy as np
+
+from cartesian_maze import CartesianMaze, N, S, E, W
+from pointy_hexagon_maze import PointyHexagonMaze
+from polar_maze import PolarMaze
+from triangle_maze import TriangleMaze
+
+MAGIC = b'MAZE'
+VERSION = 1
+HEADER = struct.Struct('<4sHBBIIQ16sQ')
+FLAG_SEED = 1
+
+TOPOLOGIES = ('cartesian', 'triangle', 'hex', 'polar')
+MAZE_CLASSES = {
+    'cartesian': CartesianMaze,
+    'triangle': TriangleMaze,
+    'hex': PointyHexagonMaze,
+    'polar': PolarMaze,
+}
+
+CHUNK = 1 << 22 # cells packed or unpacked at a time, a multiple of 4
+
+'''
+Metadata of a maze file.
+'''
+class Header:
+    def __init__(self, topology, rows, cols, seed, algorithm, body_size):
+        self.topology = topology
+        self.rows = rows
+        self.cols = cols
+        self.seed = seed
+        self.algorithm = algorithm
+        self.body_size = body_size
+
+    def pack(self):
+        flags = 0 if self.seed is None else FLAG_SEED
+        return HEADER.pack(MAGIC, VERSION, TOPOLOGIES.index(self.topology), flags,
+                           self.rows, self.cols, self.seed or 0,
+                           (self.algorithm or '').encode('ascii'), self.body_size)
+
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError("Not a maze file: too short")
+        magic, version, topology, flags, rows, cols, seed, algorithm, body_size = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a maze file: bad magic")
+        if version != VERSION:
+            raise ValueError(f"Unsupported maze file version {version}, expected {VERSION}")
+        return cls(TOPOLOGIES[topology], rows, cols,
+                   seed if flags & FLAG_SEED else None,
+                   algorithm.rstrip(b'\0').decode('ascii') or None,
+                   body_size)
+
+'''
+Write `maze` to the file at `path`.
+'''
+def save(maze, path):
+    with open(path, 'wb') as f:
+        write(maze, f)
+
+'''
+Write `maze` to the binary file-like object `f`.
+'''
+def write(maze, f):
+    seed = maze.seed if maze.seed is not None and 0 <= maze.seed < 1 << 64 else None
+    seen = np.uint8(maze.SEEN_MARKER)
+
+    if maze.TOPOLOGY == 'cartesian':
+        rows, cols = maze.rows, maze.cols
+        body_size = (maze.cell_count + 3) // 4
+    else:
+        rows, cols = maze.size, 0
+        body_size = maze.cell_count
+
+    header = Header(maze.TOPOLOGY, rows, cols, seed, maze.algorithm, body_size)
+    f.write(header.pack())
+    for start in range(0, maze.cell_count, CHUNK):
+        chunk = maze.cells[start:start + CHUNK]
+        if maze.TOPOLOGY == 'cartesian':
+            f.write(_pack_cartesian(chunk).tobytes())
+        else:
+            f.write((chunk & ~seen).tobytes())
+
+'''
+Open the maze file at `path` as a `MappedMaze`, without reading the body.
+'''
+def open_maze(path):
+    with open(path, 'rb') as f:
+        # a private copy-on-write mapping: the maze can be modified in memory
+        # without touching the file
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return MappedMaze(data)
+
+'''
+Load the maze file at `path` into a maze object. The body stays memory-mapped
+for triangle and hex mazes.
+'''
+def load(path):
+    return open_maze(path).to_maze()
+
+'''
+A maze file mapped into memory. Individual cells can be queried without
+unpacking the rest of the file.
+'''
+class MappedMaze:
+    def __init__(self, data):
+        self.data = data
+        self.header = Header.unpack(data)
+        self.body = np.frombuffer(data, dtype=np.uint8, count=self.header.body_size,
+                                  offset=HEADER.size)
+
+        if self.header.topology == 'cartesian':
+            self.cell_count = self.header.rows * self.header.cols
+        else:
+            self.cell_count = self.header.body_size
+
+    '''
+    Wall bits of cells `start` to `stop` (flat ids), in the same encoding as the
+    maze classes' cell store.
+    '''
+    def cells(self, start=0, stop=None):
+        stop = self.cell_count if stop is None else stop
+        if self.header.topology != 'cartesian':
+            return self.body[start:stop]
+
+        cols = self.header.cols
+        # unpack from one row earlier to recover N and W
+        first = max(0, start - cols)
+        bits = _unpack_cartesian(self.body, first, stop)
+
+        cells = bits[start - first:].copy()
+        ids = np.arange(start, stop)
+        above = ids >= cols
+        cells[above] |= np.where(bits[ids[above] - cols - first] & S, N, 0).astype(np.uint8)
+        left = ids % cols > 0
+        cells[left] |= np.where(bits[ids[left] - 1 - first] & E, W, 0).astype(np.uint8)
+        return cells
+
+    '''
+    Return True iff cell `cell` (a flat id) has a wall in direction `direction`.
+    '''
+    def has_wall(self, cell, direction):
+        return self.cells(cell, cell + 1)[0] & direction == 0
+
+    '''
+    Build a maze object of the right class from the file. Triangle and hex mazes
+    use the mapped body as their cell store; Cartesian mazes are unpacked.
+    '''
+    def to_maze(self):
+        h = self.header
+        cls = MAZE_CLASSES[h.topology]
+        if h.topology == 'cartesian':
+            cells = np.empty(self.cell_count, dtype=np.uint8)
+            for start in range(0, self.cell_count, CHUNK):
+                stop = min(start + CHUNK, self.cell_count)
+                cells[start:stop] = self.cells(start, stop)
+            maze = cls(h.rows, h.cols, seed=h.seed, cells=cells)
+        else:
+            maze = cls(h.rows, seed=h.seed, cells=self.body)
+        maze.algorithm = h.algorithm
+        return maze
+
+'''
+Pack the E and S bits of Cartesian `cells` (a flat array whose length is a
+multiple of 4, except possibly at the very end) 2 bits per cell.
+'''
+def _pack_cartesian(cells):
+    pairs = ((cells & E) != 0).astype(np.uint8) | (((cells & S) != 0).astype(np.uint8) << 1)
+    pairs = np.concatenate((pairs, np.zeros(-len(pairs) % 4, dtype=np.uint8)))
+    quads = pairs.reshape(-1, 4)
+    return quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+
+'''
+Unpack cells `start` to `stop` of a packed Cartesian body into E and S bits.
+'''
+def _unpack_cartesian(body, start, stop):
+    packed = body[start // 4:(stop + 3) // 4]
+    pairs = (packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+    pairs = pairs.reshape(-1)[start % 4:start % 4 + (stop - start)]
+    return np.where(pairs & 1, E, 0).astype(np.uint8) | np.where(pairs & 2, S, 0).astype(np.uint8)
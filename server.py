@@ -0,0 +1,497 @@
+'''
+Local HTTP service that generates, renders and solves mazes.
+
+    GET /<type>/<side>.<format>?algorithm=backtracker&seed=1
+
+`type` is one of `batch.MAZE_TYPES` and `format` one of FORMATS:
+
+    png    the image `render_image` draws, in the mode given by `?mode=`
+           (see `raster.MODES`, 'L' by default)
+    webp   the same, losslessly compressed WebP
+    qoi    the same, as QOI
+    svg    the same picture as SVG, see `svg.py`
+    txt    text, in the style given by `?style=` ('ascii' by default)
+    maze   the binary format of `serialize.py`
+    grid   raw cell bytes, as `batch.py` writes them
+    json   the shortest path from cell `?start=` to cell `?goal=` (flat ids,
+           by default the first and the last cell), with the cells'
+           coordinates
+
+Without a seed the server picks one. Every response carries the seed in an
+X-Maze-Seed header, so the same maze can be requested again. `GET /` lists the
+types, formats and the algorithms each type supports.
+
+Generation, rendering and solving run in a process pool, so the event loop
+only parses requests and streams responses. Results are kept in a `ResultCache`
+keyed by `(type, side, algorithm, seed, format)` plus the format's options: an
+LRU in memory in front of an LRU directory on disk, both bounded in bytes.
+Identical requests that arrive while their result is being looked up or
+computed wait for that one computation instead of starting their own.
+
+Usage:
+    python server.py --port 8080 --cache-dir cache/
+    curl -o maze.png 'http://localhost:8080/hex/15.png?seed=3'
+'''
+import argparse
+import asyncio
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import secrets
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from batch import MAZE_TYPES, cell_count, image_pixels
+import generators
+import raster
+import serialize
+import solve
+import svg
+import text
+
+FORMATS = ('png', 'webp', 'qoi', 'svg', 'txt', 'maze', 'grid', 'json')
+IMAGE_FORMATS = ('png', 'webp', 'qoi')
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'qoi': 'image/qoi',
+    'svg': 'image/svg+xml',
+    'txt': 'text/plain; charset=utf-8',
+    'maze': 'application/octet-stream',
+    'grid': 'application/octet-stream',
+    'json': 'application/json',
+}
+
+# Requests for larger mazes are refused
+MAX_CELLS = 4_000_000
+MAX_PIXELS = 100_000_000 # PNG canvas size
+
+DEFAULT_MEMORY_BYTES = 256 << 20
+DEFAULT_DISK_BYTES = 4 << 30
+
+MAX_HEADER_BYTES = 16 << 10
+MAX_BODY_BYTES = 16 << 10 # GET bodies are read and ignored, larger ones refused
+CHUNK = 1 << 16 # bytes written to the socket at a time
+
+'''
+One result to produce. `options` is a sorted tuple of (name, value) pairs for
+the format: the mode of images, the style of 'txt', the start and goal cells of
+'json'.
+'''
+Request = namedtuple('Request', 'type side algorithm seed format options')
+
+'''
+Build the maze described by `request` and produce its result as bytes. Runs in
+a worker process.
+'''
+def produce(request):
+    maze = MAZE_TYPES[request.type](request.side, seed=request.seed)
+    maze.generate(request.algorithm)
+    options = dict(request.options)
+
+    if request.format in IMAGE_FORMATS:
+        return maze.write_image(None, request.format, options['mode'])
+    if request.format == 'svg':
+        out = io.StringIO()
+        svg.write_svg(out, *maze.wall_geometry())
+        return out.getvalue().encode('utf-8')
+    if request.format == 'txt':
+        out = io.StringIO()
+        maze.render_to_text(out, options['style'])
+        return out.getvalue().encode('utf-8')
+    if request.format == 'maze':
+        out = io.BytesIO()
+        serialize.write(maze, out)
+        return out.getvalue()
+    if request.format == 'grid':
+        return (maze.cells & ~np.uint8(maze.SEEN_MARKER)).tobytes()
+
+    path = solve.solve(maze, options['start'], options['goal'])
+    if path is None:
+        return json.dumps({'path': None}).encode('utf-8')
+    a, b = maze.coordinates()
+    return json.dumps({'path': path,
+                       'coords': np.stack((a[path], b[path]), axis=1).tolist(),
+                       'length': len(path) - 1}).encode('utf-8')
+
+'''
+Size-bounded LRU cache of results, in memory and optionally in `directory` on
+disk. Entries evicted from memory stay on disk until the disk budget evicts
+them too; entries found on disk are brought back into memory. The disk cache
+survives restarts, its LRU order being kept in the files' modification times.
+Safe to use from several threads.
+'''
+class ResultCache:
+    SUFFIX = '.result'
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES, directory=None,
+                 disk_bytes=DEFAULT_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        self.memory_used = 0
+        self.disk_used = 0
+        self.__memory = OrderedDict() # key -> bytes
+        self.__disk = OrderedDict() # file name -> size
+        self.__lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(directory):
+                if entry.name.endswith(self.SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(entries):
+                self.__disk[name] = size
+                self.disk_used += size
+
+    '''
+    The cached result for `key`, or None.
+    '''
+    def get(self, key):
+        name = self.__filename(key)
+        with self.__lock:
+            if key in self.__memory:
+                self.__memory.move_to_end(key)
+                return self.__memory[key]
+            if name not in self.__disk:
+                return None
+            self.__disk.move_to_end(name)
+
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another thread in the meantime
+            return None
+        with self.__lock:
+            self.__remember(key, data)
+        return data
+
+    '''
+    Store `data`, the result for `key`.
+    '''
+    def put(self, key, data):
+        with self.__lock:
+            self.__remember(key, data)
+        if self.directory is None or len(data) > self.disk_bytes:
+            return
+
+        name = self.__filename(key)
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        evicted = []
+        with self.__lock:
+            self.disk_used += len(data) - self.__disk.pop(name, 0)
+            self.__disk[name] = len(data)
+            while self.disk_used > self.disk_bytes:
+                old, size = self.__disk.popitem(last=False)
+                self.disk_used -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    # add to the memory LRU, evicting the least recently used entries
+    def __remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        self.memory_used -= len(self.__memory.pop(key, b''))
+        while self.__memory and self.memory_used + len(data) > self.memory_bytes:
+            _, evicted = self.__memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+        self.__memory[key] = data
+        self.memory_used += len(data)
+
+    def __filename(self, key):
+        return hashlib.sha256(repr(tuple(key)).encode('utf-8')).hexdigest() + self.SUFFIX
+
+'''
+An error reported to the client with HTTP status `status`.
+'''
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Content Too Large', 431: 'Request Header Fields Too Large',
+           500: 'Internal Server Error'}
+
+'''
+The HTTP service. `handle` is the connection callback for
+`asyncio.start_server`; `close()` shuts the process pool down.
+'''
+class MazeServer:
+    def __init__(self, cache=None, workers=None, max_cells=MAX_CELLS, max_pixels=MAX_PIXELS):
+        self.cache = ResultCache() if cache is None else cache
+        self.workers = workers
+        self.pool = self.__new_pool()
+        self.max_cells = max_cells
+        self.max_pixels = max_pixels
+        self.computed = 0 # results produced by the pool, as opposed to the cache
+        self.__pending = {} # request -> future of its result
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __new_pool(self):
+        # forked workers would inherit the sockets open at the time, keeping
+        # connections alive after the server closes them
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+    '''
+    The result for `request`, from the cache or computed, sharing the work
+    with any identical request already in flight.
+    '''
+    async def result(self, request):
+        future = self.__pending.get(request)
+        if future is None:
+            future = asyncio.ensure_future(self.__lookup(request))
+            self.__pending[request] = future
+            future.add_done_callback(lambda f: self.__finished(request, f))
+        # a client going away must not cancel the work others wait for
+        return await asyncio.shield(future)
+
+    async def __lookup(self, request):
+        data = await asyncio.to_thread(self.cache.get, request)
+        if data is None:
+            data = await self.__compute(request)
+            self.computed += 1
+            await asyncio.to_thread(self.cache.put, request, data)
+        return data
+
+    '''
+    Produce the result for `request` in the pool. A worker dying (killed for
+    running out of memory, say) breaks the whole pool and fails everything
+    running in it, so the pool is replaced and the request tried once more on
+    the new one; if that breaks too, only this request fails.
+    '''
+    async def __compute(self, request):
+        loop = asyncio.get_running_loop()
+        for _ in range(2):
+            pool = self.pool
+            try:
+                return await loop.run_in_executor(pool, produce, request)
+            except BrokenProcessPool:
+                # requests that were running alongside see the same broken
+                # pool, only the first replaces it
+                if self.pool is pool:
+                    self.pool = self.__new_pool()
+                    pool.shutdown(wait=False)
+        raise HTTPError(500, "The worker process producing this result died")
+
+    def __finished(self, request, future):
+        del self.__pending[request]
+        if not future.cancelled():
+            future.exception() # retrieved, even if every waiter has gone
+
+    '''
+    Parse and validate the request target `target` into a `Request`.
+    '''
+    def parse(self, target):
+        url = urlsplit(target)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or '.' not in parts[1]:
+            raise HTTPError(404, f"No such resource {url.path!r}, expected /<type>/<side>.<format>")
+        topology, (side, _, fmt) = parts[0], parts[1].partition('.')
+        if topology not in MAZE_TYPES:
+            raise HTTPError(404, f"Unknown maze type {topology!r}, expected one of {sorted(MAZE_TYPES)}")
+        if fmt not in FORMATS:
+            raise HTTPError(404, f"Unknown format {fmt!r}, expected one of {FORMATS}")
+
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        side = _integer(side, 'side', minimum=1)
+        seed = query.get('seed')
+        seed = secrets.randbits(63) if seed is None else _integer(seed, 'seed', minimum=0)
+
+        algorithm = query.get('algorithm', 'backtracker')
+        if algorithm not in generators.available(MAZE_TYPES[topology].TOPOLOGY):
+            raise HTTPError(400, f"Algorithm {algorithm!r} cannot generate {topology} mazes, "
+                                 f"expected one of {generators.available(MAZE_TYPES[topology].TOPOLOGY)}")
+
+        cells = cell_count(topology, side)
+        if cells > self.max_cells:
+            raise HTTPError(413, f"Mazes are limited to {self.max_cells} cells, this one has {cells}")
+        if fmt in IMAGE_FORMATS and image_pixels(topology, side) > self.max_pixels:
+            raise HTTPError(413, f"Images are limited to {self.max_pixels} pixels")
+
+        options = {}
+        if fmt in IMAGE_FORMATS:
+            options['mode'] = query.get('mode', 'L')
+            if options['mode'] not in raster.MODES:
+                raise HTTPError(400, f"Unknown image mode {options['mode']!r}, expected one of {raster.MODES}")
+        elif fmt == 'txt':
+            options['style'] = query.get('style', 'ascii')
+            if options['style'] not in text.STYLES:
+                raise HTTPError(400, f"Unknown text style {options['style']!r}, expected one of {text.STYLES}")
+        elif fmt == 'json':
+            options['start'] = _integer(query.get('start', '0'), 'start', 0, cells - 1)
+            options['goal'] = _integer(query.get('goal', str(cells - 1)), 'goal', 0, cells - 1)
+
+        return Request(topology, side, algorithm, seed, fmt, tuple(sorted(options.items())))
+
+    '''
+    Serve HTTP/1.1 requests on one connection until the client closes it.
+    '''
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.LimitOverrunError:
+                    await self.__send(writer, 431, 'text/plain; charset=utf-8',
+                                      b'Request headers too large\n', close=True)
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                try:
+                    method, target, version, headers = _parse_head(head)
+                    length = _integer(headers.get('content-length', '0'), 'Content-Length', minimum=0)
+                except HTTPError as e:
+                    await self.__send(writer, e.status, 'text/plain; charset=utf-8',
+                                      f"{e}\n".encode('utf-8'), close=True)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.__send(writer, 413, 'text/plain; charset=utf-8',
+                                      f"Request bodies are limited to {MAX_BODY_BYTES} bytes\n".encode('utf-8'),
+                                      close=True)
+                    break
+                if length:
+                    try:
+                        await reader.readexactly(length) # GET bodies are ignored
+                    except asyncio.IncompleteReadError:
+                        break
+                close = (headers.get('connection', '').lower() == 'close'
+                         or version == 'HTTP/1.0')
+
+                status, content_type, body, extra = await self.__respond(method, target)
+                await self.__send(writer, status, content_type, body, extra,
+                                  head_only=method == 'HEAD', close=close)
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def __respond(self, method, target):
+        try:
+            if method not in ('GET', 'HEAD'):
+                raise HTTPError(405, f"Method {method} not allowed, use GET")
+            if urlsplit(target).path.strip('/') == '':
+                return 200, CONTENT_TYPES['json'], _index(), {}
+            request = self.parse(target)
+            try:
+                body = await self.result(request)
+            except ValueError as e:
+                raise HTTPError(400, str(e)) from None
+            return 200, CONTENT_TYPES[request.format], body, {'X-Maze-Seed': str(request.seed)}
+        except HTTPError as e:
+            return e.status, 'text/plain; charset=utf-8', f"{e}\n".encode('utf-8'), {}
+        except Exception as e:
+            return 500, 'text/plain; charset=utf-8', f"{type(e).__name__}: {e}\n".encode('utf-8'), {}
+
+    async def __send(self, writer, status, content_type, body, extra=None,
+                     head_only=False, close=False):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        if close:
+            lines.append("Connection: close")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head_only:
+            view = memoryview(body)
+            for start in range(0, len(view), CHUNK):
+                writer.write(view[start:start + CHUNK])
+                await writer.drain()
+        await writer.drain()
+
+def _integer(value, name, minimum=None, maximum=None):
+    try:
+        n = int(value)
+    except ValueError:
+        raise HTTPError(400, f"Expected an integer for {name}, got {value!r}") from None
+    if minimum is not None and n < minimum:
+        raise HTTPError(400, f"{name} must be at least {minimum}, got {n}")
+    if maximum is not None and n > maximum:
+        raise HTTPError(400, f"{name} must be at most {maximum}, got {n}")
+    return n
+
+# method, target, version and lowercased headers of a request head
+def _parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, f"Malformed request line {lines[0]!r}") from None
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+def _index():
+    return json.dumps({
+        'types': {name: generators.available(cls.TOPOLOGY) for name, cls in MAZE_TYPES.items()},
+        'formats': FORMATS,
+        'text_styles': text.STYLES,
+    }).encode('utf-8')
+
+'''
+Run the service until interrupted.
+'''
+async def serve(host='127.0.0.1', port=8080, cache=None, workers=None,
+                max_cells=MAX_CELLS, max_pixels=MAX_PIXELS):
+    server = MazeServer(cache, workers, max_cells, max_pixels)
+    try:
+        listener = await asyncio.start_server(server.handle, host, port,
+                                              limit=MAX_HEADER_BYTES)
+        async with listener:
+            print(f"Serving mazes on http://{host}:{port}/")
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Serve generated mazes over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-w', '--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--cache-dir', help="directory for the on-disk cache (default: memory only)")
+    parser.add_argument('--memory-cache', type=int, default=DEFAULT_MEMORY_BYTES >> 20,
+                        help="memory cache size in MiB")
+    parser.add_argument('--disk-cache', type=int, default=DEFAULT_DISK_BYTES >> 20,
+                        help="disk cache size in MiB")
+    parser.add_argument('--max-cells', type=int, default=MAX_CELLS)
+    parser.add_argument('--max-pixels', type=int, default=MAX_PIXELS)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+    cache = ResultCache(args.memory_cache << 20, args.cache_dir, args.disk_cache << 20)
+    try:
+        asyncio.run(serve(args.host, args.port, cache, args.workers,
+                          args.max_cells, args.max_pixels))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,382 @@
+'''
+Path finding over generated mazes: BFS, bidirectional BFS and A*.
+
+Searches walk the maze's adjacency table and only follow an entry when the
+cell's wall bit in that direction is open. Cells are flat ids (see
+`Maze.cell_id` for converting from coordinates) and paths are returned as lists
+of flat ids from start to goal, or None if the goal cannot be reached.
+
+Visited sets and parent links live in flat arrays owned by a `Solver`. Every
+query stamps the cells it visits with a fresh number instead of clearing the
+arrays, so a solver kept around for many queries on the same maze only pays
+for the cells each query actually touches.
+
+Only the compiled BFS (`kernels.bfs_path`, with Numba installed) answers a query
+on a 4000x4000 maze in under a second: about 0.35s corner to corner. The pure
+Python searches visit cells one at a time and take several seconds on mazes
+that size (5-6s for BFS and bidirectional BFS, about 10s for A*); they are the
+reference implementations and the fallback when Numba is unavailable or
+MAZE_PURE_PYTHON is set.
+'''
+from heapq import heappop, heappush
+
+import numpy as np
+
+import kernels
+
+# Above this many cells `solve()` defaults to bidirectional BFS when the
+# compiled kernels are not available; with them it always uses the compiled BFS.
+LARGE_MAZE = 1 << 20
+
+UNREACHABLE = 0xFFFFFFFF # distance_field value for cells that cannot be reached
+
+'''
+Admissible A* heuristics per topology. Each takes the two coordinate arrays of
+`Maze.coordinates()` (as memoryviews) and returns a function estimating the
+number of steps from a cell to `goal`.
+'''
+def _cartesian_distance(rows, cols, goal):
+    gr, gc = rows[goal], cols[goal]
+    # Manhattan distance: every step changes the row or the column by one
+    def h(cell):
+        return abs(rows[cell] - gr) + abs(cols[cell] - gc)
+    return h
+
+def _hex_distance(qs, rs, goal):
+    gq, gr = qs[goal], rs[goal]
+    # axial coordinates, distance is the cube distance
+    def h(cell):
+        dq, dr = qs[cell] - gq, rs[cell] - gr
+        return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+    return h
+
+def _triangle_distance(rs, qs, goal):
+    gr, gq = rs[goal], qs[goal]
+    # Every step changes either r (through an up cell's S side or a down cell's
+    # N side) or q by one. Two vertical steps always have a horizontal step in
+    # between, and the number of horizontal steps has the parity of dq.
+    def h(cell):
+        v, dq = abs(rs[cell] - gr), abs(qs[cell] - gq)
+        horizontal = max(dq, v - 1)
+        horizontal += (horizontal - dq) & 1
+        return v + horizontal
+    return h
+
+def _polar_distance(rings, indices, goal):
+    gr = rings[goal]
+    # every step changes the ring by at most one
+    def h(cell):
+        return abs(rings[cell] - gr)
+    return h
+
+HEURISTICS = {
+    'cartesian': _cartesian_distance,
+    'hex': _hex_distance,
+    'triangle': _triangle_distance,
+    'polar': _polar_distance,
+}
+
+'''
+Path finder bound to one maze. Reuse it for many queries on the same maze.
+'''
+class Solver:
+    def __init__(self, maze):
+        self.maze = maze
+        adj = maze.adjacency()
+        self.offsets = memoryview(adj.offsets)
+        self.neighbors = memoryview(adj.neighbors)
+        self.directions = memoryview(adj.directions)
+
+        n = maze.cell_count
+        self.parent = np.empty(n, dtype=np.int32)
+        self.dist = np.empty(n, dtype=np.int32) # steps from the start, for A*
+        self.stamps = np.zeros(n, dtype=np.uint32)
+        self.stamp = 0
+        self.queue = None # BFS queue of the compiled search, allocated on first use
+
+    '''
+    Shortest path with breadth-first search, compiled when the kernels are
+    enabled (see `kernels.bfs_path`).
+    '''
+    def bfs(self, start, goal):
+        if kernels.enabled():
+            return self.__compiled_bfs(start, goal)
+
+        offsets, neighbors, directions = self.offsets, self.neighbors, self.directions
+        cells = memoryview(self.maze.cells)
+        parent, stamps = memoryview(self.parent), memoryview(self.stamps)
+        mark = self.__next_stamp()
+
+        stamps[start] = mark
+        parent[start] = -1
+        frontier = [start]
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                if cell == goal:
+                    return self.__path_to(goal)
+                bits = cells[cell]
+                for k in range(offsets[cell], offsets[cell + 1]):
+                    n = neighbors[k]
+                    if bits & directions[k] and stamps[n] != mark:
+                        stamps[n] = mark
+                        parent[n] = cell
+                        next_frontier.append(n)
+            frontier = next_frontier
+        return None
+
+    '''
+    Shortest path with breadth-first search from both ends at once, always
+    growing the smaller frontier by a full level.
+    '''
+    def bidirectional_bfs(self, start, goal):
+        if start == goal:
+            return [start]
+
+        offsets, neighbors, directions = self.offsets, self.neighbors, self.directions
+        cells = memoryview(self.maze.cells)
+        parent, stamps = memoryview(self.parent), memoryview(self.stamps)
+        forward = self.__next_stamp()
+        backward = self.__next_stamp()
+
+        stamps[start], parent[start] = forward, -1
+        stamps[goal], parent[goal] = backward, -1
+        frontiers = {forward: [start], backward: [goal]}
+
+        while frontiers[forward] and frontiers[backward]:
+            side = forward if len(frontiers[forward]) <= len(frontiers[backward]) else backward
+            other = backward if side == forward else forward
+
+            next_frontier = []
+            for cell in frontiers[side]:
+                bits = cells[cell]
+                for k in range(offsets[cell], offsets[cell + 1]):
+                    if not bits & directions[k]:
+                        continue
+                    n = neighbors[k]
+                    if stamps[n] == other:
+                        # the searches met between `cell` and `n`
+                        if side == forward:
+                            return self.__join(cell, n)
+                        return self.__join(n, cell)
+                    if stamps[n] != side:
+                        stamps[n] = side
+                        parent[n] = cell
+                        next_frontier.append(n)
+            frontiers[side] = next_frontier
+        return None
+
+    '''
+    Shortest path with A*, guided by the admissible heuristic for the maze's
+    topology.
+    '''
+    def astar(self, start, goal):
+        offsets, neighbors, directions = self.offsets, self.neighbors, self.directions
+        cells = memoryview(self.maze.cells)
+        parent, stamps = memoryview(self.parent), memoryview(self.stamps)
+        dist = memoryview(self.dist)
+        mark = self.__next_stamp()
+
+        a, b = self.maze.coordinates()
+        h = HEURISTICS[self.maze.TOPOLOGY](memoryview(a), memoryview(b), goal)
+
+        stamps[start] = mark
+        parent[start] = -1
+        dist[start] = 0
+        # entries are (estimated total, steps so far, cell); a cell can be
+        # pushed more than once, stale entries are skipped when popped
+        heap = [(h(start), 0, start)]
+        while heap:
+            _, g, cell = heappop(heap)
+            if cell == goal:
+                return self.__path_to(goal)
+            if g > dist[cell]:
+                continue
+            bits = cells[cell]
+            for k in range(offsets[cell], offsets[cell + 1]):
+                if not bits & directions[k]:
+                    continue
+                n = neighbors[k]
+                if stamps[n] != mark or g + 1 < dist[n]:
+                    stamps[n] = mark
+                    parent[n] = cell
+                    dist[n] = g + 1
+                    heappush(heap, (g + 1 + h(n), g + 1, n))
+        return None
+
+    def __compiled_bfs(self, start, goal):
+        adj = self.maze.adjacency()
+        if self.queue is None:
+            self.queue = np.empty(self.maze.cell_count, dtype=np.int32)
+        path = kernels.bfs_path(adj.offsets, adj.neighbors, adj.directions, self.maze.cells,
+                                start, goal, self.parent, self.stamps, self.__next_stamp(),
+                                self.queue)
+        return path.tolist() if len(path) else None
+
+    def __next_stamp(self):
+        self.stamp += 1
+        if self.stamp == 1 << 32:
+            # wrapped around, stale stamps could collide with new ones
+            self.stamps.fill(0)
+            self.stamp = 1
+        return self.stamp
+
+    def __path_to(self, cell):
+        parent = memoryview(self.parent)
+        path = []
+        while cell >= 0:
+            path.append(cell)
+            cell = parent[cell]
+        path.reverse()
+        return path
+
+    # `a` was reached from the start, `b` from the goal
+    def __join(self, a, b):
+        parent = memoryview(self.parent)
+        path = self.__path_to(a)
+        while b >= 0:
+            path.append(b)
+            b = parent[b]
+        return path
+
+'''
+Path finder for mazes too large for per-cell arrays, such as
+`tiled_maze.TiledMaze`. The maze provides `open_neighbors(cell)` and
+`cell_coords(cell)`; search state lives in dicts holding only the cells a query
+visits. Has the same methods as `Solver`.
+'''
+class SparseSolver:
+    def __init__(self, maze):
+        self.maze = maze
+
+    def bfs(self, start, goal):
+        open_neighbors = self.maze.open_neighbors
+        parent = {start: -1}
+        frontier = [start]
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                if cell == goal:
+                    return _sparse_path(parent, goal)
+                for n in open_neighbors(cell):
+                    if n not in parent:
+                        parent[n] = cell
+                        next_frontier.append(n)
+            frontier = next_frontier
+        return None
+
+    def bidirectional_bfs(self, start, goal):
+        if start == goal:
+            return [start]
+
+        open_neighbors = self.maze.open_neighbors
+        # parent links and frontier of the search from the start (0) and from
+        # the goal (1)
+        parents = ({start: -1}, {goal: -1})
+        frontiers = [[start], [goal]]
+
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            parent, other = parents[side], parents[1 - side]
+
+            next_frontier = []
+            for cell in frontiers[side]:
+                for n in open_neighbors(cell):
+                    if n in other:
+                        # the searches met between `cell` and `n`
+                        a, b = (cell, n) if side == 0 else (n, cell)
+                        path = _sparse_path(parents[0], a)
+                        while b >= 0:
+                            path.append(b)
+                            b = parents[1][b]
+                        return path
+                    if n not in parent:
+                        parent[n] = cell
+                        next_frontier.append(n)
+            frontiers[side] = next_frontier
+        return None
+
+    def astar(self, start, goal):
+        open_neighbors, coords = self.maze.open_neighbors, self.maze.cell_coords
+        # sparse mazes are Cartesian, the heuristic is the Manhattan distance
+        gr, gc = coords(goal)
+        def h(cell):
+            r, c = coords(cell)
+            return abs(r - gr) + abs(c - gc)
+
+        parent, dist = {start: -1}, {start: 0}
+        heap = [(h(start), 0, start)]
+        while heap:
+            _, g, cell = heappop(heap)
+            if cell == goal:
+                return _sparse_path(parent, goal)
+            if g > dist[cell]:
+                continue
+            for n in open_neighbors(cell):
+                if n not in dist or g + 1 < dist[n]:
+                    parent[n] = cell
+                    dist[n] = g + 1
+                    heappush(heap, (g + 1 + h(n), g + 1, n))
+        return None
+
+def _sparse_path(parent, cell):
+    path = []
+    while cell >= 0:
+        path.append(cell)
+        cell = parent[cell]
+    path.reverse()
+    return path
+
+'''
+Number of steps from cell `source` to every cell of `maze`, as a uint32 array
+indexed by flat id. Cells that cannot be reached get UNREACHABLE.
+'''
+def distance_field(maze, source):
+    adj = maze.adjacency()
+    field = np.full(maze.cell_count, UNREACHABLE, dtype=np.uint32)
+    if kernels.enabled():
+        kernels.distance_field(adj.offsets, adj.neighbors, adj.directions, maze.cells,
+                               source, field)
+        return field
+
+    offsets, neighbors = memoryview(adj.offsets), memoryview(adj.neighbors)
+    directions = memoryview(adj.directions)
+    cells = memoryview(maze.cells)
+    dist = memoryview(field)
+    dist[source] = 0
+
+    # the queue is a list that is appended to while it is iterated over
+    queue = [source]
+    for cell in queue:
+        d = dist[cell] + 1
+        bits = cells[cell]
+        for k in range(offsets[cell], offsets[cell + 1]):
+            n = neighbors[k]
+            if bits & directions[k] and dist[n] == UNREACHABLE:
+                dist[n] = d
+                queue.append(n)
+    return field
+
+# names of the `Solver` (and `SparseSolver`) methods
+METHODS = {
+    'bfs': 'bfs',
+    'bidirectional': 'bidirectional_bfs',
+    'astar': 'astar',
+}
+
+'''
+Shortest path from cell `start` to cell `goal` of `maze` (flat ids). `method` is
+one of METHODS; by default the compiled BFS is used when the kernels are
+enabled, otherwise A* on small mazes and bidirectional BFS on large ones (which
+is far slower on large mazes, see above). Mazes with `SPARSE` set are searched
+with a `SparseSolver`. Keep a solver instead when running many queries on one
+maze.
+'''
+def solve(maze, start, goal, method=None):
+    if method is None:
+        if kernels.enabled() and not maze.SPARSE:
+            method = 'bfs'
+        else:
+            method = 'bidirectional' if maze.cell_count > LARGE_MAZE else 'astar'
+    solver = SparseSolver(maze) if maze.SPARSE else Solver(maze)
+    return getattr(solver, METHODS[method])(start, goal)
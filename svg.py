@@ -0,0 +1,98 @@
+'''
+SVG output for mazes.
+
+Every maze class describes its picture with `wall_geometry()`: boundary
+polylines plus one segment per wall, in the pixel coordinates the PNG renderers
+rasterize. Drawn one by one, the segments of a large maze make huge files that
+viewers are slow to render, so collinear segments that touch or overlap are
+first merged into single lines: a row of Cartesian S walls, a run of triangle
+horizontals, and so on. The lines are written to the file in chunks as one
+`<path>`, without building the document in memory.
+'''
+import numpy as np
+
+# Segments are put on the same line when their directions agree to within
+# 1e-6 and their distances from the origin to within 1e-3 pixels; both are far
+# below the precision of the coordinates the renderers compute.
+DIRECTION_STEPS = 10**6
+OFFSET_STEPS = 10**3
+EPSILON = 1e-6 # gap along a line below which segments are joined
+
+CHUNK = 4096 # lines formatted and written at a time
+
+'''
+Merge collinear segments that touch or overlap. Takes and returns four arrays
+`x0, y0, x1, y1` of segment ends; zero-length segments are dropped.
+'''
+def merge_segments(x0, y0, x1, y1):
+    x0, y0, x1, y1 = (np.asarray(v, dtype=np.float64) for v in (x0, y0, x1, y1))
+
+    # orient every segment the same way along its line
+    flip = (x1 < x0) | ((x1 == x0) & (y1 < y0))
+    x0, x1 = np.where(flip, x1, x0), np.where(flip, x0, x1)
+    y0, y1 = np.where(flip, y1, y0), np.where(flip, y0, y1)
+
+    length = np.hypot(x1 - x0, y1 - y0)
+    keep = length > 0
+    x0, y0, x1, y1, length = x0[keep], y0[keep], x1[keep], y1[keep], length[keep]
+    if len(x0) == 0:
+        return x0, y0, x1, y1
+    ux, uy = (x1 - x0)/length, (y1 - y0)/length
+
+    # a line is identified by its direction and its distance from the origin;
+    # positions along it are projections onto the direction
+    kx = np.round(ux*DIRECTION_STEPS).astype(np.int64)
+    ky = np.round(uy*DIRECTION_STEPS).astype(np.int64)
+    kd = np.round((x0*uy - y0*ux)*OFFSET_STEPS).astype(np.int64)
+    t0 = x0*ux + y0*uy
+    t1 = t0 + length
+
+    order = np.lexsort((t0, kd, ky, kx))
+    kx, ky, kd, t0, t1 = kx[order], ky[order], kd[order], t0[order], t1[order]
+    x0, y0, ux, uy = x0[order], y0[order], ux[order], uy[order]
+
+    new_line = np.ones(len(t0), dtype=bool)
+    new_line[1:] = (kx[1:] != kx[:-1]) | (ky[1:] != ky[:-1]) | (kd[1:] != kd[:-1])
+
+    # furthest end reached so far on each line: shift every line's positions
+    # past the previous line's so that one running maximum covers them all
+    line = np.cumsum(new_line) - 1
+    span = t1.max() - t0.min() + 1
+    shifted = t1 - t0.min() + line*span
+    reach = np.maximum.accumulate(shifted) - line*span + t0.min()
+
+    # a run starts at a new line or after a gap
+    start = new_line.copy()
+    start[1:] |= t0[1:] > reach[:-1] + EPSILON
+    first = np.flatnonzero(start)
+    last = np.append(first[1:] - 1, len(t0) - 1)
+
+    end = reach[last] - t0[first]
+    return (x0[first], y0[first],
+            x0[first] + ux[first]*end, y0[first] + uy[first]*end)
+
+'''
+Write an SVG document of `width` by `height` pixels to the text file `file`,
+drawing `polylines` (lists of points) and `segments` (arrays `x0, y0, x1, y1`)
+as 1 pixel black lines on white, like the PNG renderers.
+'''
+def write_svg(file, width, height, polylines, segments):
+    ends = [list(segments)]
+    for points in polylines:
+        points = np.asarray(points, dtype=np.float64)
+        ends.append([points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]])
+    x0, y0, x1, y1 = merge_segments(*(np.concatenate(v) for v in zip(*ends)))
+
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+               f'viewBox="0 0 {width} {height}">\n'
+               f'<rect width="{width}" height="{height}" fill="white"/>\n'
+               # pixel centers, where the rasterizer puts its 1 pixel lines
+               '<path transform="translate(0.5 0.5)" fill="none" stroke="black" '
+               'stroke-width="1" stroke-linecap="square" d="')
+    for start in range(0, len(x0), CHUNK):
+        stop = start + CHUNK
+        file.write(''.join(f"M{a:.7g} {b:.7g}L{c:.7g} {d:.7g}"
+                           for a, b, c, d in zip(x0[start:stop].tolist(), y0[start:stop].tolist(),
+                                                 x1[start:stop].tolist(), y1[start:stop].tolist())))
+    file.write('"/>\n</svg>\n')
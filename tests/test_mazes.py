@@ -0,0 +1,220 @@
+'''
+Checks shared by every kind of maze: generation gives perfect mazes with every
+registered algorithm, mazes survive a trip through `serialize.py`, all solvers
+agree, and the vectorized renderers draw the same pixels as the original
+per-wall `ImageDraw` renderers.
+'''
+import numpy as np
+from PIL import Image, ImageDraw
+import pytest
+
+from batch import MAZE_TYPES
+from cartesian_maze import CartesianMaze
+import generators
+import kernels
+from pointy_hexagon_maze import PointyHexagonMaze
+import serialize
+import solve
+from triangle_maze import TriangleMaze
+
+TOPOLOGIES = sorted(MAZE_TYPES)
+SIDES = {'cartesian': 13, 'triangle': 9, 'hex': 6, 'polar': 5}
+
+'''
+Assert that `maze` is perfect: every passage is open from both sides and the
+passages form a spanning tree of the cells.
+'''
+def assert_perfect(maze):
+    adj = maze.adjacency()
+    cells = np.asarray(maze.cells)
+    src = np.repeat(np.arange(len(adj)), np.diff(adj.offsets))
+    forward = (cells[src] & adj.directions) != 0
+    backward = (cells[adj.neighbors] & adj.back) != 0
+    assert (forward == backward).all(), "passage open from one side only"
+    assert int(forward.sum()) // 2 == maze.cell_count - 1, "not a tree"
+    assert (maze.distances(0) != solve.UNREACHABLE).all(), "not connected"
+
+def cases():
+    return [(topology, algorithm) for topology in TOPOLOGIES
+            for algorithm in generators.available(topology)]
+
+def generated(topology, algorithm='backtracker', seed=1):
+    maze = MAZE_TYPES[topology](SIDES[topology], seed=seed)
+    maze.generate(algorithm)
+    return maze
+
+@pytest.fixture(params=[True, False], ids=['kernels', 'python'])
+def kernels_enabled(request):
+    if request.param and not kernels.AVAILABLE:
+        pytest.skip("Numba is not installed")
+    was = kernels.enabled()
+    kernels.enable() if request.param else kernels.disable()
+    yield request.param
+    kernels.enable() if was else kernels.disable()
+
+@pytest.mark.parametrize('topology,algorithm', cases())
+def test_generate_perfect(topology, algorithm, kernels_enabled):
+    assert_perfect(generated(topology, algorithm))
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_tiny_mazes_perfect(topology):
+    for side in (1, 2, 3):
+        maze = MAZE_TYPES[topology](side, seed=0)
+        maze.generate()
+        assert_perfect(maze)
+
+@pytest.mark.parametrize('topology,algorithm', cases())
+def test_same_seed_same_maze(topology, algorithm):
+    a, b = generated(topology, algorithm, 5), generated(topology, algorithm, 5)
+    assert np.array_equal(a.cells, b.cells)
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_kernels_match_python(topology):
+    if not kernels.AVAILABLE:
+        pytest.skip("Numba is not installed")
+    was = kernels.enabled()
+    try:
+        kernels.disable()
+        python = generated(topology, seed=3)
+        kernels.enable()
+        compiled = generated(topology, seed=3)
+    finally:
+        kernels.enable() if was else kernels.disable()
+    assert np.array_equal(python.cells, compiled.cells)
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_serialize_round_trip(topology, tmp_path):
+    maze = generated(topology, 'kruskal', 7)
+    path = tmp_path / f"{topology}.maze"
+    serialize.save(maze, path)
+
+    loaded = serialize.load(path)
+    assert type(loaded) is type(maze)
+    assert loaded.size == maze.size
+    assert loaded.seed == maze.seed and loaded.algorithm == maze.algorithm
+    walls = np.asarray(maze.cells) & ~np.uint8(maze.SEEN_MARKER)
+    assert np.array_equal(np.asarray(loaded.cells) & ~np.uint8(maze.SEEN_MARKER), walls)
+
+    mapped = serialize.open_maze(path)
+    assert np.array_equal(mapped.cells() & ~np.uint8(maze.SEEN_MARKER), walls)
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_solvers_agree(topology, kernels_enabled):
+    maze = generated(topology, seed=2)
+    solver = solve.Solver(maze)
+    index = maze.tree_index()
+    adj = maze.adjacency()
+    rng = np.random.default_rng(0)
+    for start, goal in rng.integers(maze.cell_count, size=(30, 2)).tolist():
+        paths = [getattr(solver, method)(start, goal) for method in solve.METHODS.values()]
+        # a perfect maze has exactly one path between two cells
+        assert all(path == paths[0] for path in paths)
+        path = paths[0]
+        assert path[0] == start and path[-1] == goal
+        for a, b in zip(path, path[1:]):
+            k = adj.offsets[a] + list(adj.neighbors[adj.offsets[a]:adj.offsets[a + 1]]).index(b)
+            assert maze.cells[a] & adj.directions[k]
+        assert len(path) - 1 == maze.distances(start)[goal] == index.distance(start, goal)
+        assert solve.solve(maze, start, goal) == path
+
+# The original renderers, drawing one wall at a time with ImageDraw
+def baseline_cartesian(maze):
+    from cartesian_maze import E, S
+    SC, M = 25, 20
+    WIDTH, HEIGHT = maze.cols*SC, maze.rows*SC
+    image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([(M, M), (WIDTH + M, HEIGHT + M)], None, (0, 0, 0))
+    for r in range(maze.rows):
+        for c in range(maze.cols):
+            if maze.has_wall(maze.cell_id(r, c), E):
+                draw.line([(M + (c+1)*SC, M + r*SC), (M + (c+1)*SC, M + (r+1)*SC)], (0, 0, 0))
+            if maze.has_wall(maze.cell_id(r, c), S):
+                draw.line([(M + c*SC, M + (r+1)*SC), (M + (c+1)*SC, M + (r+1)*SC)], (0, 0, 0))
+    return image
+
+def baseline_triangle(maze):
+    from triangle_maze import E, S, SQRT_3
+    SC, M = 40, 25
+    WIDTH = int(maze.N*SC)
+    HEIGHT = int(SQRT_3*WIDTH/2)
+    image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    draw.polygon([(M+WIDTH/2, M), (M, M+HEIGHT), (M+WIDTH, M+HEIGHT)], None, (0, 0, 0))
+    for r in range(maze.N):
+        for q in range(-r, r+1):
+            cell = maze.cell_id(r, q)
+            if (r + q) % 2 == 0:
+                if maze.has_wall(cell, E):
+                    draw.line([(M+(WIDTH+q*SC)/2, M+SC*(r*SQRT_3/2)),
+                               (M+(WIDTH+(q+1)*SC)/2, M+SC*((r+1)*SQRT_3/2))], (0, 0, 0))
+                if maze.has_wall(cell, S):
+                    draw.line([(M+(WIDTH+(q-1)*SC)/2, M+SC*((r+1)*SQRT_3/2)),
+                               (M+(WIDTH+(q+1)*SC)/2, M+SC*((r+1)*SQRT_3/2))], (0, 0, 0))
+            elif maze.has_wall(cell, E):
+                draw.line([(M+(WIDTH+(q+1)*SC)/2, M+SC*(r*SQRT_3/2)),
+                           (M+(WIDTH+q*SC)/2, M+SC*((r+1)*SQRT_3/2))], (0, 0, 0))
+    return image
+
+def baseline_hex(maze):
+    from pointy_hexagon_maze import E, SE, SW, SQRT_3
+    SC, M = 20, 25
+    N = maze.N
+    WIDTH = int((2*N - 1)*SQRT_3*SC)
+    HEIGHT = int((3*N-1)*SC)
+    image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    top_wall, bottom_wall = [], []
+    for col in range(N + 1):
+        x = M + SC*SQRT_3*(col + ((N-1) / 2))
+        dx = SC*SQRT_3 / 2
+        top_wall.extend([(x, M + SC / 2), (x+dx, M)])
+        bottom_wall.extend([(x, M + SC*(3*N - 1.5)), (x+dx, M + SC*(3*N - 1))])
+    top_wall.pop()
+    bottom_wall.pop()
+    draw.line(top_wall, (0, 0, 0))
+    draw.line(bottom_wall, (0, 0, 0))
+
+    x = M + SC*SQRT_3*(N-1)/2
+    y = M + SC/2
+    dx, dy = -SC*SQRT_3/2, SC*1.5
+    left_wall, right_wall = [], []
+    for r in range(maze.rows):
+        if r == N-1:
+            dx = -dx
+            left_wall.pop()
+            right_wall.pop()
+        left_wall.extend([(x, y), (x, y+SC), (x+dx, y+dy)])
+        d = N - r - 1
+        qmin, qmax = max(0, d), maze.rows - abs(d) + max(0, d)
+        row_width = (qmax-qmin)*SC*SQRT_3
+        right_wall.extend([(x+row_width, y), (x+row_width, y+SC), (x+row_width-dx, y+dy)])
+        for q in range(qmin, qmax):
+            cell = maze.cell_id(q, r)
+            if maze.has_wall(cell, E):
+                draw.line([(x+(q-qmin+1)*SQRT_3*SC, y), (x+(q-qmin+1)*SQRT_3*SC, y+SC)], (0, 0, 0))
+            if maze.has_wall(cell, SE):
+                draw.line([(x+(q-qmin+1)*SQRT_3*SC, y+SC), (x+(q-qmin+0.5)*SQRT_3*SC, y+SC*1.5)], (0, 0, 0))
+            if maze.has_wall(cell, SW):
+                draw.line([(x+(q-qmin+0.5)*SQRT_3*SC, y+SC*1.5), (x+(q-qmin)*SQRT_3*SC, y+SC)], (0, 0, 0))
+        x += dx
+        y += dy
+    left_wall.pop()
+    draw.line(left_wall, (0, 0, 0))
+    draw.line(right_wall, (0, 0, 0))
+    return image
+
+@pytest.mark.parametrize('cls,side,baseline', [
+    (CartesianMaze, 17, baseline_cartesian),
+    (TriangleMaze, 12, baseline_triangle),
+    (PointyHexagonMaze, 8, baseline_hex),
+], ids=['cartesian', 'triangle', 'hex'])
+@pytest.mark.parametrize('mode', ['RGB', 'L'])
+def test_png_matches_baseline(cls, side, baseline, mode):
+    maze = cls(side, seed=4)
+    maze.generate('wilson')
+    expected = np.asarray(baseline(maze).convert('L'))
+    actual = np.asarray(maze.render_image(mode).convert('L'))
+    assert actual.shape == expected.shape
+    assert np.array_equal(actual, expected)
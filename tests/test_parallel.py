@@ -0,0 +1,65 @@
+'''
+Mazes generated region by region with `parallel.py` are perfect whatever the
+layout of the regions, and do not depend on the number of workers.
+'''
+import numpy as np
+import pytest
+
+from cartesian_maze import CartesianMaze, N, S, E, W
+import generators
+import parallel
+import solve
+
+REGION = 8
+
+'''
+Assert that the Cartesian `maze` is perfect: every passage is open from both
+sides, the outer walls are closed, and the passages connect all cells with
+exactly `cell_count - 1` of them, i.e. they form a spanning tree.
+'''
+def assert_perfect(maze):
+    grid = maze.grid
+    east = (grid[:, :-1] & E) != 0
+    south = (grid[:-1, :] & S) != 0
+    assert (east == ((grid[:, 1:] & W) != 0)).all(), "passage open from one side only"
+    assert (south == ((grid[1:, :] & N) != 0)).all(), "passage open from one side only"
+    assert not ((grid[:, -1] & E).any() or (grid[:, 0] & W).any() or
+                (grid[-1, :] & S).any() or (grid[0, :] & N).any()), "outer wall open"
+    assert int(east.sum()) + int(south.sum()) == maze.cell_count - 1, "not a tree"
+    assert (maze.distances(0) != solve.UNREACHABLE).all(), "not connected"
+
+# a single column of regions, a single row of regions and a grid of regions,
+# with and without partial regions at the edges
+LAYOUTS = [(45, REGION), (45, 5), (REGION, 45), (5, 45), (45, 37), (REGION, REGION), (1, 1)]
+
+@pytest.mark.parametrize('rows,cols', LAYOUTS)
+@pytest.mark.parametrize('algorithm', generators.available('cartesian'))
+def test_layouts_perfect(rows, cols, algorithm):
+    maze = CartesianMaze(rows, cols, seed=0)
+    parallel.generate(maze, algorithm, workers=1, region=REGION)
+    assert maze.algorithm == algorithm
+    assert_perfect(maze)
+
+def test_workers_give_same_maze():
+    single = CartesianMaze(45, 37, seed=2)
+    parallel.generate(single, 'kruskal', workers=1, region=REGION)
+    several = CartesianMaze(45, 37, seed=2)
+    parallel.generate(several, 'kruskal', workers=2, region=REGION)
+    assert_perfect(several)
+    assert np.array_equal(single.cells, several.cells)
+
+def test_rejects_other_topologies():
+    from triangle_maze import TriangleMaze
+    with pytest.raises(ValueError):
+        parallel.generate(TriangleMaze(5), workers=1)
+    with pytest.raises(ValueError):
+        parallel.generate(CartesianMaze(5), 'no-such-algorithm', workers=1)
+
+def test_store_outlives_generation():
+    import pickle
+    maze = CartesianMaze(30, 20, seed=1)
+    parallel.generate(maze, workers=1, region=REGION)
+    copy = pickle.loads(pickle.dumps(maze))
+    maze.grid[0, 0] |= 0 # the shared store is still mapped and writable
+    assert np.array_equal(copy.cells, maze.cells)
+    assert_perfect(copy)
@@ -0,0 +1,60 @@
+'''
+The HTTP service survives its workers dying and refuses oversized or truncated
+request bodies.
+'''
+import asyncio
+
+import pytest
+
+import server
+
+@pytest.fixture(scope='module')
+def maze_server():
+    instance = server.MazeServer(workers=1)
+    yield instance
+    instance.close()
+
+# send `raw` on a new connection and return the status and the whole response
+async def exchange(instance, raw, close_write=False):
+    listener = await asyncio.start_server(instance.handle, '127.0.0.1', 0,
+                                          limit=server.MAX_HEADER_BYTES)
+    async with listener:
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(raw)
+        if close_write:
+            writer.write_eof()
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 60)
+        writer.close()
+    if not response:
+        return None, response
+    return int(response.split(b' ', 2)[1]), response
+
+def get(instance, target):
+    raw = f"GET {target} HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n".encode('latin-1')
+    return asyncio.run(exchange(instance, raw))
+
+def test_pool_replaced_after_worker_dies(maze_server):
+    status, _ = get(maze_server, '/cartesian/5.txt?seed=1')
+    assert status == 200
+
+    broken = maze_server.pool
+    for process in list(broken._processes.values()):
+        process.kill()
+        process.join()
+
+    status, response = get(maze_server, '/cartesian/6.txt?seed=1')
+    assert status == 200, response
+    assert maze_server.pool is not broken
+
+def test_large_body_refused(maze_server):
+    raw = (f"GET /cartesian/5.txt HTTP/1.1\r\nContent-Length: {server.MAX_BODY_BYTES + 1}\r\n"
+           "\r\n").encode('latin-1')
+    status, _ = asyncio.run(exchange(maze_server, raw))
+    assert status == 413
+
+def test_truncated_body_closes_connection(maze_server):
+    raw = b"GET /cartesian/5.txt HTTP/1.1\r\nContent-Length: 100\r\n\r\nshort"
+    status, response = asyncio.run(exchange(maze_server, raw, close_write=True))
+    assert status is None and response == b''
@@ -0,0 +1,64 @@
+'''
+Text output shared by the maze classes.
+
+Each maze class turns rows of cells into lines of text with lookup tables from
+wall bits to glyphs, built with `lookup_table`: indexing a table with a whole
+row of cells gives the code points of every glyph in the row at once, and
+`decode` turns them into a string. `write_lines` then writes lines to any text
+file-like object in large chunks instead of one small write per character.
+
+Renderers are generators of lines that consume the maze one row at a time, so
+mazes streamed row by row (e.g. `cartesian_maze.eller_rows`) can be printed
+without ever being held in memory.
+
+Every renderer supports two styles: 'ascii' with `_`, `|`, `/` and `\\`, and
+'unicode' with box-drawing characters.
+'''
+import sys
+
+import numpy as np
+
+STYLES = ('ascii', 'unicode')
+
+BUFFER_SIZE = 1 << 16 # characters collected before each write
+
+'''
+Raise ValueError unless `style` is one of STYLES.
+'''
+def check_style(style):
+    if style not in STYLES:
+        raise ValueError(f"Unknown text style {style!r}, expected one of {STYLES}")
+
+'''
+Build a lookup table of glyphs: row `bits` of the result holds the code points
+of `glyph(bits)`, a string of `width` characters, for every `bits` below `size`.
+'''
+def lookup_table(size, width, glyph):
+    table = np.empty((size, width), dtype=np.uint32)
+    for bits in range(size):
+        table[bits] = [ord(ch) for ch in glyph(bits)]
+    return table
+
+'''
+String of the code points in the uint32 array `codes`, in order.
+'''
+def decode(codes):
+    return np.ascontiguousarray(codes, dtype='<u4').tobytes().decode('utf-32-le')
+
+'''
+Write `lines` (strings without line endings) to `file` (default: standard
+output), collecting about BUFFER_SIZE characters per write.
+'''
+def write_lines(lines, file=None):
+    file = sys.stdout if file is None else file
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line) + 1
+        if size >= BUFFER_SIZE:
+            chunk.append('')
+            file.write('\n'.join(chunk))
+            chunk, size = [], 0
+    if chunk:
+        chunk.append('')
+        file.write('\n'.join(chunk))
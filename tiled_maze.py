@@ -0,0 +1,256 @@
+'''
+Cartesian mazes too large to hold in memory.
+
+The grid is split into square tiles of `tile` x `tile` cells (smaller along the
+bottom and right edges). Each tile is an ordinary `CartesianMaze` generated from
+its own random stream, derived from `(seed, tile_row, tile_col)`, so any tile
+can be rebuilt at any time without looking at the others. Tiles are only
+materialized when a cell in them is read, and kept in an LRU cache bounded by a
+byte budget.
+
+To keep the whole maze a perfect maze, tiles are themselves joined into a
+spanning tree with the binary tree rule: every tile except the top-left one
+opens exactly one passage through its north or west boundary, picked by a hash
+of the seed and the tile position (tiles in the top row always go west, tiles in
+the left column always go north). The hash also picks where along the boundary
+the opening is, so both tiles sharing a boundary agree on it without either
+having to be generated.
+
+Cells are addressed by (row, col) or by flat id `row*cols + col` like in
+`CartesianMaze`. Path finding goes through `solve.solve`, which uses a solver
+with dict-based state for mazes like this one.
+'''
+from collections import OrderedDict
+import io
+
+import numpy as np
+
+from cartesian_maze import (CartesianMaze, N, S, E, W, DX, DY, SEEN_MARKER,
+                            render_rows_to_png, render_rows_to_text, render_viewport)
+import generators
+import raster
+
+DEFAULT_TILE = 256
+DEFAULT_CACHE_BYTES = 64 << 20
+
+'''
+Maze of `side` rows by `cols` columns (square if `cols` is None), built from
+tiles generated on demand with `algorithm`. At most `cache_bytes` of tiles are
+kept in memory at once.
+'''
+class TiledMaze:
+    TOPOLOGY = 'cartesian'
+    SEEN_MARKER = SEEN_MARKER
+    SPARSE = True # see `solve.solve`
+
+    def __init__(self, side, cols=None, tile=DEFAULT_TILE, seed=None,
+                 algorithm='backtracker', cache_bytes=DEFAULT_CACHE_BYTES):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        if not isinstance(seed, int) or seed < 0:
+            raise ValueError(f"Tiled mazes need a non-negative int seed, got {seed!r}")
+        gen = generators.GENERATORS.get(algorithm)
+        if gen is None or not gen.supports(self.TOPOLOGY):
+            raise ValueError(f"Algorithm {algorithm!r} cannot generate tiles, "
+                             f"expected one of {generators.available(self.TOPOLOGY)}")
+
+        self.seed = seed
+        self.algorithm = algorithm
+        self.rows = side
+        self.cols = side if cols is None else cols
+        self.size = (self.rows, self.cols)
+        self.tile = tile
+        self.tile_rows = -(-self.rows // tile)
+        self.tile_cols = -(-self.cols // tile)
+
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.__tiles = OrderedDict()
+
+    '''
+    Total number of cells in the maze.
+    '''
+    @property
+    def cell_count(self):
+        return self.rows * self.cols
+
+    '''
+    Flat id of the cell in row `r`, column `c`.
+    '''
+    def cell_id(self, r, c):
+        return r*self.cols + c
+
+    '''
+    (row, col) of the cell with flat id `cell`.
+    '''
+    def cell_coords(self, cell):
+        return divmod(cell, self.cols)
+
+    '''
+    Wall bits of the cell in row `r`, column `c`.
+    '''
+    def cell(self, r, c):
+        ty, r = divmod(r, self.tile)
+        tx, c = divmod(c, self.tile)
+        return int(self.tile_cells(ty, tx)[r, c])
+
+    '''
+    Return True iff cell `cell` (a flat id) has a wall in direction `direction`,
+    like `Maze.has_wall`.
+    '''
+    def has_wall(self, cell, direction):
+        return self.has_wall_at(*divmod(cell, self.cols), direction)
+
+    '''
+    Return True iff the cell in row `r`, column `c` has a wall in direction
+    `direction`.
+    '''
+    def has_wall_at(self, r, c, direction):
+        return self.cell(r, c) & direction == 0
+
+    '''
+    Flat ids of the cells reachable in one step from cell `cell` (a flat id).
+    '''
+    def open_neighbors(self, cell):
+        r, c = divmod(cell, self.cols)
+        bits = self.cell(r, c)
+        return [(r + DY[d])*self.cols + c + DX[d] for d in (N, E, W, S) if bits & d]
+
+    '''
+    Wall bits of rows `r0` to `r1` and columns `c0` to `c1` (end exclusive) as a
+    new 2D array, assembled from the tiles it overlaps.
+    '''
+    def region(self, r0, c0, r1, c1):
+        T = self.tile
+        out = np.empty((r1 - r0, c1 - c0), dtype=np.uint8)
+        for ty in range(r0 // T, -(-r1 // T)):
+            for tx in range(c0 // T, -(-c1 // T)):
+                tile = self.tile_cells(ty, tx)
+                a, b = max(r0, ty*T), min(r1, (ty + 1)*T)
+                c, d = max(c0, tx*T), min(c1, (tx + 1)*T)
+                out[a - r0:b - r0, c - c0:d - c0] = tile[a - ty*T:b - ty*T, c - tx*T:d - tx*T]
+        return out
+
+    '''
+    A standalone `CartesianMaze` holding a copy of a region (see `region`), e.g.
+    for rendering or inspecting a window of the maze with the usual methods.
+    Cells on the region's edges may have passages leading out of it.
+    '''
+    def submaze(self, r0, c0, r1, c1):
+        cells = self.region(r0, c0, r1, c1)
+        return CartesianMaze(r1 - r0, c1 - c0, cells=cells.reshape(-1))
+
+    '''
+    Yield the maze one row at a time, a band of tiles at a time, in the form
+    `render_rows_to_text` and `render_rows_to_png` consume.
+    '''
+    def iter_rows(self):
+        for r0 in range(0, self.rows, self.tile):
+            yield from self.region(r0, 0, min(r0 + self.tile, self.rows), self.cols)
+
+    '''
+    Print out the maze as text, streaming it row by row. See
+    `cartesian_maze.text_lines` for `style`.
+    '''
+    def render_to_text(self, file=None, style='ascii'):
+        render_rows_to_text(self.iter_rows(), self.cols, file, style)
+
+    '''
+    Render the maze to PNG, streaming it row by row so that neither the maze
+    nor the image has to fit in memory. `filename` and `file` are as for
+    `Maze.render_to_png`; returning bytes (when both are None) does hold the
+    encoded image in memory. `mode` is 'L' or '1', see `png_stream.PngWriter`.
+    '''
+    def render_to_png(self, filename=None, file=None, mode='L', compress_level=6):
+        if filename is not None:
+            file = f"./img/{filename}.png"
+            print(f"Writing maze to {file}")
+        out = io.BytesIO() if file is None else file
+        render_rows_to_png(self.iter_rows(), self.rows, self.cols, out,
+                           mode=mode, compress_level=compress_level)
+        return out.getvalue() if file is None else None
+
+    '''
+    Render the pixel rectangle from (`x0`, `y0`) to (`x1`, `y1`) (end exclusive)
+    of the maze's image at the usual scale, materializing only the tiles under
+    it. See `cartesian_maze.render_viewport`.
+    '''
+    def render_viewport(self, x0, y0, x1, y1, mode='L'):
+        return raster.to_image(render_viewport(self, x0, y0, x1, y1), mode)
+
+    '''
+    Wall bits of tile (`ty`, `tx`) as a 2D array, generated and cached if it is
+    not in the cache already. The array must not be modified.
+    '''
+    def tile_cells(self, ty, tx):
+        key = (ty, tx)
+        tiles = self.__tiles
+        if key in tiles:
+            tiles.move_to_end(key)
+            return tiles[key]
+
+        cells = self.__build_tile(ty, tx)
+        while tiles and self.cached_bytes + cells.nbytes > self.cache_bytes:
+            _, evicted = tiles.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+        tiles[key] = cells
+        self.cached_bytes += cells.nbytes
+        return cells
+
+    '''
+    Drop every cached tile.
+    '''
+    def clear_cache(self):
+        self.__tiles.clear()
+        self.cached_bytes = 0
+
+    # tiles are cheap to rebuild, so copies sent to other processes start with
+    # an empty cache
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_TiledMaze__tiles'] = OrderedDict()
+        state['cached_bytes'] = 0
+        return state
+
+    def __build_tile(self, ty, tx):
+        T = self.tile
+        height = min(T, self.rows - ty*T)
+        width = min(T, self.cols - tx*T)
+
+        tile = CartesianMaze(height, width,
+                             seed=np.random.default_rng([self.seed, ty, tx]))
+        tile.generate(self.algorithm)
+        cells = tile.grid
+
+        # this tile's own opening, and the ones its south and east neighbors
+        # make into it
+        link = self.__link(ty, tx)
+        if link is not None:
+            direction, k = link
+            if direction == N:
+                cells[0, k] |= N
+            else:
+                cells[k, 0] |= W
+        if ty + 1 < self.tile_rows:
+            direction, k = self.__link(ty + 1, tx)
+            if direction == N:
+                cells[height - 1, k] |= S
+        if tx + 1 < self.tile_cols:
+            direction, k = self.__link(ty, tx + 1)
+            if direction == W:
+                cells[k, width - 1] |= E
+
+        cells.setflags(write=False)
+        return cells
+
+    '''
+    The boundary opening of tile (`ty`, `tx`) as (N, column) or (W, row) within
+    the tile, or None for the top-left tile.
+    '''
+    def __link(self, ty, tx):
+        if ty == 0 and tx == 0:
+            return None
+        choice, where = np.random.SeedSequence([self.seed, ty, tx, 1]).generate_state(2).tolist()
+        if ty > 0 and (tx == 0 or choice & 1):
+            return N, where % min(self.tile, self.cols - tx*self.tile)
+        return W, where % min(self.tile, self.rows - ty*self.tile)
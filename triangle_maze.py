@@ -1,7 +1,9 @@
-from maze import Maze
+from maze import Adjacency, Maze
+import generators
+import raster
+import text
 
-from PIL import Image, ImageDraw
-from random import shuffle
+import numpy as np
 
 SQRT_3 = 1.73205
 N, E, S, W = 1, 2, 4, 8
@@ -31,127 +33,174 @@ OPPOSITE = {
 '''
 Maze based on a grid made of equilateral triangles
 The overall shape of the grid is an equilateral triangle pointing up
-`coords` is a list of length 2 representing [r, q] coordinates.
+Cells are addressed by (r, q) coordinates or by flat id, see `cell_id`.
 '''
 class TriangleMaze(Maze):
-    def __init__(self, side):
+    TOPOLOGY = 'triangle'
+    SEEN_MARKER = SEEN_MARKER
+    SC = 40 # output scale
+    M = 25 # padding
+    __slots__ = ('N',)
+
+    def __init__(self, side, seed=None, cells=None):
+        self._seed(seed)
         self.N = side # number of rows in the grid
+        self.size = side
 
-        # Grid is stored as an array of arrays
-        self.grid = [
-            [0 for _ in range(2*r + 1)]
-            for r in range(self.N)
-        ]
-
-    def __in_bounds(self, coords):
-        r, q = coords
-        return 0 <= r < self.N and -r <= q <= r
-
-    def __points_up(self, r, q):
-        return (r + q) % 2 == 0
-
-    def __neighbors(self, coords):
-        directions = [E, W]
-        directions.append(S if self.__points_up(*coords) else N)
-        shuffle(directions)
-
-        cr, cq = coords
-
-        for direction in directions:
-            nr, nq = cr + DR[direction], cq + DQ[direction]
-
-            if not self.__in_bounds([nr, nq]):
-                continue
-
-            yield (nr, nq, direction)
-
-    def render_to_png(self, filename):
-        SC = 40 # output scale
-        M = 25 # padding
-
-        WHITE = (255, 255, 255)
-        BLACK = (0, 0, 0)
-
-        WIDTH = int(self.N*SC) # final row has width == N triangles
-        HEIGHT = int(SQRT_3*WIDTH/2)
-
-        image = Image.new('RGB', (WIDTH + 2*M, HEIGHT + 2*M))
-        draw = ImageDraw.Draw(image)
-
-        draw.rectangle([(0, 0),
-                        (WIDTH + 2*M, HEIGHT + 2*M)],
-                        WHITE)
-
-        # draw the boundary of the overall grid
-        draw.polygon([(M+WIDTH/2, M),
-                      (M, M+HEIGHT),
-                      (M+WIDTH, M+HEIGHT)],
-                     None, BLACK)
-
-        for r in range(self.N):
-            for q in range(-r, r+1):
-                if self.__points_up(r, q):
-                    if self.__has_wall([r, q], E):
-                        draw.line([(M+(WIDTH+q*SC)/2, M+SC*(r*SQRT_3/2)),
-                                   (M+(WIDTH+(q+1)*SC)/2, M+SC*((r+1)*SQRT_3/2))],
-                                  BLACK)
-                    if self.__has_wall([r, q], S):
-                        draw.line([(M+(WIDTH+(q-1)*SC)/2, M+SC*((r+1)*SQRT_3/2)),
-                                   (M+(WIDTH+(q+1)*SC)/2, M+SC*((r+1)*SQRT_3/2))],
-                                  BLACK)
-                else:
-                    if self.__has_wall([r, q], E):
-                        draw.line([(M+(WIDTH+(q+1)*SC)/2, M+SC*(r*SQRT_3/2)),
-                                   (M+(WIDTH+q*SC)/2, M+SC*((r+1)*SQRT_3/2))],
-                                  BLACK)
-
-        del draw
-
-        path = f"./img/{filename}.png"
-        print(f"Writing maze to {path}")
-        image.save(f"{path}", 'PNG')
-
-    def carve_passages_from(self, cr, cq):
-        # We start out with `reverse_dir` == None.
-        stack = [(cr, cq, None)]
-
-        while stack:
-            # `reverse_dir` is the direction that takes you from the current cell
-            # to the cell that enqueued it. This is why we start out the stack
-            # with a None `reverse_dir`.
-            cr, cq, reverse_dir = stack.pop()
-            if self.__seen([cr, cq]):
-                continue
-            self.__mark_seen([cr, cq])
-
-            if reverse_dir:
-                pr, pq = cr + DR[reverse_dir], cq + DQ[reverse_dir]
-                prev_dir = OPPOSITE[reverse_dir]
-                self.grid[pr][pr+pq] |= prev_dir
-                self.grid[cr][cr+cq] |= reverse_dir
-
-            for nq, nr, new_dir in self.__neighbors([cr, cq]):
-                stack.append((nq, nr, OPPOSITE[new_dir]))
-
-    def generate(self):
-        self.carve_passages_from(0, 0) # topmost cell
+        # Cells are stored in one flat array, row r holding 2r + 1 cells. The
+        # grid is an array of per-row views into it.
+        self._allocate_cells([2*r + 1 for r in range(self.N)], cells)
+        self._attach_grid()
 
     '''
-    When the bitwise AND of a cell and a direction is 0 it means there is no
-    connection in that direction, which means there is a wall there. This method
-    assumes that `coords` is known to be in bounds.
+    Flat id of the cell at (r, q). Row r starts at flat index r^2, see the notes
+    at the bottom.
     '''
-    def __has_wall(self, coords, direction):
-        r, q = coords
-        return self.grid[r][r+q] & direction == 0
+    def cell_id(self, r, q):
+        return r*r + r + q
+
+    @classmethod
+    def _build_coordinates(cls, size):
+        n = size
+        r = np.repeat(np.arange(n, dtype=np.int32), 2*np.arange(n) + 1)
+        q = np.arange(n*n, dtype=np.int32) - r*r - r
+        return r, q
+
+    @classmethod
+    def _build_adjacency(cls, size):
+        n = size
+        r, q = cls._build_coordinates(size)
+        up = (r + q) % 2 == 0
+
+        # every cell has E and W; up cells also have S, down cells also have N
+        directions = [E, W, S, N]
+        table = np.empty((n*n, len(directions)), dtype=np.int32)
+        for k, direction in enumerate(directions):
+            nr, nq = r + DR[direction], q + DQ[direction]
+            inside = (0 <= nr) & (nr < n) & (-nr <= nq) & (nq <= nr)
+            if direction == S:
+                inside &= up
+            elif direction == N:
+                inside &= ~up
+            table[:, k] = np.where(inside, nr*nr + nr + nq, -1)
+
+        return Adjacency.from_table(table, directions, OPPOSITE)
 
-    def __seen(self, coords):
-        r, q = coords
-        return self.grid[r][r+q] & SEEN_MARKER != 0
+    '''
+    Print out the maze as text to `file` (default: standard output), see
+    `text_lines`.
+    '''
+    def render_to_text(self, file=None, style='ascii'):
+        with self._phase('text'):
+            text.write_lines(text_lines(self.grid, self.N, style), file)
+
+    @classmethod
+    def count_cells(cls, side):
+        return side*side
+
+    @classmethod
+    def image_size(cls, side):
+        width = int(side*cls.SC) # final row has width == N triangles
+        height = int(SQRT_3*width/2)
+        return width + 2*cls.M, height + 2*cls.M
+
+    def render_image(self, mode='L'):
+        width, height, polylines, segments = self.wall_geometry()
+        canvas = raster.new_canvas(width, height)
+        for points in polylines:
+            raster.draw_polyline(canvas, points)
+        raster.draw_segments(canvas, *segments)
+        self.instrumentation.count('walls_drawn', len(segments[0]))
+        return raster.to_image(canvas, mode)
+
+    def wall_geometry(self, owners=False):
+        SC, M = self.SC, self.M
+
+        width, height = self.image_size(self.N)
+        WIDTH, HEIGHT = width - 2*M, height - 2*M
+
+        # the boundary of the overall grid
+        boundary = [(M+WIDTH/2, M),
+                    (M, M+HEIGHT),
+                    (M+WIDTH, M+HEIGHT),
+                    (M+WIDTH/2, M)]
+
+        r, q = self.coordinates()
+        up = (r + q) % 2 == 0
+        east = self.cells & E == 0
+        south = self.cells & S == 0
+
+        # E walls of up cells, E walls of down cells and S walls of up cells,
+        # each as (which cells, q and r of one end, q and r of the other end).
+        # The coordinate expressions match the per-wall arithmetic they
+        # replaced so the truncated pixel coordinates come out identical.
+        walls = ((up & east, E, q, r, q+1, r+1),
+                 (~up & east, E, q+1, r, q, r+1),
+                 (up & south, S, q-1, r+1, q+1, r+1))
+
+        x0, y0, x1, y1 = [], [], [], []
+        cells, bits = [], []
+        for mask, bit, q0, r0, q1, r1 in walls:
+            x0.append(M+(WIDTH+q0[mask]*SC)/2)
+            y0.append(M+SC*(r0[mask]*SQRT_3/2))
+            x1.append(M+(WIDTH+q1[mask]*SC)/2)
+            y1.append(M+SC*(r1[mask]*SQRT_3/2))
+            cells.append(np.flatnonzero(mask))
+            bits.append(np.full(len(cells[-1]), bit, dtype=np.uint8))
+
+        segments = tuple(np.concatenate(v) for v in (x0, y0, x1, y1))
+        if owners:
+            walls = (np.concatenate(cells), np.concatenate(bits))
+            return width, height, [boundary], segments, walls
+        return width, height, [boundary], segments
+
+    '''
+    Generate a maze by carving out passages starting from cell (cr, cq). With
+    `events=True`, return a generator of carve events instead, see
+    `Maze.carve_events`.
+    '''
+    def carve_passages_from(self, cr, cq, events=False):
+        if events:
+            return self.carve_events(self.cell_id(cr, cq))
+        with self._phase('generate'):
+            generators.backtracker(self, self.cell_id(cr, cq))
+        self.invalidate()
+
+# Text glyphs, see `text.py`. Every up cell is drawn as two lines of four
+# characters, its W and E walls on the first and its W, S and E walls on the
+# second, looked up by those three bits:
+#      /\
+#     /__\
+# Down cells have no glyphs of their own: their walls are the walls of the up
+# cells around them and of the up cell above.
+def _up_cell(slash, backslash, underscore):
+    def glyph(bits):
+        w = slash if bits & W == 0 else ' '
+        e = backslash if bits & E == 0 else ' '
+        s = underscore if bits & S == 0 else ' '
+        return ' ' + w + e + ' ' + w + s + s + e
+    return glyph
+
+TEXT_CELLS = {
+    'ascii': text.lookup_table((W | E | S) + 1, 8, _up_cell('/', '\\', '_')),
+    'unicode': text.lookup_table((W | E | S) + 1, 8, _up_cell('╱', '╲', '▁')),
+}
 
-    def __mark_seen(self, coords):
-        r, q = coords
-        self.grid[r][r+q] |= SEEN_MARKER
+'''
+Generate the lines of text showing a triangle maze of side `side` in `style`
+(see `text.py`), two lines per row. `rows` is any iterable of rows, row r
+holding 2r + 1 cells, e.g. `TriangleMaze.grid`, and is consumed one row at a
+time.
+'''
+def text_lines(rows, side, style='ascii'):
+    text.check_style(style)
+    cells = TEXT_CELLS[style]
+    for r, row in enumerate(rows):
+        # up cells are the even positions of a row
+        glyphs = cells[np.asarray(row, dtype=np.uint8)[::2] & (W | E | S)]
+        indent = ' ' * (2*(side - r - 1))
+        yield (indent + text.decode(glyphs[:, :4])).rstrip()
+        yield (indent + text.decode(glyphs[:, 4:])).rstrip()
 
 '''
 Notes
@@ -180,6 +229,8 @@ each cell (r, q) has up to 3 neighbors
 if a cell points up, its neighbors are (r+1, q), (r, q+1), (r, q-1)
 if a cell points down, its neighbors are (r-1, q), (r, q+1), (r, q-1)
 
-storage is done as an array of arrays
+storage is done as one flat array with per-row offsets, viewed as an array of
+arrays
 to translate (r, q) to 2D array coords: (r, q) => (r, q+r)
+row r starts at flat index 1 + 3 + ... [r terms] = r^2, so (r, q) => r^2 + r + q
 '''
\ No newline at end of file